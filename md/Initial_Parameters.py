@@ -51,6 +51,10 @@ tau = 100
 #Switch Radius in Angstroem
 r_switch = r_cut_LJ*0.9
 
+#Skin Radius of the LJ neighbourlist in Angstroem
+#the neighbourlist is only rebuilt, when a particle moved further than r_skin/2
+r_skin = 0.1*r_cut_LJ
+
 #Number of itereations
 N_steps=20
 
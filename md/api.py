@@ -84,7 +84,8 @@ def api(N_steps, threshold, Energy_save, Frame_save,Temperature_save):
         dt,
         p_rea,
         p_error,
-        Symbols)
+        Symbols,
+        r_skin=ip.r_skin)
 
     MD.forces = MD.get_forces()
     MD.minmimize_Energy(N_steps=N_steps, threshold=threshold, Energy_save=Energy_save, Frame_save=Frame_save, path=cwd,
@@ -0,0 +1,261 @@
+'''
+Optional numba JIT backend for the neighbourlist search and the pair forces
+
+The kernels are written as plain loops over particles and pairs. If numba is
+installed they are compiled with numba.njit, otherwise the module still
+imports, the kernels stay (slow) python functions and select_backend falls
+back to the NumPy implementations.
+'''
+import os
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def jit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+def available_backends():
+    '''
+    Names of the backends that can be used in this environment.
+    '''
+    if numba is None:
+        return ('numpy',)
+    return ('numpy', 'numba')
+
+
+def select_backend(backend=None):
+    '''
+    Resolves the backend used by neighbourlist, coulomb and lennard_jones.
+
+    Parameters
+    ----------
+    backend : 'numpy', 'numba' or None, optional
+        Requested backend. None uses the environment variable MD_BACKEND and
+        'numpy' if it is not set. 'numba' falls back to 'numpy' if numba is
+        not installed.
+
+    Returns
+    -------
+    backend : 'numpy' or 'numba'
+    '''
+    if backend is None:
+        backend = os.environ.get('MD_BACKEND', 'numpy')
+    backend = backend.lower()
+    if backend not in ('numpy', 'numba'):
+        raise ValueError('Unknown backend: ' + str(backend))
+    if backend == 'numba' and numba is None:
+        return 'numpy'
+    return backend
+
+
+@jit
+def _scan_cells(R, box_length, r_cutoff, n_cells, cell, start, counts, offsets, half, out_p, out_q, out_s, fill):
+    '''
+    Loops over the offsets of the stencil, all particles and the particles in
+    the neighbouring cell, in the order of neighbourlist.compute_pairs. R and
+    cell are sorted by cell. Counts the pairs (fill=False) or writes the sorted
+    indices and the image shift of q to out_p, out_q, out_s (fill=True).
+    '''
+    N = R.shape[0]
+    r_cutoff_2 = r_cutoff * r_cutoff
+    n_pairs = 0
+    for o in range(offsets.shape[0]):
+        # without the half stencil every pair of cells shows up twice
+        check = not half or (offsets[o, 0] == 0 and offsets[o, 1] == 0 and offsets[o, 2] == 0)
+        for p in range(N):
+            nx = cell[p, 0] + offsets[o, 0]
+            ny = cell[p, 1] + offsets[o, 1]
+            nz = cell[p, 2] + offsets[o, 2]
+            sx = nx // n_cells
+            sy = ny // n_cells
+            sz = nz // n_cells
+            c = ((nx - sx * n_cells) * n_cells + ny - sy * n_cells) * n_cells + nz - sz * n_cells
+            for q in range(start[c], start[c] + counts[c]):
+                if check and p >= q:
+                    continue
+                dx = R[q, 0] + sx * box_length - R[p, 0]
+                dy = R[q, 1] + sy * box_length - R[p, 1]
+                dz = R[q, 2] + sz * box_length - R[p, 2]
+                if dx * dx + dy * dy + dz * dz <= r_cutoff_2:
+                    if fill:
+                        out_p[n_pairs] = p
+                        out_q[n_pairs] = q
+                        out_s[n_pairs, 0] = sx
+                        out_s[n_pairs, 1] = sy
+                        out_s[n_pairs, 2] = sz
+                    n_pairs += 1
+    return n_pairs
+
+
+def cell_list_pairs(R, box_length, r_cutoff):
+    '''
+    Cell list search for all pairs within the cutoff radius, same arguments
+    and results as neighbourlist.compute_pairs. It scans the same cell grid
+    and stencil (neighbourlist.cell_grid and cell_stencil), so the pairs are
+    returned in the same order.
+
+    Returns
+    -------
+    i, j : 1dim np.array, int
+        Indices of the pairs, each pair (and periodic image) once with i < j.
+    dr : 2dim np.array (pair, dim)
+        Displacement vector pointing from particle i to the image of j.
+    distances : 1dim np.array
+        Length of dr, all distances are <= r_cutoff.
+    '''
+    # neighbourlist imports this module, so the grid is imported on first use
+    from neighbourlist import cell_grid
+    from neighbourlist import cell_stencil
+    R = np.remainder(np.asarray(R, dtype=float), box_length)
+    N = np.shape(R)[0]
+    n_cells, r_c = cell_grid(box_length, r_cutoff)
+    offsets, half = cell_stencil(n_cells, r_c, r_cutoff)
+
+    cell = np.minimum((R / r_c).astype(np.int64), n_cells - 1)
+    cell_index = (cell[:, 0] * n_cells + cell[:, 1]) * n_cells + cell[:, 2]
+    # particles sorted by cell, the particles of cell c are order[start[c]:start[c]+counts[c]]
+    order = np.argsort(cell_index, kind='mergesort')
+    counts = np.bincount(cell_index, minlength=n_cells ** 3)
+    start = np.cumsum(counts) - counts
+    arguments = (np.ascontiguousarray(R[order]), float(box_length), float(r_cutoff), n_cells,
+                 np.ascontiguousarray(cell[order]), start, counts, offsets.astype(np.int64), half)
+
+    empty = np.zeros(0, dtype=np.int64)
+    n_pairs = _scan_cells(*arguments, empty, empty, np.zeros((0, 3), dtype=np.int64), False)
+    p = np.zeros(n_pairs, dtype=np.int64)
+    q = np.zeros(n_pairs, dtype=np.int64)
+    shift = np.zeros((n_pairs, 3), dtype=np.int64)
+    _scan_cells(*arguments, p, q, shift, True)
+    i = order[p]
+    j = order[q]
+    dr = R[j] + shift * box_length - R[i]
+
+    # return every pair as i < j, dr still points from i to j
+    swap = i > j
+    i[swap], j[swap] = j[swap], i[swap]
+    dr[swap] *= -1
+    return i, j, dr, np.linalg.norm(dr, axis=1)
+
+
+@jit
+def lj_pair_forces(positions, offsets, indices, half, L, species, sig6, epsilon, switch_parameter, r_switch):
+    '''
+    LJ forces of all entries of a csr neighbourlist, see lennard_jones.compute_forces.
+
+    Parameters
+    ----------
+    positions : N x 3 Array
+    offsets, indices : 1D int Arrays
+        csr arrays of the neighbourlist
+    half : bool
+        If True, every pair is stored once and both particles get its force.
+    L : 3x1 Array
+        Dimensions of the simulation box
+    species : 1D int Array
+        species (0 or 1) of every particle
+    sig6, epsilon : 3x1 Arrays
+        sigma**6 and epsilon of the species pairs AA, AB, BB
+    switch_parameter : 1D Array
+        Coefficients of the switch polynomial, lowest order first.
+    r_switch : float
+        Distance where the switch function kicks in.
+
+    Returns
+    -------
+    forces : N x 3 Array
+    '''
+    N = positions.shape[0]
+    forces = np.zeros((N, 3))
+    n_switch = switch_parameter.shape[0]
+    for i in range(N):
+        for entry in range(offsets[i], offsets[i + 1]):
+            j = indices[entry]
+            dx = positions[j, 0] - positions[i, 0]
+            dy = positions[j, 1] - positions[i, 1]
+            dz = positions[j, 2] - positions[i, 2]
+            dx -= L[0] * round(dx / L[0])
+            dy -= L[1] * round(dy / L[1])
+            dz -= L[2] * round(dz / L[2])
+            dist_2 = dx * dx + dy * dy + dz * dz
+            index = species[i] + species[j]
+            ratio = sig6[index] / (dist_2 * dist_2 * dist_2)
+            eps = epsilon[index]
+            dV_r = -24 * eps * (2 * ratio * ratio - ratio) / dist_2
+            if dist_2 >= r_switch * r_switch:
+                dist = math.sqrt(dist_2)
+                S = 0.0
+                dS = 0.0
+                # Horner scheme for S and dS/dr
+                for k in range(n_switch - 1, -1, -1):
+                    dS = dS * dist + S
+                    S = S * dist + switch_parameter[k]
+                potential = 4 * eps * (ratio * ratio - ratio)
+                dV_r = dV_r * S + potential * dS / dist
+            forces[i, 0] += dV_r * dx
+            forces[i, 1] += dV_r * dy
+            forces[i, 2] += dV_r * dz
+            if half:
+                forces[j, 0] -= dV_r * dx
+                forces[j, 1] -= dV_r * dy
+                forces[j, 2] -= dV_r * dz
+    return forces
+
+
+@jit
+def coulomb_pair_forces(positions, offsets, indices, half, L, charges, std, constant):
+    '''
+    Short range coulomb forces of all entries of a csr neighbourlist, see
+    coulomb.compute_forces with a neighbourlist.
+
+    Parameters
+    ----------
+    positions : N x 3 Array
+    offsets, indices : 1D int Arrays
+        csr arrays of the neighbourlist
+    half : bool
+        If True, every pair is stored once and both particles get its force.
+    L : 3x1 Array
+        Dimensions of the simulation box
+    charges : 1D Array
+    std : float
+        Standard deviation of the gaussian charge distribution
+    constant : float
+        1/(8 pi epsilon0)
+
+    Returns
+    -------
+    forces : N x 3 Array
+    '''
+    N = positions.shape[0]
+    forces = np.zeros((N, 3))
+    for i in range(N):
+        for entry in range(offsets[i], offsets[i + 1]):
+            j = indices[entry]
+            dx = positions[j, 0] - positions[i, 0]
+            dy = positions[j, 1] - positions[i, 1]
+            dz = positions[j, 2] - positions[i, 2]
+            dx -= L[0] * round(dx / L[0])
+            dy -= L[1] * round(dy / L[1])
+            dz -= L[2] * round(dz / L[2])
+            r2 = dx * dx + dy * dy + dz * dz
+            r = math.sqrt(r2)
+            coefficient = constant * charges[i] * charges[j] / r2 * (
+                math.erfc(r / math.sqrt(2.0) / std) / r
+                + math.sqrt(2.0 / math.pi) / std * math.exp(-r2 / 2.0 / std ** 2))
+            # force on i points along r_i - r_j
+            forces[i, 0] -= coefficient * dx
+            forces[i, 1] -= coefficient * dy
+            forces[i, 2] -= coefficient * dz
+            if half:
+                forces[j, 0] += coefficient * dx
+                forces[j, 1] += coefficient * dy
+                forces[j, 2] += coefficient * dz
+    return forces
@@ -0,0 +1,148 @@
+'''
+Timings of the neighbourlist search and the short range forces for the
+available backends, and strong scaling of the parallel pair engine
+
+usage: python benchmark.py [N ...]
+       python benchmark.py scaling [N [thread|process]]
+'''
+import sys
+import time
+import numpy as np
+from backend import available_backends
+from neighbourlist import neighbourlist
+from particle_interaction import coulomb
+from particle_interaction import lennard_jones
+from pair_displacements import pair_displacements
+from pair_engine import pair_engine
+from parallel import parallel_pair_engine
+
+
+def best_time(function, repeat=3):
+    '''
+    Shortest wall time of repeat calls of function.
+    '''
+    times = []
+    for n in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def random_system(N, density):
+    '''
+    Random positions and alternating +1/-1 labels of N particles at the given density.
+    '''
+    box_length = (N / float(density)) ** (1 / 3.0)
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:, 1] = np.where(np.arange(N) % 2 == 0, 1.0, -1.0)
+    labels[:, 2] = np.arange(N) % 2
+    return R, labels, box_length
+
+
+def run(N_list=(1000, 8000), density=0.04, r_cut=5.0, repeat=3):
+    '''
+    Times compute_csr_neighbourlist, lennard_jones.compute_forces and the short
+    range coulomb forces on a neighbourlist for random ionic configurations.
+
+    Parameters
+    ----------
+    N_list : list of int
+        Numbers of particles.
+    density : float
+        Particles per volume, sets the box length.
+    r_cut : float
+        Cutoff radius of the neighbourlist.
+    repeat : int
+        Every timing is the best of repeat runs, after one warm up call that
+        also triggers the JIT compilation.
+
+    Returns
+    -------
+    timings : dictionary
+        timings[(backend, N)] = (t_neighbourlist, t_LJ, t_coulomb) in seconds
+    '''
+    timings = {}
+    for N in N_list:
+        R, labels, box_length = random_system(N, density)
+        L = np.array([box_length] * 3)
+        sigma = np.array([2.5, 2.8, 3.1])
+        epsilon = np.array([0.1, 0.1, 0.1])
+        switch_parameter = np.array([1.0, 0.0, 0.0, 0.0])
+        for backend in available_backends():
+            search = neighbourlist(backend)
+            LJ = lennard_jones(backend)
+            # a minimal k_list, so the time is dominated by the short range part
+            C = coulomb(1, L, 10.0, k_cut=2.5 * np.pi / box_length, backend=backend)
+            neighbours = search.compute_csr_neighbourlist(R, box_length, r_cut, half=True)
+            d_Pos = pair_displacements(R)
+
+            def lj_forces():
+                return LJ.compute_forces(R, sigma, epsilon, labels, L, switch_parameter, 0.9 * r_cut, neighbours)
+
+            def coulomb_forces():
+                return C.compute_forces(d_Pos, labels, L, neighbours)
+
+            for function in (lj_forces, coulomb_forces):
+                function()
+            timings[(backend, N)] = (
+                best_time(lambda: search.compute_csr_neighbourlist(R, box_length, r_cut, half=True), repeat),
+                best_time(lj_forces, repeat),
+                best_time(coulomb_forces, repeat))
+    return timings
+
+
+def run_scaling(N=32000, n_workers_list=(1, 2, 4, 8, 16, 32), executor='thread', density=0.04, repeat=3):
+    '''
+    Strong scaling of parallel_pair_engine: fixed system size, growing number of workers.
+
+    Returns
+    -------
+    timings : dictionary
+        timings[n_workers] = seconds per evaluation of the LJ and real space coulomb
+        forces, timings[0] is the serial pair_engine
+    '''
+    R, labels, box_length = random_system(N, density)
+    L = np.array([box_length] * 3)
+    C = coulomb(1, L, 10.0)
+    C.std = 1.5
+    engine = pair_engine(C, np.array([2.5, 2.8, 3.1]), np.array([0.1, 0.1, 0.1]), np.array([1.0, 0.0, 0.0, 0.0]),
+                         4.5, 5.0, 6.0)
+    neighbours = neighbourlist().compute_csr_neighbourlist(R, box_length, engine.r_cut, half=True)
+    timings = {0: best_time(lambda: engine.compute(R, labels, L, neighbours), repeat)}
+    for n_workers in n_workers_list:
+        parallel = parallel_pair_engine(engine, labels, n_workers, executor)
+        # the first call starts the pool
+        parallel.compute(R, labels, L, neighbours)
+        timings[n_workers] = best_time(lambda: parallel.compute(R, labels, L, neighbours), repeat)
+        parallel.close()
+    return timings
+
+
+def print_scaling(N, executor):
+    timings = run_scaling(N, executor=executor)
+    print('strong scaling of the pair forces, N = %d, %s pool' % (N, executor))
+    print('%8s %10s %8s %10s' % ('workers', 'time', 'speedup', 'efficiency'))
+    print('%8s %9.4fs' % ('serial', timings[0]))
+    for n_workers in sorted(timings):
+        if n_workers > 0:
+            speedup = timings[0] / timings[n_workers]
+            print('%8d %9.4fs %7.2fx %9.0f%%' % (n_workers, timings[n_workers], speedup, 100 * speedup / n_workers))
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ['scaling']:
+    print_scaling(int(sys.argv[2]) if len(sys.argv) > 2 else 32000, sys.argv[3] if len(sys.argv) > 3 else 'thread')
+elif __name__ == '__main__':
+    N_list = [int(N) for N in sys.argv[1:]] or [1000, 8000]
+    timings = run(N_list)
+    print('%8s %8s %14s %10s %10s' % ('backend', 'N', 'neighbourlist', 'LJ', 'coulomb'))
+    for N in N_list:
+        for backend in available_backends():
+            t = timings[(backend, N)]
+            print('%8s %8d %13.4fs %9.4fs %9.4fs' % (backend, N, t[0], t[1], t[2]))
+        if 'numba' in available_backends():
+            speedup = np.array(timings[('numpy', N)]) / np.array(timings[('numba', N)])
+            print('%8s %8d %13.1fx %9.1fx %9.1fx' % ('speedup', N, speedup[0], speedup[1], speedup[2]))
+    if 'numba' not in available_backends():
+        print('numba is not installed, only the numpy backend was timed')
@@ -0,0 +1,85 @@
+'''
+Checkpoint files with the full state of a simulation
+
+A checkpoint is an uncompressed numpy .npz archive (a zip file of .npy
+arrays) with the entry 'format' = _FORMAT. The values are stored with their
+full precision, so a simulation restored from a checkpoint continues bit for
+bit. The scalar options of the simulation are kept as one JSON string in the
+entry 'options'.
+
+A checkpoint is written to a temporary file next to the target, which then
+replaces the target (os.replace). If the program is killed while writing, the
+previous checkpoint stays intact.
+'''
+import os
+import json
+import numpy as np
+
+_FORMAT = 'md-checkpoint-1'
+
+
+def get_random_state():
+    '''
+    State of the global numpy random generator, which is used by the Andersen
+    thermostat and maxwellboltzmann, as dictionary of arrays.
+    '''
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    return {'random_keys': keys, 'random_position': np.int64(position),
+            'random_has_gauss': np.int64(has_gauss), 'random_cached_gaussian': np.float64(cached_gaussian)}
+
+
+def set_random_state(state):
+    '''
+    Restores the global numpy random generator from get_random_state.
+    '''
+    np.random.set_state(('MT19937', np.asarray(state['random_keys'], dtype=np.uint32),
+                         int(state['random_position']), int(state['random_has_gauss']),
+                         float(state['random_cached_gaussian'])))
+    return
+
+
+def write_checkpoint(path, arrays, options):
+    '''
+    Atomically writes a checkpoint.
+
+    Parameters
+    ----------
+    path : string
+        Checkpoint file, it is replaced if it exists.
+
+    arrays : dictionary
+        Arrays and numbers, None values are left out.
+
+    options : dictionary
+        Numbers, strings, bools and None, stored as JSON.
+    '''
+    entries = {'format': np.array(_FORMAT), 'options': np.array(json.dumps(options))}
+    for key, value in arrays.items():
+        if value is not None:
+            entries[key] = np.asarray(value)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file_object:
+        np.savez(file_object, **entries)
+        file_object.flush()
+        os.fsync(file_object.fileno())
+    os.replace(temporary, path)
+    return
+
+
+def read_checkpoint(path):
+    '''
+    Reads a checkpoint written by write_checkpoint.
+
+    Returns
+    -------
+    arrays : dictionary
+        The arrays, missing entries were None.
+
+    options : dictionary
+    '''
+    with np.load(path, allow_pickle=False) as archive:
+        if 'format' not in archive.files or str(archive['format']) != _FORMAT:
+            raise ValueError('not a checkpoint file: ' + str(path))
+        arrays = {key: archive[key] for key in archive.files if key not in ('format', 'options')}
+        options = json.loads(str(archive['options']))
+    return arrays, options
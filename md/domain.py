@@ -0,0 +1,370 @@
+'''
+Spatial domain decomposition over several processes or nodes
+
+The box is split into slabs along x, which are contiguous layers of the cell
+grid of the neighbourlist (see neighbourlist.cell_grid). Every rank owns the
+particles of its slab, receives copies of the particles within the cutoff of
+its slab from the other ranks (ghosts) and hands particles over, when they
+cross a slab boundary. All communication goes through a transport:
+mpi_transport for MPI jobs and pipe_transport for processes on one machine.
+'''
+import threading
+import numpy as np
+from multiprocessing import Pipe
+from multiprocessing import Process
+from neighbourlist import cell_grid
+from neighbourlist import neighbourlist
+from parallel import slab_index
+from reciprocal import structure_factor
+from distribution import maxwellboltzmann
+
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+
+class transport(object):
+    '''
+    Interface of the communication between the ranks of a domain decomposition.
+
+    Attributes
+    ----------
+    rank : int
+        Index of this process.
+    size : int
+        Number of processes.
+    '''
+
+    def alltoall(self, objects):
+        '''
+        Sends objects[d] to rank d and returns the list of the objects received
+        from all ranks, in rank order. objects[rank] is returned unchanged.
+        '''
+        raise NotImplementedError
+
+    def allgather(self, value):
+        '''
+        List of the values of all ranks, in rank order.
+        '''
+        return self.alltoall([value] * self.size)
+
+    def allreduce(self, value):
+        '''
+        Sum of value over all ranks. The values are added in rank order, so all
+        ranks get bitwise the same result.
+        '''
+        values = self.allgather(value)
+        total = values[0]
+        for v in values[1:]:
+            total = total + v
+        return total
+
+
+class mpi_transport(transport):
+    '''
+    Transport over an MPI communicator, needs mpi4py.
+
+    Parameters
+    ----------
+    comm : MPI communicator, optional
+        Default is MPI.COMM_WORLD.
+    '''
+
+    def __init__(self, comm=None):
+        if MPI is None:
+            raise ImportError('mpi_transport needs mpi4py')
+        self.comm = MPI.COMM_WORLD if comm is None else comm
+        self.rank = self.comm.Get_rank()
+        self.size = self.comm.Get_size()
+        return
+
+    def alltoall(self, objects):
+        return self.comm.alltoall(objects)
+
+    def allgather(self, value):
+        return self.comm.allgather(value)
+
+
+class pipe_transport(transport):
+    '''
+    Transport between processes on one machine over multiprocessing pipes,
+    a stand-in for mpi_transport. Use create or spawn to set up all ranks.
+
+    Every ordered pair of ranks has its own one-way pipe. The messages of
+    alltoall are sent by a background thread while the receiving side reads
+    them, so large messages can not dead lock.
+
+    Parameters
+    ----------
+    rank : int
+
+    senders : list of Connections
+        senders[d] sends to rank d (None for d = rank)
+
+    receivers : list of Connections
+        receivers[s] receives from rank s (None for s = rank)
+    '''
+
+    def __init__(self, rank, senders, receivers):
+        self.rank = rank
+        self.size = len(senders)
+        self.senders = senders
+        self.receivers = receivers
+        return
+
+    @classmethod
+    def create(cls, size):
+        '''
+        Transports of all size ranks, to be handed to one process each.
+        '''
+        senders = [[None] * size for rank in range(size)]
+        receivers = [[None] * size for rank in range(size)]
+        for source in range(size):
+            for dest in range(size):
+                if source != dest:
+                    receivers[dest][source], senders[source][dest] = Pipe(duplex=False)
+        return [cls(rank, senders[rank], receivers[rank]) for rank in range(size)]
+
+    @classmethod
+    def spawn(cls, size, function, *args):
+        '''
+        Runs function(transport, *args) in size processes and returns their
+        results in rank order.
+        '''
+        transports = cls.create(size)
+        results = [Pipe(duplex=False) for rank in range(size)]
+        processes = [Process(target=_run_rank, args=(function, transports[rank], args, results[rank][1]))
+                     for rank in range(size)]
+        for process in processes:
+            process.start()
+        values = [result[0].recv() for result in results]
+        for process in processes:
+            process.join()
+        for value in values:
+            if isinstance(value, BaseException):
+                raise value
+        return values
+
+    def alltoall(self, objects):
+        def send():
+            for dest in range(self.size):
+                if dest != self.rank:
+                    self.senders[dest].send(objects[dest])
+        sender = threading.Thread(target=send)
+        sender.start()
+        received = [objects[self.rank] if source == self.rank else self.receivers[source].recv()
+                    for source in range(self.size)]
+        sender.join()
+        return received
+
+
+def _run_rank(function, rank_transport, args, result):
+    try:
+        value = function(rank_transport, *args)
+    except Exception as error:
+        value = error
+    result.send(value)
+    result.close()
+    return
+
+
+class domain_decomposition(object):
+    '''
+    Velocity Verlet propagation (as dynamics.velocity_verlet_integrator) of the
+    particles of one slab of the box, run by every rank of the transport.
+
+    Forces, energy and virial follow md.get_forces_energy_virial. The LJ and
+    real space coulomb pairs are evaluated by the pair engine for the owned
+    particles and their ghosts. The reciprocal space part uses the Ewald sum
+    with the structure factor: every rank computes S(k) of its particles, the
+    sum over all ranks gives the forces on the owned particles and the energy.
+
+    Parameters
+    ----------
+    transport : transport
+
+    pair_engine : pair_engine
+
+    coulomb : coulomb
+        Provides k_list, std, epsilon0 of the reciprocal space sum.
+
+    L : 3x1 Array
+        Dimensions of the simulation box.
+
+    positions, velocities, labels : N x 3 Arrays
+        The whole system, every rank keeps the particles of its slab.
+
+    seed : int, optional
+        If given, the random numbers of the thermostat of a rank are seeded with seed + rank.
+    '''
+
+    def __init__(self, transport, pair_engine, coulomb, L, positions, velocities, labels, seed=None):
+        self.transport = transport
+        self.pair_engine = pair_engine
+        self.coulomb = coulomb
+        self.L = np.asarray(L, dtype=float)
+        self.r_cut = pair_engine.r_cut
+        self.n_cells, self.r_c = cell_grid(self.L[0], self.r_cut)
+        if transport.size > self.n_cells:
+            raise ValueError('%d domains for %d cell layers, use fewer domains' % (transport.size, self.n_cells))
+        # x range of the slab of every rank, see parallel.slab_index
+        first_cell = -(-np.arange(transport.size + 1) * self.n_cells // transport.size)
+        self.bounds = first_cell * self.r_c
+        if seed is not None:
+            np.random.seed(seed + transport.rank)
+
+        positions = np.remainder(np.asarray(positions, dtype=float), self.L)
+        mine = self.owner(positions) == transport.rank
+        self.ids = np.where(mine)[0]
+        self.positions = positions[mine]
+        self.velocities = np.array(velocities, dtype=float)[mine]
+        self.labels = np.array(labels, dtype=float)[mine]
+        # the self energy of the Ewald sum only depends on the charges of all particles
+        self.self_energy = coulomb.compute_self_energy(np.asarray(labels)[:, 1])
+        self.reciprocal_sum = structure_factor(coulomb.k_list, coulomb.std, coulomb.volume, coulomb.epsilon0,
+                                               coulomb.box_length)
+        self.forces, self.energy, self.virial = self.compute_forces()
+        return
+
+    @classmethod
+    def from_md(cls, md_object, transport, seed=None):
+        '''
+        Decomposition of the system and the interactions of an md object.
+        '''
+        return cls(transport, md_object.pair_engine, md_object.coulomb, md_object.L, md_object.positions,
+                   md_object.velocities, md_object.labels, seed)
+
+    def owner(self, positions):
+        '''
+        Rank of the slab of every position.
+        '''
+        return slab_index(positions, self.L[0], self.r_cut, self.transport.size)
+
+    def exchange_halo(self):
+        '''
+        Sends every rank the owned particles within r_cut of its slab.
+
+        Returns
+        -------
+        positions, labels : Arrays of the ghost particles
+        '''
+        x = self.positions[:, 0]
+        messages = []
+        for rank in range(self.transport.size):
+            if rank == self.transport.rank:
+                messages.append(None)
+                continue
+            lo, hi = self.bounds[rank], self.bounds[rank + 1]
+            # periodic distance along x to the slab [lo, hi)
+            dx = np.remainder(x - lo, self.L[0])
+            distance = np.where(dx < hi - lo, 0.0, np.minimum(dx - (hi - lo), self.L[0] - dx))
+            halo = distance <= self.r_cut
+            messages.append((self.positions[halo], self.labels[halo]))
+        received = [message for rank, message in enumerate(self.transport.alltoall(messages))
+                    if rank != self.transport.rank]
+        if len(received) == 0:
+            return np.zeros((0, 3)), np.zeros((0, np.shape(self.labels)[1]))
+        return np.concatenate([m[0] for m in received]), np.concatenate([m[1] for m in received])
+
+    def migrate(self):
+        '''
+        Hands the particles that left the slab over to their new rank.
+        '''
+        owner = self.owner(self.positions)
+        arrays = (self.ids, self.positions, self.velocities, self.forces, self.labels)
+        messages = [tuple(a[owner == rank] for a in arrays) for rank in range(self.transport.size)]
+        received = self.transport.alltoall(messages)
+        self.ids, self.positions, self.velocities, self.forces, self.labels = [
+            np.concatenate([message[n] for message in received]) for n in range(len(arrays))]
+        return
+
+    def compute_forces(self):
+        '''
+        Forces on the owned particles and the energy and virial of the whole system.
+
+        Returns
+        -------
+        forces : N_owned x 3 Array
+        energy : float
+        virial : 3 x 3 Array
+        '''
+        n_owned = np.shape(self.positions)[0]
+        ghost_positions, ghost_labels = self.exchange_halo()
+        positions = np.concatenate((self.positions, ghost_positions))
+        labels = np.concatenate((self.labels, ghost_labels))
+
+        # full list, only the rows of the owned particles: a pair with a ghost
+        # counts half here and half on the rank that owns the ghost
+        neighbours = neighbourlist().compute_csr_neighbourlist(positions, self.L[0], self.r_cut)
+        i = neighbours.rows()
+        owned = i < n_owned
+        forces, energy, virial = self.pair_engine.compute_pairs(positions, labels, self.L, i[owned],
+                                                                neighbours.indices[owned], False)
+        forces = forces[:n_owned]
+
+        # S(k) is a sum over the particles, the partial sums of all ranks are added up
+        self.reciprocal_sum.compute(self.labels[:, 1], self.positions)
+        self.reciprocal_sum.S = self.transport.allreduce(self.reciprocal_sum.S)
+        forces = forces + self.reciprocal_sum.compute_forces()
+
+        energy = self.transport.allreduce(energy)
+        virial = self.transport.allreduce(virial)
+        energy += self.reciprocal_sum.compute_energy() - self.self_energy
+        virial = virial + self.reciprocal_sum.compute_virial()
+        return forces, energy, virial
+
+    def step(self, dt, T=None, p_rea=0):
+        '''
+        One velocity Verlet step with the optional Andersen thermostat, see
+        dynamics.velocity_verlet_integrator.
+
+        Parameters
+        ----------
+        dt : float
+            Timestep.
+        T : float, optional
+            Temperature of the thermostat, no thermostat if None.
+        p_rea : float, optional
+            Reassignment probability of the thermostat.
+        '''
+        m = self.labels[:, 0][:, np.newaxis]
+        self.positions = np.remainder(self.positions + self.velocities * dt + self.forces / m * dt ** 2, self.L)
+        self.migrate()
+        # the old forces, masses and velocities moved with the particles
+        forces_old = self.forces
+        m = self.labels[:, 0][:, np.newaxis]
+        forces_new, self.energy, self.virial = self.compute_forces()
+        self.velocities = self.velocities + (forces_old + forces_new) / (2 * m) * dt
+        self.forces = forces_new
+        if T is not None:
+            indexes = np.where(np.random.uniform(size=len(self.ids)) < p_rea)[0]
+            if len(indexes) > 0:
+                self.velocities[indexes] = maxwellboltzmann().sample_distribution(N=len(indexes),
+                                                                                  m=self.labels[indexes, 0], T=T)
+        return
+
+    def run(self, N_steps, dt, T=None, p_rea=0, Energy_save=1):
+        '''
+        Propagates the system by N_steps steps.
+
+        Returns
+        -------
+        energies : list of float
+            Total (potential) energy after every Energy_save steps, the same on all ranks.
+        '''
+        energies = []
+        for n in range(1, N_steps + 1):
+            self.step(dt, T, p_rea)
+            if n % Energy_save == 0:
+                energies.append(self.energy)
+        return energies
+
+    def gather(self):
+        '''
+        Positions, velocities and forces of all particles, in the original order.
+        '''
+        parts = self.transport.allgather((self.ids, self.positions, self.velocities, self.forces))
+        ids = np.concatenate([p[0] for p in parts])
+        order = np.argsort(ids)
+        return tuple(np.concatenate([p[n] for p in parts])[order] for n in (1, 2, 3))
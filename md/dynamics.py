@@ -4,6 +4,7 @@ from particle_interaction import coulomb
 from particle_interaction import lennard_jones
 from distribution import maxwellboltzmann
 from neighbourlist import neighbourlist
+from pair_displacements import pair_displacements
 
 class dynamics(object):
 
@@ -26,20 +27,29 @@ class dynamics(object):
                                    p_rea,
                                    coulomb,
                                    lennard_jones,
-                                   d_Pos,
-                                   thermostat):
+                                   thermostat,
+                                   neighbours_coulomb=None,
+                                   force_engine=None):
         ''' The Verlocity Verlet Integrator
         Parameters:
         --------------
         thermostat: bool
             if True, sampling takes place in the NVT ensemble
             else sampling takes place in the NVE ensemble.
+        neighbours_coulomb: csr_neighbourlist, optional
+            if given, the short range coulomb forces are only evaluated for these pairs.
+        force_engine: callable, optional
+            force_engine(Positions) returns forces, energy and virial of the given positions
+            in one evaluation (see md.get_forces_energy_virial). If given, it replaces the
+            separate coulomb and lennard_jones force calls and the energy and virial of the
+            new positions are returned as well.
             
         Returns:
         -------------
         Updated Positions
         Updated Velocities
         Updated Forces
+        Energy and Virial of the updated Positions, as returned by force_engine (None without force_engine)
         '''       
 
         Forces_old = Forces
@@ -55,17 +65,22 @@ class dynamics(object):
         Positions_new[:,2] = np.remainder(Positions_new[:,2],L[2])
         
         
-        Forces_new = coulomb.compute_forces(d_Pos,
-            Labels,
-            L)+lennard_jones.compute_forces(
-            Positions_new,
-            Sigma, 
-            Epsilon, 
-            Labels,
-            L, 
-            switch_parameter, 
-            r_switch,
-            neighbours_LJ)
+        Energy_new, Virial_new = None, None
+        if force_engine is not None:
+            Forces_new, Energy_new, Virial_new = force_engine(Positions_new)
+        else:
+            Forces_new = coulomb.compute_forces(pair_displacements(Positions_new),
+                Labels,
+                L,
+                neighbours_coulomb)+lennard_jones.compute_forces(
+                Positions_new,
+                Sigma, 
+                Epsilon, 
+                Labels,
+                L, 
+                switch_parameter, 
+                r_switch,
+                neighbours_LJ)
         
         Velocities_new = Velocities + (Forces_old+Forces_new)/(2*(np.outer(Labels[:,0],np.ones(3))))*dt
         
@@ -85,10 +100,7 @@ class dynamics(object):
                 #Reassign a new Velocity to the Correspoding Particles
                 Velocities_new[indexes] = maxwellboltzmann().sample_distribution(N = np.size(indexes), m = m[indexes], T=T)        
 
-            return Positions_new, Velocities_new, Forces_new
-        
-        else:
-            return Positions_new, Velocities_new, Forces_new
+        return Positions_new, Velocities_new, Forces_new, Energy_new, Virial_new
     
     def Thermometer(self, Labels, Velocities,kB=0.0001987191):
         
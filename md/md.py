@@ -4,11 +4,29 @@ Class for the Molecular Dynamics Simulation
 import numpy as np
 import PSE
 from neighbourlist import neighbourlist
+from neighbourlist import verlet_neighbourlist
+from pair_displacements import pair_displacements
+from pair_engine import pair_engine
+from tables import pair_tables
+from backend import select_backend
+from parallel import parallel_pair_engine
 from particle_interaction import coulomb
 from particle_interaction import lennard_jones
 from dynamics import dynamics
+from trajectory import trajectory_writer
+from trajectory import export_xyz
+from trajectory import open_trajectory
+from trajectory import hdf5_writer
+from output import output_pipeline
+from output import trajectory_output
+from output import rdf_output
+from checkpoint import write_checkpoint
+from checkpoint import read_checkpoint
+from checkpoint import get_random_state
+from checkpoint import set_random_state
 from scipy.constants import epsilon_0
 import sys
+import os
 PSE = PSE.PSE
 
 class System(object):
@@ -153,6 +171,62 @@ class md(object):
         p_rea: float
              Reassingment probability. Denotes the coupling strength to the thermostat. It is the probability with which a particle will undergo a velocity reassignment. 
 
+        r_skin: float, optional
+            Skin radius of the Verlet neighbourlist for the LJ interaction. The list is only rebuilt,
+            if a particle moved further than r_skin/2. Default is 0.1*r_cut_LJ.
+
+        half_neighbourlist: bool, optional
+            If True, the neighbourlists store every pair only once (i<j) and the interactions
+            are accumulated for both particles (Newton's third law). Default is False.
+
+        reciprocal: 'ewald' or 'spme', optional
+            Method for the reciprocal space part of the coulomb interaction, the direct
+            sum over all k-vectors or Smooth Particle Mesh Ewald. Default is 'ewald'.
+
+        fused_pairs: bool, optional
+            If True, the integrator evaluates LJ and real space coulomb interaction in one
+            pass over a shared neighbourlist (see pair_engine) and gets the energy and the
+            virial of every step with the forces. Default is False.
+
+        tables: 'cubic' or 'linear', optional
+            If given, the pair engine looks the LJ and real space coulomb pair functions up in
+            interpolation tables versus r^2 (see tables.pair_tables) instead of evaluating them
+            analytically. The tables are built once from std, r_switch, the cutoffs, Sigma_LJ
+            and Epsilon_LJ. Tables switch on fused_pairs. Default is None, no tables.
+
+        table_points: int, optional
+            Resolution (number of grid points) of every table. Default is 4096.
+
+        table_tolerance: float, optional
+            Largest accepted relative error of the tables in the self-check against the
+            analytic pair functions, a ValueError is raised otherwise. Default is 1e-6.
+
+        backend: 'numpy' or 'numba', optional
+            Implementation of the neighbourlist search and the LJ and short range coulomb forces,
+            'numba' uses JIT compiled loops if numba is installed (see backend.py). Default is
+            the environment variable MD_BACKEND or 'numpy'.
+
+        n_workers: int, optional
+            Number of workers for the LJ and real space coulomb forces. With more than one
+            worker the pairs are evaluated by the pair engine (as with fused_pairs=True) in
+            spatial slabs in parallel, see parallel.parallel_pair_engine. Default is 1.
+
+        executor: 'thread' or 'process', optional
+            Pool of the workers, threads or processes with shared memory. Default is 'thread'.
+
+        k_workers: int, optional
+            Number of worker processes for the 'ewald' reciprocal sum. With more than one, the
+            k-vectors are split over a process pool, see parallel.sharded_structure_factor.
+            Default is 1.
+
+        The worker pools are started when they are first used and stopped by close (or at
+        the end of a with block). A copy (copy.deepcopy, pickle) starts its own pools.
+
+        cutoffs: (r_cut_coulomb, k_cut) or (r_cut_coulomb, k_cut, k_list), optional
+            Cutoffs of the real and the reciprocal space coulomb sum of an earlier run, e.g.
+            of a checkpoint (see from_checkpoint). The timing run of
+            coulomb.compute_optimal_cutoff is skipped. Default is None, the cutoffs are optimized.
+
     Returns
     -------
         nothing
@@ -172,23 +246,35 @@ class md(object):
                  dt,
                  p_rea,
                  p_error,
-                 Symbols):
+                 Symbols,
+                 r_skin=None,
+                 half_neighbourlist=False,
+                 reciprocal='ewald',
+                 fused_pairs=False,
+                 tables=None,
+                 table_points=4096,
+                 table_tolerance=1e-6,
+                 backend=None,
+                 n_workers=1,
+                 executor='thread',
+                 k_workers=1,
+                 cutoffs=None):
         #check input parameters
+        # forces, energy and virial of the current configuration, see get_forces
+        self.positions_version = -1
+        self.__results = {'version': None}
+        self.__pending = None
         self.positions=positions
         self.R=np.linalg.norm(self.positions, axis=1)
         self.N = np.size(self.positions[:,0])
-        first_d_Pos = np.zeros((self.N,self.N,3))
-        first_d_Pos[:,:,0] = np.subtract.outer(self.positions[:,0], self.positions[:,0])
-        first_d_Pos[:,:,1] = np.subtract.outer(self.positions[:,1], self.positions[:,1])
-        first_d_Pos[:,:,2] = np.subtract.outer(self.positions[:,2], self.positions[:,2])
-        self.d_Pos = first_d_Pos
         self.labels=properties
         self.velocities = velocities
         self.forces = forces
         self.L=box
         self.T= Temperature
         
-        self.lennard_jones = lennard_jones()
+        self.backend = select_backend(backend)
+        self.lennard_jones = lennard_jones(self.backend)
         self.Sigma_LJ = Sigma_LJ
         self.Epsilon_LJ = Epsilon_LJ
         
@@ -199,23 +285,75 @@ class md(object):
 
         self.r_switch = r_switch
         self.r_cut_LJ = r_cut_LJ
+        self.half_neighbourlist = half_neighbourlist
 
         # epsilon0 = (8.854 * 10^-12) / (36.938 * 10^-9) -> see Dimension Analysis
-        self.coulomb = coulomb(n_boxes_short_range, box, p_error, epsilon0 = epsilon_0 / (36.938 * 10**-9))
-
-        self.neighbours_coulomb, self.distances_coulomb = neighbourlist().compute_neighbourlist(positions, box[0],
-                                                                                                0.49 * box[0])
-        self.r_cut_coulomb, self.k_cut, self.std = self.coulomb.compute_optimal_cutoff(p_error, box, properties, self.neighbours_coulomb, self.distances_coulomb, r_switch, 0.49 * box[0], positions)
-        self.neighbours_coulomb, self.distances_coulomb = neighbourlist().compute_neighbourlist(positions, box[0],
-                                                                                                self.r_cut_coulomb)
+        self.coulomb = coulomb(n_boxes_short_range, box, p_error, epsilon0 = epsilon_0 / (36.938 * 10**-9),
+                               reciprocal = reciprocal, backend = self.backend, n_workers = k_workers)
+
+        self.p_error = p_error
+        if cutoffs is None:
+            self.r_cut_coulomb = 0.49 * box[0]
+            self.neighbours_coulomb, self.distances_coulomb = self.get_neighbourlist_coulomb()
+            self.r_cut_coulomb, self.k_cut, self.std = self.coulomb.compute_optimal_cutoff(p_error, box, properties, self.neighbours_coulomb, self.distances_coulomb, r_switch, 0.49 * box[0], positions)
+        else:
+            self.r_cut_coulomb, self.k_cut = cutoffs[:2]
+            self.coulomb.set_cutoff(p_error, box, self.k_cut, *cutoffs[2:])
+            self.std = self.coulomb.std
 
         self.coulomb.n_boxes_short_range = np.ceil( self.r_cut_coulomb/self.L[0] ).astype(int)
         self.switch_parameter = self.__get_switch_parameter()
-        self.neighbours_LJ, self.distances_LJ= neighbourlist().compute_neighbourlist(positions, box[0], self.r_cut_LJ)
+        if r_skin is None:
+            r_skin = 0.1 * self.r_cut_LJ
+        self.verlet_coulomb = verlet_neighbourlist(self.r_cut_coulomb, r_skin, self.L[0], self.half_neighbourlist, self.backend)
+        self.neighbours_coulomb, self.distances_coulomb = self.update_neighbourlist_coulomb()
+        self.verlet_LJ = verlet_neighbourlist(self.r_cut_LJ, r_skin, self.L[0], self.half_neighbourlist, self.backend)
+        self.neighbours_LJ, self.distances_LJ = self.update_neighbourlist_LJ()
+        # only the pair engine reads the interpolation tables
+        self.fused_pairs = fused_pairs or n_workers > 1 or tables is not None
+        self.pair_engine = pair_engine(self.coulomb, self.Sigma_LJ, self.Epsilon_LJ, self.switch_parameter,
+                                       self.r_switch, self.r_cut_LJ, self.r_cut_coulomb)
+        if tables is not None:
+            # closer pairs are rare and fall back to the analytic functions
+            self.pair_engine.tables = pair_tables(self.pair_engine, 0.75 * np.min(self.Sigma_LJ), table_points, tables)
+            error = self.pair_engine.tables.check()
+            if error > table_tolerance:
+                raise ValueError("interpolation tables are not accurate enough (relative error %g), increase table_points" % error)
+        self.verlet_pairs = verlet_neighbourlist(self.pair_engine.r_cut, r_skin, self.L[0], self.half_neighbourlist,
+                                                 self.backend)
+        self.parallel_pair_engine = None
+        if n_workers > 1:
+            self.parallel_pair_engine = parallel_pair_engine(self.pair_engine, self.labels, n_workers, executor)
+        self.energy = None
+        self.virial = None
         self.Symbols = Symbols
+        # number of steps of get_traj, continued by checkpoints
+        self.n_steps = 0
+        # keyword options, stored in checkpoints
+        self.options = {'r_skin': float(r_skin), 'half_neighbourlist': bool(half_neighbourlist),
+                        'reciprocal': reciprocal, 'fused_pairs': bool(fused_pairs), 'tables': tables,
+                        'table_points': int(table_points), 'table_tolerance': float(table_tolerance),
+                        'backend': self.backend, 'n_workers': int(n_workers), 'executor': executor,
+                        'k_workers': int(k_workers)}
 
         return
     
+    def close(self):
+        """Stops the worker pools of the pair engine and of the reciprocal sum and frees
+        their shared memory. They are started again if the object is used afterwards.
+        """
+        if self.parallel_pair_engine is not None:
+            self.parallel_pair_engine.close()
+        self.coulomb.close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
     @property
     def positions(self):
         return self._positions
@@ -224,11 +362,15 @@ class md(object):
     def positions(self,xyz):
         self._positions = xyz
         self.R = np.linalg.norm(xyz, axis=1)
-        new_d_Pos = np.zeros( (xyz.shape[0], xyz.shape[0], 3) )
-        new_d_Pos[:,:,0] = np.subtract.outer(xyz[:,0], xyz[:,0])
-        new_d_Pos[:,:,1] = np.subtract.outer(xyz[:,1], xyz[:,1])
-        new_d_Pos[:,:,2] = np.subtract.outer(xyz[:,2], xyz[:,2])
-        self.d_Pos = new_d_Pos
+        # pair displacements are only computed block wise when a consumer asks for them
+        self.d_Pos = pair_displacements(xyz)
+        # every new configuration gets a new version, the results of the old one are dropped
+        self.positions_version += 1
+        self.__results = {'version': self.positions_version}
+        pending, self.__pending = self.__pending, None
+        if pending is not None and pending[0] is xyz:
+            # the integrator already evaluated these positions
+            self.__results.update(pending[1])
         return
      
     @property
@@ -288,13 +430,14 @@ class md(object):
         Returns
         ..........
         
-        neighbours: cell-linked list
-            list at entry i contains all neighbours of particle i within cutoff-radius
-        distances: cell-linked list
-            list at entry i contains the distances to all neighbours of particle i within cutoff-radius
+        neighbours: csr_neighbourlist
+            entry i contains all neighbours of particle i within cutoff-radius
+        distances: csr_view
+            entry i contains the distances to all neighbours of particle i within cutoff-radius
         """  
-        neighbours, distances = neighbourlist().compute_neighbourlist(self.positions, self.L[0], self.r_cut_coulomb)
-        return neighbours, distances
+        neighbours = neighbourlist(self.backend).compute_csr_neighbourlist(self.positions, self.L[0], self.r_cut_coulomb,
+                                                               self.half_neighbourlist)
+        return neighbours, neighbours.distance_view()
     
     def get_neighbourlist_LJ(self):
         """Compute the neighbourlist according to r_cut_coulomb and given configuration 
@@ -303,13 +446,53 @@ class md(object):
         Returns
         ..........
         
-        neighbours: cell-linked list
-            list at entry i contains all neighbours of particle i within cutoff-radius
-        distances: cell-linked list
-            list at entry i contains the distances to all neighbours of particle i within cutoff-radius
+        neighbours: csr_neighbourlist
+            entry i contains all neighbours of particle i within cutoff-radius
+        distances: csr_view
+            entry i contains the distances to all neighbours of particle i within cutoff-radius
         """  
-        neighbours, distances = neighbourlist().compute_neighbourlist(self.positions, self.L[0], self.r_cut_LJ)
-        return neighbours, distances    
+        neighbours = neighbourlist(self.backend).compute_csr_neighbourlist(self.positions, self.L[0], self.r_cut_LJ,
+                                                               self.half_neighbourlist)
+        return neighbours, neighbours.distance_view()
+    
+    
+    def update_neighbourlist_coulomb(self):
+        """Update the Verlet neighbourlist of the short range coulomb interaction for the current configuration.
+        The list is only rebuilt, if a particle moved further than half the skin radius.
+        
+        Returns
+        ..........
+        
+        neighbours: csr_neighbourlist
+            entry i contains all neighbours of particle i within cutoff-radius
+        distances: csr_view
+            entry i contains the distances to all neighbours of particle i within cutoff-radius
+        """
+        neighbours = self.__verlet_update(self.verlet_coulomb, 'neighbours_coulomb', self.positions,
+                                          self.__current_results())
+        return neighbours, neighbours.distance_view()
+    
+    def update_neighbourlist_LJ(self):
+        """Update the Verlet neighbourlist of the LJ interaction for the current configuration.
+        The list is only rebuilt, if a particle moved further than half the skin radius.
+        The number of rebuilds is counted in verlet_LJ.n_builds.
+        
+        Returns
+        ..........
+        
+        neighbours: csr_neighbourlist
+            entry i contains all neighbours of particle i within cutoff-radius
+        distances: csr_view
+            entry i contains the distances to all neighbours of particle i within cutoff-radius
+        """
+        neighbours = self.__verlet_update(self.verlet_LJ, 'neighbours_LJ', self.positions, self.__current_results())
+        return neighbours, neighbours.distance_view()
+
+    def __verlet_update(self, verlet, key, positions, results):
+        '''verlet.update(positions), only once per configuration.'''
+        if key not in results:
+            results[key] = verlet.update(positions)
+        return results[key]
     
     
     # work in progress    
@@ -341,21 +524,45 @@ class md(object):
         return Potential
     
     
+    def __current_results(self):
+        '''Cached results of the current configuration, see get_forces.'''
+        if self.__results['version'] != self.positions_version:
+            self.__results = {'version': self.positions_version}
+        return self.__results
+
     def get_energy(self):
-        
+        """Compute the energy of the current configuration of the System, or reuse the one
+        of the force evaluation of the integrator (with fused_pairs), see get_forces.
+        With fused_pairs the energy comes from get_forces_energy_virial.
+
+        Returns
+        ..........
+
+        Energy : float
+        """
+        results = self.__current_results()
+        if 'energy' in results:
+            return results['energy']
+        if self.fused_pairs:
+            Forces, results['energy'], results['virial'] = self.get_forces_energy_virial()
+            results.setdefault('forces', Forces)
+            return results['energy']
+        neighbours_LJ, distances_LJ = self.update_neighbourlist_LJ()
+        neighbours_coulomb, distances_coulomb = self.update_neighbourlist_coulomb()
         Energy = self.lennard_jones.compute_energy(sigma = self.Sigma_LJ,
                                                    epsilon = self.Epsilon_LJ,
                                                    labels = self.labels,
-                                                   neighbours = self.neighbours_LJ,
-                                                   distances = self.distances_LJ,
+                                                   neighbours = neighbours_LJ,
+                                                   distances = distances_LJ,
                                                    r_c=self.r_cut_LJ,
                                                    r_s=self.r_switch)+(
         self.coulomb.compute_energy(labels = self.labels,
                                     positions = self.positions, 
-                                    neighbours = self.neighbours_coulomb, 
-                                    distances = self.distances_coulomb,
+                                    neighbours = neighbours_coulomb, 
+                                    distances = distances_coulomb,
                                     r_s=self.r_switch,
                                     r_c=self.r_cut_coulomb))
+        results['energy'] = Energy
         return Energy
     
     
@@ -367,6 +574,14 @@ class md(object):
         """Compute the forces for the current configuration of the System
         
         F_total = F_Coulomb + F_Lennard_Jones
+
+        The forces are evaluated once per configuration: they are cached with the
+        positions_version of the positions, which is incremented by every assignment
+        to positions. The integrator (propagte_system) hands the forces (and with
+        fused_pairs the energy and virial) of the new positions over to the cache,
+        so get_forces and get_energy do not recompute them. Changes of the positions
+        array in place are not detected, assign the positions instead. With fused_pairs
+        the forces come from get_forces_energy_virial, which caches energy and virial as well.
         
         Returns
         ..........
@@ -374,18 +589,74 @@ class md(object):
         Forces : N x 3 Array
             Array containg the Forces that act upon each particle component wise. 
         """
-        Forces = self.lennard_jones.compute_forces(Positions =self.positions, 
+        results = self.__current_results()
+        if 'forces' not in results:
+            results['forces'] = self.__compute_forces(self.positions, results)
+        return results['forces']
+
+    def __compute_forces(self, positions, results):
+        if self.fused_pairs:
+            Forces, results['energy'], results['virial'] = self.get_forces_energy_virial(positions)
+            return Forces
+        Forces = self.lennard_jones.compute_forces(Positions =positions, 
                                                    Sigma =self.Sigma_LJ,
                                                    Epsilon = self.Epsilon_LJ, 
                                                    Labels =self.labels, 
                                                    L =self.L, 
                                                    switch_parameter = self.switch_parameter, 
                                                    r_switch = self.r_switch,
-                                                   neighbours = self.neighbours_LJ)+(
-        self.coulomb.compute_forces(d_Pos = self.d_Pos,
+                                                   neighbours = self.__verlet_update(self.verlet_LJ, 'neighbours_LJ',
+                                                                                     positions, results))+(
+        self.coulomb.compute_forces(d_Pos = pair_displacements(positions),
                                       Labels = self.labels,
-                                      L = self.L) )
+                                      L = self.L,
+                                      neighbours = self.__verlet_update(self.verlet_coulomb, 'neighbours_coulomb',
+                                                                        positions, results)) )
         return Forces
+
+    def __step_forces(self, positions):
+        '''force_engine of the integrator: one evaluation of the new positions, that
+        is kept for get_forces and get_energy until the positions are assigned.'''
+        if self.fused_pairs:
+            Forces, Energy, Virial = self.get_forces_energy_virial(positions)
+            self.__pending = (positions, {'forces': Forces, 'energy': Energy, 'virial': Virial})
+        else:
+            results = {}
+            Forces, Energy, Virial = self.__compute_forces(positions, results), None, None
+            results['forces'] = Forces
+            self.__pending = (positions, results)
+        return Forces, Energy, Virial
+    
+    def get_forces_energy_virial(self, positions=None):
+        """Compute forces, energy and virial tensor in one pass over the pairs
+        
+        The LJ and real space coulomb part are evaluated together by self.pair_engine
+        (in parallel by self.parallel_pair_engine, if n_workers > 1) on a Verlet list at
+        max(r_cut_LJ, r_cut_coulomb), the reciprocal space part by self.coulomb. The conventions are the ones of get_forces and get_energy.
+        
+        Parameters
+        ..........
+        
+        positions : N x 3 Array, optional
+            Configuration to evaluate, default is self.positions.
+        
+        Returns
+        ..........
+        
+        Forces : N x 3 Array
+            Array containg the Forces that act upon each particle component wise. 
+        Energy : float
+            Total energy of the system.
+        Virial : 3 x 3 Array
+            Virial tensor sum_pairs (r_i - r_j) x F_ij plus the reciprocal space part.
+        """
+        if positions is None:
+            positions = self.positions
+        neighbours = self.verlet_pairs.update(positions)
+        engine = self.pair_engine if self.parallel_pair_engine is None else self.parallel_pair_engine
+        Forces, Energy, Virial = engine.compute(positions, self.labels, self.L, neighbours)
+        Forces_long, Energy_long, Virial_long = self.coulomb.compute_long_range(self.labels, positions)
+        return Forces + Forces_long, Energy + Energy_long, Virial + Virial_long
     
     def propagte_system(self):
         """ Propagates the system by one timestep of length dt. Uses the Velocity Verlet Integrator and Andersen Thermostat.
@@ -400,28 +671,138 @@ class md(object):
         
         Forces_new : N x 3 Array
             Array with N rows and 3 columns. Contains each the force acting upon each particle component wise.
+
+        The forces are evaluated once, for the new positions. Once Positions_new is assigned
+        to positions, get_forces and get_energy reuse this evaluation.
         
         """
-        Positions, Velocities, Forces = dynamics().velocity_verlet_integrator(self.positions,
-                                                                               self.velocities, 
-                                                                               self.forces, 
-                                                                               self.labels,
-                                                                               self.Sigma_LJ, 
-                                                                               self.Epsilon_LJ,
-                                                                               self.dt,
-                                                                               self.L, 
-                                                                               self.T,
-                                                                               self.switch_parameter, 
-                                                                               self.r_switch,
-                                                                               self.neighbours_LJ,
-                                                                               self.p_rea,
-                                                                               self.coulomb,
-                                                                               self.lennard_jones,
-                                                                               self.d_Pos,
-                                                                               thermostat = True)
+        Positions, Velocities, Forces, Energy, Virial = dynamics().velocity_verlet_integrator(self.positions,
+                                                                                              self.velocities,
+                                                                                              self.forces,
+                                                                                              self.labels,
+                                                                                              self.Sigma_LJ,
+                                                                                              self.Epsilon_LJ,
+                                                                                              self.dt,
+                                                                                              self.L,
+                                                                                              self.T,
+                                                                                              self.switch_parameter,
+                                                                                              self.r_switch,
+                                                                                              self.neighbours_LJ,
+                                                                                              self.p_rea,
+                                                                                              self.coulomb,
+                                                                                              self.lennard_jones,
+                                                                                              thermostat = True,
+                                                                                              neighbours_coulomb = self.neighbours_coulomb,
+                                                                                              force_engine = self.__step_forces)
+        if self.fused_pairs:
+            # energy and virial of the new positions come with the forces
+            self.energy, self.virial = Energy, Virial
         
         return Positions, Velocities, Forces
     
+    def get_metadata(self):
+        """ Parameters of the simulation, stored as attributes of HDF5 trajectories.
+
+        Returns
+        -----------
+        metadata : dictionary
+            Symbols, labels, L, dt, T, p_rea, std, k_cut, r_switch, r_cut_LJ and r_cut_coulomb
+        """
+        return {'Symbols': np.asarray(self.Symbols), 'labels': self.labels, 'L': self.L, 'dt': self.dt,
+                'T': self.T, 'p_rea': self.p_rea, 'std': self.std, 'k_cut': self.k_cut,
+                'r_switch': self.r_switch, 'r_cut_LJ': self.r_cut_LJ, 'r_cut_coulomb': self.r_cut_coulomb}
+
+    def save_checkpoint(self, path):
+        """ Writes the full state of the simulation to a checkpoint file, see checkpoint.py.
+
+        The file contains positions, velocities and forces, the cached results of the
+        current configuration, the parameters of the constructor, the cutoffs and k-vectors
+        of the Ewald sum (r_cut_coulomb, k_cut, std, k_list), the reference positions and
+        counters of the Verlet lists, the state of the global numpy random generator (used
+        by the Andersen thermostat and maxwellboltzmann) and the step counter n_steps.
+        The file is replaced atomically.
+
+        Parameters
+        -----------
+        path : string
+            Checkpoint file.
+        """
+        results = self.__current_results()
+        arrays = {'positions': self.positions, 'velocities': self.velocities, 'forces': self.forces,
+                  'labels': self.labels, 'L': self.L, 'T': self.T, 'Sigma_LJ': self.Sigma_LJ,
+                  'Epsilon_LJ': self.Epsilon_LJ, 'r_switch': self.r_switch, 'r_cut_LJ': self.r_cut_LJ,
+                  'n_boxes_short_range': self.n_boxes_short_range, 'dt': self.dt, 'p_rea': self.p_rea,
+                  'p_error': self.p_error, 'Symbols': np.asarray(self.Symbols),
+                  'r_cut_coulomb': self.r_cut_coulomb, 'k_cut': self.k_cut, 'std': self.std,
+                  'k_list': self.coulomb.k_list, 'n_steps': self.n_steps,
+                  'energy': self.energy, 'virial': self.virial}
+        for key in ('forces', 'energy', 'virial'):
+            arrays['cached_' + key] = results.get(key)
+        for name in ('verlet_LJ', 'verlet_coulomb', 'verlet_pairs'):
+            verlet = getattr(self, name)
+            arrays[name + '_reference'] = verlet.reference_positions
+            arrays[name + '_counters'] = np.array([verlet.n_builds, verlet.n_updates])
+        arrays.update(get_random_state())
+        write_checkpoint(path, arrays, self.options)
+        return
+
+    @classmethod
+    def from_checkpoint(cls, path):
+        """ Restores a simulation from a checkpoint file written by save_checkpoint.
+
+        The cutoffs of the coulomb interaction are taken from the checkpoint, there is no
+        timing run of coulomb.compute_optimal_cutoff. The Verlet lists are built at their
+        stored reference positions and the global numpy random generator is reset to the
+        stored state, so the restored simulation continues bit for bit like the original one.
+
+        Parameters
+        -----------
+        path : string
+            Checkpoint file.
+
+        Returns
+        -----------
+        md_object : md
+        """
+        arrays, options = read_checkpoint(path)
+
+        def scalar(key):
+            # 0-dim arrays back to python numbers, None if the value was not stored
+            if key not in arrays:
+                return None
+            return arrays[key].item() if arrays[key].ndim == 0 else arrays[key]
+
+        md_object = cls(arrays['positions'], arrays['labels'], arrays['velocities'], arrays['forces'], arrays['L'],
+                        scalar('T'), arrays['Sigma_LJ'], arrays['Epsilon_LJ'], scalar('r_switch'),
+                        scalar('r_cut_LJ'), scalar('n_boxes_short_range'), scalar('dt'), scalar('p_rea'),
+                        scalar('p_error'), [str(symbol) for symbol in arrays['Symbols']],
+                        cutoffs=(scalar('r_cut_coulomb'), scalar('k_cut'), arrays['k_list']), **options)
+        md_object.std = scalar('std')
+        md_object.coulomb.std = md_object.std
+        md_object.n_steps = scalar('n_steps')
+        md_object.energy = scalar('energy')
+        md_object.virial = scalar('virial')
+
+        # the neighbourlists of the current configuration, from the stored Verlet lists
+        for name in ('verlet_LJ', 'verlet_coulomb', 'verlet_pairs'):
+            verlet = getattr(md_object, name)
+            verlet.reference_positions = None
+            verlet.skin_list = None
+            if name + '_reference' in arrays:
+                verlet.build(arrays[name + '_reference'])
+        results = {'version': md_object.positions_version}
+        for key in ('forces', 'energy', 'virial'):
+            if 'cached_' + key in arrays:
+                results[key] = scalar('cached_' + key)
+        md_object.__results = results
+        md_object.neighbours_LJ, md_object.distances_LJ = md_object.update_neighbourlist_LJ()
+        md_object.neighbours_coulomb, md_object.distances_coulomb = md_object.update_neighbourlist_coulomb()
+        for name in ('verlet_LJ', 'verlet_coulomb', 'verlet_pairs'):
+            getattr(md_object, name).n_builds, getattr(md_object, name).n_updates = arrays[name + '_counters'].tolist()
+
+        set_random_state(arrays)
+        return md_object
+
     def get_Temperature(self):
         """ Calculate the instantaneous Temperature of the given Configuration.
         
@@ -436,7 +817,8 @@ class md(object):
         
                          
     
-    def get_traj(self, N_steps, Energy_save, Temperature_save, Frame_save, path):
+    def get_traj(self, N_steps, Energy_save, Temperature_save, Frame_save, path, xyz=False, hdf5=False,
+                 compression='gzip', queue_size=16, when_full='block', checkpoint_save=None):
         """Propagates the System unitil convergence is reached or the maximum Number of Steps is reached
 
         Parameters
@@ -456,220 +838,203 @@ class md(object):
         Path: string
             Location where results will be saved.
 
+        xyz: bool, optional
+            If True, the trajectory is also exported to traj.xyz at the end, see
+            trajectory.export_xyz. Default is False.
+
+        hdf5: bool, optional
+            If True, positions, velocities, forces and radial distributions of the frames,
+            the energies, the temperatures and the metadata (see get_metadata) are written
+            to one HDF5 file traj.h5 instead, see trajectory.hdf5_writer. Needs h5py.
+            Default is False.
+
+        compression: None, 'gzip', 'lzf' or 'lz4', optional
+            Compression of the HDF5 datasets. Default is 'gzip'.
+
+        queue_size: int, optional
+            The frames (and radial distributions) are written by a background thread, see
+            output.output_pipeline. queue_size snapshots can wait for it. Default is 16.
+
+        when_full: 'block' or 'drop', optional
+            If the queue is full, the integrator waits ('block', default) or the frame is
+            not written ('drop'). Energies and temperatures are never dropped. On completion,
+            errors and KeyboardInterrupt all queued snapshots, the energies and the
+            temperatures are written.
+
+        checkpoint_save: int, optional
+            The intervall at which the state of the simulation is saved to the file
+            checkpoint.npz, see save_checkpoint. Before, all output up to the step is written.
+            A run restored with from_checkpoint continues bit for bit. Default is None, no
+            checkpoints.
+
+        If n_steps > 0, e.g. for a run restored with from_checkpoint, the output files in
+        path are continued: the frames, energies, temperatures and radial distributions after
+        step n_steps, which a crashed run wrote after its last checkpoint, are removed and the
+        new ones appended. Energies, temperatures, frames and checkpoints are saved at the
+        multiples of their intervalls of n_steps.
+
         Returns
         -----------------
         "Simulation Completed"
         Results will be saved in the specified path. Files will be named as follows:
-        Trajectory : traj.xyz
-        Energies: Energies
-        Temperature: Temperature
+        Trajectory : traj.bin (binary, see trajectory.trajectory_writer) or traj.h5
+        Energies: Energies (in traj.h5 with hdf5=True)
+        Temperature: Temperature (in traj.h5 with hdf5=True)
+        Radial distributions: rdf (in traj.h5 with hdf5=True)
 
         """
-        traj_file = ''.join([path,"\\traj.xyz"])
+        traj_file = ''.join([path,"\\traj.bin"])
         Energy_file = ''.join([path,"\\Energies"])
         Temperature_file = ''.join([path,"\\Temperature"])
         rdf_file = ''.join([path,"\\rdf"])
-        string1 = (''.join([str(self.N), "\n", "\n"]))
-
-        #write header
-        myfile = open(traj_file,'w')
-        myfile.write(str(self.N)+"\n"+"\n")
-        myfile.close()
-
-        frame = np.zeros((self.N), dtype=[('var1', 'U16'), ('var2',float), ('var3', float), ('var4',float)])
-        frame['var1'] = self.Symbols[self.labels[:,2].astype(int)]
-
-        #Positions in Angstroem
-        frame['var2'] = self.positions[:, 0]
-        frame['var3'] = self.positions[:, 1]
-        frame['var4'] = self.positions[:, 2]
-
-        myfile = open(traj_file,'ab')
-        np.savetxt(myfile,frame, fmt = "%s %f8 %f8 %f8", )
-        myfile.close()
-        myfile = open(traj_file,'a')
-        myfile.write(string1)
-        myfile.close()
-
-        Energy = np.zeros(np.ceil(N_steps/Energy_save).astype(int))
-        Temperature = np.zeros(np.ceil(N_steps/Temperature_save).astype(int))
-
-        counter_Energy = 0
-        counter_Temperature = 0
-        counter_Frame = 0
-        E_index = -1
-
-        #######################################################################
-        ### write radial distribution function of current frame into a file ###
-        #######################################################################
-        number_part_A = np.unique(self.labels[:, 2], return_counts=True)[1][0]
-        number_part_B = np.unique(self.labels[:, 2], return_counts=True)[1][1]
-
-        totdismatrix = np.linalg.norm(self.d_Pos, axis=2)
-        distancematrix_particle_A = totdismatrix[number_part_B:self.N, 0:number_part_A]
-        distancematrix_particle_B = totdismatrix[0:number_part_A, number_part_B:self.N]
-
+        checkpoint_file = ''.join([path,"\\checkpoint.npz"])
+        # a restored (or continued) run appends to the output of the steps up to n_steps
+        restart = self.n_steps > 0
+
+        #positions in Angstroem, one frame per Frame_save steps
+        if hdf5:
+            traj_file = ''.join([path,"\\traj.h5"])
+            trajectory = hdf5_writer(traj_file, self.get_metadata(), compression, append=restart)
+        else:
+            trajectory = trajectory_writer(traj_file, self.labels[:,2].astype(int), self.Symbols, self.L,
+                                           append=restart)
+        if restart:
+            trajectory.truncate(self.n_steps)
         # Volumenelement hat Dicke 1 Angstroem
         # maximal bis L/2 wird die Distribution genommen
-        histvector_particle_A = self.radial_distribution(distancematrix_particle_A, 1, self.L[0]/2, self.N/2, self.N / self.L[0]**3)
-        histvector_particle_B = self.radial_distribution(distancematrix_particle_B, 1, self.L[0]/2, self.N/2, self.N / self.L[0]**3)
-
-        myfile = open(rdf_file, 'w')
-        myfile.write(str(histvector_particle_A) + "\n" + str(histvector_particle_B) + "\n")
-        myfile.close()
-        #######################################################################
-        #######################################################################
-        #######################################################################
-
-        for i in np.arange(N_steps):
-
-            Positions_New, Velocities_New, Forces_New = self.propagte_system()
-            self.positions = Positions_New
-            self.velocities = Velocities_New
-            self.forces = Forces_New
-            self.neighbours_LJ  = self.get_neighbourlist_LJ()[0]
-
-            counter_Energy += 1
-            counter_Temperature += 1
-            counter_Frame += 1
-
-            #Save Energy
-            if counter_Energy > Energy_save-1:
-                E_index += 1
-                Energy[E_index] = self.get_energy()
-                counter_Energy = 0
-
-            #Save Temperature
-            if counter_Temperature > Temperature_save-1:
-                Temperature[np.floor(i/Temperature_save).astype(int)] = self.get_Temperature()
-                counter_Temperature = 0
-
-            # Save Frame
-            if counter_Frame > Frame_save-1 :
-                #create frame
-                frame = np.zeros((self.N), dtype=[('var1', 'U16'), ('var2',float), ('var3', float), ('var4',float)])
-                frame['var1'] = self.Symbols[self.labels[:,2].astype(int)]
-
-                frame['var2'] = self.positions[:,0]
-                frame['var3'] = self.positions[:,1]
-                frame['var4'] = self.positions[:,2]
-
-                #save frame
-                myfile = open(traj_file,'ab')
-                np.savetxt(myfile,frame, fmt = "%s %f8 %f8 %f8", )
-                myfile.close()
-                myfile = open(traj_file,'a')
-                myfile.write(string1)
-                myfile.close()
-
-                #######################################################################
-                ### write radial distribution function of current frame into a file ###
-                #######################################################################
-                number_part_A = np.unique(self.labels[:, 2], return_counts=True)[1][0]
-                number_part_B = np.unique(self.labels[:, 2], return_counts=True)[1][1]
-
-                totdismatrix = np.linalg.norm(self.d_Pos, axis=2)
-                distancematrix_particle_A = totdismatrix[number_part_B:self.N, 0:number_part_A]
-                distancematrix_particle_B = totdismatrix[0:number_part_A, number_part_B:self.N]
-
-                histvector_particle_A = self.radial_distribution(distancematrix_particle_A, 1, self.L[0] / 2,
-                                                                 self.N / 2, self.N / self.L[0] ** 3)
-                histvector_particle_B = self.radial_distribution(distancematrix_particle_B, 1, self.L[0] / 2,
-                                                                 self.N / 2, self.N / self.L[0] ** 3)
-
-                myfile = open(rdf_file, 'a')
-                myfile.write(str(histvector_particle_A) + "\n" + str(histvector_particle_B) + "\n")
-                myfile.close()
-                #######################################################################
-                #######################################################################
-                #######################################################################
-
-                counter_Frame = 0
-
-            sys.stdout.write("\r")
-            sys.stdout.write( ''.join([str(float(i+1)/N_steps*100), "% of steps completed"]))
-            sys.stdout.flush()
-
-        # save Energy       
-        np.savetxt(Energy_file, Energy)
-        # save Temperature
-        np.savetxt(Temperature_file, Temperature)
+        rdf = rdf_output(self, trajectory if hdf5 else rdf_file,
+                         trajectory.n_frames if restart and not hdf5 else None)
+        # frames and radial distributions are written by a background thread
+        pipeline = output_pipeline([trajectory_output(trajectory), rdf], queue_size, when_full)
+
+        # energies and temperatures are saved at the multiples of Energy_save and Temperature_save
+        Energy = np.zeros(0)
+        Temperature = np.zeros(0)
+        if restart and not hdf5:
+            if os.path.exists(Energy_file):
+                Energy = np.loadtxt(Energy_file, ndmin=1)[:self.n_steps // Energy_save]
+            if os.path.exists(Temperature_file):
+                Temperature = np.loadtxt(Temperature_file, ndmin=1)[:self.n_steps // Temperature_save]
+        E_index = len(Energy) - 1
+        T_index = len(Temperature) - 1
+        Energy = np.concatenate((Energy, np.zeros(N_steps // Energy_save + 1)))
+        Temperature = np.concatenate((Temperature, np.zeros(N_steps // Temperature_save + 1)))
+
+        def save_series():
+            if not hdf5:
+                # save Energy
+                np.savetxt(Energy_file, Energy[:E_index + 1])
+                # save Temperature
+                np.savetxt(Temperature_file, Temperature[:T_index + 1])
+            return
+
+        try:
+            if not restart:
+                pipeline.push(self.n_steps, positions=self.positions, velocities=self.velocities, forces=self.forces)
+
+            for i in np.arange(N_steps):
+
+                Positions_New, Velocities_New, Forces_New = self.propagte_system()
+                self.positions = Positions_New
+                self.velocities = Velocities_New
+                self.forces = Forces_New
+                self.neighbours_LJ, self.distances_LJ = self.update_neighbourlist_LJ()
+                self.neighbours_coulomb, self.distances_coulomb = self.update_neighbourlist_coulomb()
+                self.n_steps += 1
+
+                #Save Energy
+                if self.n_steps % Energy_save == 0:
+                    E_index += 1
+                    Energy[E_index] = self.get_energy()
+                    if hdf5:
+                        pipeline.push(self.n_steps, False, energies=Energy[E_index])
+
+                #Save Temperature
+                if self.n_steps % Temperature_save == 0:
+                    T_index += 1
+                    Temperature[T_index] = self.get_Temperature()
+                    if hdf5:
+                        pipeline.push(self.n_steps, False, temperatures=Temperature[T_index])
+
+                # Save Frame
+                if self.n_steps % Frame_save == 0:
+                    pipeline.push(self.n_steps, positions=self.positions, velocities=self.velocities, forces=self.forces)
+
+                if checkpoint_save is not None and self.n_steps % checkpoint_save == 0:
+                    # the output files hold everything up to the checkpoint
+                    pipeline.flush()
+                    rdf.flush()
+                    trajectory.flush()
+                    save_series()
+                    self.save_checkpoint(checkpoint_file)
+
+                sys.stdout.write("\r")
+                sys.stdout.write( ''.join([str(float(i+1)/N_steps*100), "% of steps completed"]))
+                sys.stdout.flush()
+        finally:
+            # also if the run is interrupted or a consumer fails, all output up to here is written
+            try:
+                pipeline.close()
+            finally:
+                try:
+                    rdf.close()
+                finally:
+                    try:
+                        trajectory.close()
+                    finally:
+                        save_series()
+
+        if xyz:
+            export_xyz(traj_file, ''.join([path,"\\traj.xyz"]))
 
         print("Simulation Completed")
         return
 
     def import_traj(self, file_path):
         '''
-        converts a xyz-file back to a trajectory
+        opens a trajectory, a binary file written by get_traj or a xyz-file
+
+        The frames are not loaded: the binary file is mapped into memory, the
+        xyz-file is scanned once for the offsets of the frames. Frames are read
+        when position_array is indexed, see trajectory.open_trajectory.
 
         Parameters
         ----------------
         file_path: string
-            full path to the xyz-file containing the trajectories
+            full path to the trajectory file
 
         Returns
         ----------------
         particle_type_A: string
-            type of particle A
+            type of the first particle
 
         particle_num_A: int
-            number of particle A in the trajectory
-            the first particle_num_A entries of the position_array in each frame belongs to particle A
+            number of particles of type A in the trajectory
 
         particle_type_B: string
-            type of particle B
+            type of the last particle
 
         particle_num_B:
-            number of particle B in the trajectory
-            the last particle_num_B entries in each frame belongs to particle B
+            number of particles of type B in the trajectory
 
-        position_array: M x N x 3 array
-            array containing the frames with the positions of all particles
+        position_array: M x N x 3 trajectory
+            the frames with the positions of all particles, e.g. position_array[1000:2000:10]
+            is a 100 x N x 3 Array
             M -> frame
             N -> particle
             3 -> 3 dimensional (x, y, z)
 
         '''
-
-        #read in the lines and convert the list into a numpy array of strings
-        myfile = open(file_path, 'r')
-        lines = myfile.readlines()
-        position_array = np.array(lines).astype(str)
-
-        #reads the first line to determine the total number of particles
-        particle_num = int(np.fromfile(file_path, int, 1, "\n"))
-        #reads the first table entry to determine the particle type A
-        particle_type_A = position_array[2][0:position_array[2].find(' ')]
-        #reads the last table entry to determine the particle type A
-        particle_type_B = position_array[particle_num + 1][0:position_array[particle_num + 1].find(' ')]
-
-        #deletes all blank lines and all lines containing the number of particles
-        position_array = np.delete(position_array, np.where(position_array == str(particle_num) + '\n'))
-        position_array = np.delete(position_array, np.where(position_array == '\n'))
-
-        #counts the number of particle A and B
-        particle_num_A = np.array([l.split(' ') for l in position_array], dtype=None)[0:particle_num, 0].tolist().count(
-            'A')
-        particle_num_B = np.array([l.split(' ') for l in position_array], dtype=None)[0:particle_num, 0].tolist().count(
-            'B')
-
-        #deletes the particle type in all rows and the \n
-        position_array = np.char.replace(position_array, particle_type_A + ' ', '')
-        position_array = np.char.replace(position_array, particle_type_B + ' ', '')
-        position_array = np.char.replace(position_array, '\n', '')
-        #converts the blankspace seperated numbers in the string to float values
-        position_array = np.array([l.split(' ') for l in position_array], dtype=np.float32)
-
-        #calculates the number of trajectories in the array
-        number_of_traj = int(position_array.shape[0] / particle_num)
-
-        #reshapes the 1D array to the M x N x 3 array
-        position_array = position_array.reshape(number_of_traj, particle_num, 3)
-
+        position_array = open_trajectory(file_path)
+        names = position_array.names
+        particle_type_A = names[0]
+        particle_type_B = names[-1]
+        particle_num_A = int(np.sum(names == particle_type_A))
+        particle_num_B = int(np.sum(names == particle_type_B))
         return (particle_type_A, particle_num_A, particle_type_B, particle_num_B, position_array)
 
 
-    def minmimize_Energy(self,N_steps, threshold, Energy_save, Frame_save, max_displacement, path):
+    def minmimize_Energy(self,N_steps, threshold, Energy_save, Frame_save, max_displacement, path, xyz=False):
         """Minimizes the Energy by steepest descent
 
         Parameters
@@ -692,6 +1057,10 @@ class md(object):
         Path: string
             Location where results will be saved.
 
+        xyz: bool, optional
+            If True, the trajectory is also exported to traj_minimization.xyz at the end, see
+            trajectory.export_xyz. Default is False.
+
         Returns
         -----------------
         Means by which the minimization was completed.
@@ -699,32 +1068,15 @@ class md(object):
         or "Maximum Number of steps reached
         
         Results will be saved in the specified path. Files will be named as follows:
-        Trajectory : traj.xyz
+        Trajectory : traj_minimization.bin (binary, see trajectory.trajectory_writer)
         Energies: Energies"""
         
-        traj_file = ''.join([path,"\\traj_minimization.xyz"])
+        traj_file = ''.join([path,"\\traj_minimization.bin"])
         Energy_file = ''.join([path,"\\Energies_minimization"])
-        string1 = (''.join([str(self.N), "\n", "\n"]))
-
-        #write header
-        myfile = open(traj_file,'w')
-        myfile.write(str(self.N)+"\n"+"\n")
-        myfile.close()
-
-        frame = np.zeros((self.N), dtype=[('var1', 'U16'), ('var2',float), ('var3', float), ('var4',float)])
-        frame['var1'] = self.Symbols[self.labels[:,2].astype(int)]
-
-        #Positions in Angstroem
-        frame['var2'] = self.positions[:,0]
-        frame['var3'] = self.positions[:,1]
-        frame['var4'] = self.positions[:,2]
 
-        myfile = open(traj_file,'ab')
-        np.savetxt(myfile,frame, fmt = "%s %f8 %f8 %f8", )
-        myfile.close()
-        myfile = open(traj_file,'a')
-        myfile.write(string1)
-        myfile.close()
+        #positions in Angstroem, one binary frame per Frame_save steps
+        trajectory = trajectory_writer(traj_file, self.labels[:,2].astype(int), self.Symbols, self.L)
+        trajectory.write(self.positions, 0)
 
         Energy = np.zeros(np.ceil(N_steps/Energy_save).astype(int))
 
@@ -742,7 +1094,8 @@ class md(object):
 
             #Update Self
             self.positions = Positions_new
-            self.neighbours_LJ = self.get_neighbourlist_LJ()[0]
+            self.neighbours_LJ, self.distances_LJ = self.update_neighbourlist_LJ()
+            self.neighbours_coulomb, self.distances_coulomb = self.update_neighbourlist_coulomb()
             self.forces = self.get_forces()
             
             counter_Energy += 1
@@ -755,25 +1108,7 @@ class md(object):
 
             # Save Frame
             if counter_Frame > Frame_save-1 :
-                #create frame
-                frame = np.zeros((self.N), dtype=[('var1', 'U16'), ('var2',float), ('var3', float), ('var4',float)])
-                frame['var1'] = self.Symbols[self.labels[:,2].astype(int)]
-
-                #Positions in Angstroem
-                #frame['var2'] = self.positions[:,0]*1e10
-                #frame['var3'] = self.positions[:,1]*1e10
-                #frame['var4'] = self.positions[:,2]*1e10
-                frame['var2'] = self.positions[:, 0]
-                frame['var3'] = self.positions[:, 1]
-                frame['var4'] = self.positions[:, 2]
-
-                #save frame
-                myfile = open(traj_file,'ab')
-                np.savetxt(myfile,frame, fmt = "%s %f8 %f8 %f8", )
-                myfile.close()
-                myfile = open(traj_file,'a')
-                myfile.write(string1)
-                myfile.close()
+                trajectory.write(self.positions, i + 1)
 
                 counter_Frame = 0
             
@@ -786,26 +1121,11 @@ class md(object):
             norm_Forces = np.max(np.sum(np.abs(self.forces),1))
             
             if norm_Forces < threshold:
-                #create frame
-                frame = np.zeros((self.N), dtype=[('var1', 'U16'), ('var2',float), ('var3', float), ('var4',float)])
-                frame['var1'] = self.Symbols[self.labels[:,2].astype(int)]
-
-                #Positions in Angstroem
-                #frame['var2'] = self.positions[:,0]*1e10
-                #frame['var3'] = self.positions[:,1]*1e10
-                #frame['var4'] = self.positions[:,2]*1e10
-                frame['var2'] = self.positions[:, 0]
-                frame['var3'] = self.positions[:, 1]
-                frame['var4'] = self.positions[:, 2]
-
-                #save frame
-                myfile = open(traj_file,'ab')
-                np.savetxt(myfile,frame, fmt = "%s %f8 %f8 %f8", )
-                myfile.close()
-                myfile = open(traj_file,'a')
-                myfile.write(string1)
-                myfile.close()
+                trajectory.write(self.positions, i + 1)
                 
+                trajectory.close()
+                if xyz:
+                    export_xyz(traj_file, ''.join([path,"\\traj_minimization.xyz"]))
                 # save Energy       
                 np.savetxt(Energy_file, Energy)
 
@@ -813,6 +1133,9 @@ class md(object):
                 return 
             
             
+        trajectory.close()
+        if xyz:
+            export_xyz(traj_file, ''.join([path,"\\traj_minimization.xyz"]))
         # save Energy       
         np.savetxt(Energy_file, Energy)
 
@@ -820,6 +1143,40 @@ class md(object):
         return
       
       
+    def get_radial_distribution(self, dr=1, positions=None):
+        """Computes the radial distribution of both particle types for the current positions
+
+        The distances are computed block wise from self.d_Pos, so the full
+        distance matrix is never stored.
+
+        Parameters
+        ----------------
+        dr: float
+            thickness of spherical shell
+
+        positions: N x 3 Array, optional
+            configuration to evaluate instead of the current positions
+
+        Returns
+        -----------------
+        histvector_particle_A, histvector_particle_B: 1 x m numpy.array
+            radial distribution up to L/2 around particles of type A and B
+        """
+        number_part_A = np.unique(self.labels[:, 2], return_counts=True)[1][0]
+        number_part_B = np.unique(self.labels[:, 2], return_counts=True)[1][1]
+
+        d_Pos = self.d_Pos if positions is None else pair_displacements(positions)
+        distances_particle_A = (np.linalg.norm(d, axis=2) for start, stop, d in
+                                d_Pos.chunks(rows=slice(number_part_B, self.N), columns=slice(0, number_part_A)))
+        distances_particle_B = (np.linalg.norm(d, axis=2) for start, stop, d in
+                                d_Pos.chunks(rows=slice(0, number_part_A), columns=slice(number_part_B, self.N)))
+
+        histvector_particle_A = self.radial_distribution(distances_particle_A, dr, self.L[0] / 2,
+                                                         self.N / 2, self.N / self.L[0] ** 3)
+        histvector_particle_B = self.radial_distribution(distances_particle_B, dr, self.L[0] / 2,
+                                                         self.N / 2, self.N / self.L[0] ** 3)
+        return histvector_particle_A, histvector_particle_B
+
     def radial_distribution(self, distancematrix, dr, rmax, numb_of_probes, rho0):
 
         """Computes the radial distribution
@@ -830,8 +1187,9 @@ class md(object):
 
         Parameters
         ----------------
-        distancematrix: numpy.array
-            Array with the distance of each particle of type A to each particle of type B
+        distancematrix: numpy.array or iterable of numpy.arrays
+            Array with the distance of each particle of type A to each particle of type B.
+            The distances can also be given in blocks, which are counted one after another.
 
         dr: float
             thickness of spherical shell
@@ -854,12 +1212,18 @@ class md(object):
         histlist=np.zeros(int(np.ceil(rmax/dr)))
         volume_factor = 4 * np.pi / 3
 
-        for iteration in range (0,len(histlist)):
-            histlist[iteration] = len(distancematrix[distancematrix < iteration*dr + dr]) \
-                                  - len(distancematrix[distancematrix <= iteration*dr])
+        if isinstance(distancematrix, np.ndarray):
+            distancematrix = [distancematrix]
+
+        # bin iteration counts the distances with iteration*dr < d < iteration*dr + dr
+        lower = np.arange(len(histlist)) * dr
+        for block in distancematrix:
+            block = np.sort(np.ravel(block))
+            histlist += np.searchsorted(block, lower + dr, side='left') \
+                        - np.searchsorted(block, lower, side='right')
 
-            binvolume = volume_factor * ((iteration * dr + dr) ** 3 - (iteration * dr) ** 3)
-            histlist[iteration] /= binvolume
+        binvolume = volume_factor * ((lower + dr) ** 3 - lower ** 3)
+        histlist /= binvolume
 
         histlist /= (numb_of_probes * rho0)
 
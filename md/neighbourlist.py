@@ -1,15 +1,279 @@
+import gc
 import numpy as np
+from backend import select_backend
+from backend import cell_list_pairs
+
+def _group_order(index, n):
+    """
+    Stable argsort of integer labels 0 <= index < n, used to group pairs by
+    particle. Small labels are sorted as uint16, for which numpy uses a radix sort.
+    """
+    if n <= 2**16:
+        index = index.astype(np.uint16)
+    return np.argsort(index, kind='mergesort')
+
+
+def cell_grid(box_length, r_cutoff):
+    """
+    Cell grid of the cell-list search: number of cells per dimension and their
+    edge length, which is at least r_cutoff/2.
+    """
+    # assume same size in all dimensions, cells are at least r_cutoff/2
+    # wide, which scans a smaller volume than cells of width r_cutoff
+    n_cells = max(int(2 * box_length / r_cutoff), 1)
+    return n_cells, box_length / float(n_cells)
+
+
+def cell_stencil(n_cells, r_c, r_cutoff):
+    """
+    Offsets of the neighbouring cells that the cell-list search scans on the
+    grid of cell_grid.
+
+    Returns
+    -------
+    offsets : 2dim np.array (offset, dim), int
+        Offsets in lexicographic order, without the corners that are further
+        away than r_cutoff.
+    half : bool
+        If True, only the second half of the stencil (starting with the zero
+        offset) is returned and each pair of cells is scanned once.
+    """
+    # number of neighbouring cells to scan in each direction
+    n_shells = int(np.ceil(r_cutoff / r_c))
+    shells = np.arange(-n_shells, n_shells+1)
+    offsets = np.array(np.meshgrid(shells, shells, shells, indexing='ij')).reshape(3, -1).T
+    # drop the corners of the stencil that are further away than r_cutoff
+    gap = np.maximum(np.abs(offsets) - 1, 0) * r_c
+    offsets = offsets[np.sum(gap**2, axis=1) <= r_cutoff**2]
+    # if every neighbouring cell is a different cell, each pair of cells
+    # only has to be scanned once (half stencil), otherwise the same cell
+    # shows up with different image shifts and all offsets are needed
+    half = n_cells >= 2 * n_shells + 1
+    if half:
+        offsets = offsets[len(offsets) // 2:]
+    return offsets, half
+
+
+class csr_view(object):
+    """
+    Read only, dictionary like view {i: list} on one of the arrays of a
+    csr_neighbourlist. Row i is returned as a new python list, so code that
+    was written for the dictionary of lists neighbourlist keeps working.
+    """
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+        return
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self):
+        return np.size(self.offsets) - 1
+
+    def __contains__(self, i):
+        return 0 <= i < len(self)
+
+    def keys(self):
+        return range(len(self))
+
+    def items(self):
+        return ((i, self[i]) for i in self)
+
+
+class csr_neighbourlist(object):
+    """
+    Neighbourlist in compressed sparse row format.
+
+    The neighbours of particle i are indices[offsets[i]:offsets[i+1]], the
+    corresponding entries of distances and displacements belong to the same
+    pairs. Iterating over the object and indexing it behaves like the
+    dictionary of lists returned by neighbourlist.compute_neighbourlist.
+    A half list stores each pair only once, so the interaction kernels add
+    the contribution of every entry to i and to j.
+
+    Parameters
+    ----------
+    offsets : 1dim np.array, int32, length N+1
+        Start of the row of each particle, offsets[N] is the number of entries.
+    indices : 1dim np.array, int32
+        Index of the neighbour j of each entry.
+    distances : 1dim np.array, float64
+        Distance between i and j of each entry.
+    displacements : 2dim np.array, float64 (entry, dim) or None
+        Minimum image vector r_j - r_i of each entry. None if the list was
+        created from distances only.
+    half : bool
+        If True, every pair is stored once under i with i < j (half list),
+        otherwise under i and under j (full list).
+    """
+
+    def __init__(self, offsets, indices, distances, displacements=None, half=False):
+        self.half = half
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.distances = np.asarray(distances, dtype=np.float64)
+        if displacements is not None:
+            displacements = np.asarray(displacements, dtype=np.float64)
+        self.displacements = displacements
+        self._rows = None
+        return
+
+    @classmethod
+    def from_pairs(cls, N, i, j, dr, dist, half=False):
+        """
+        Creates the full list (every pair under i and under j) or the half
+        list (every pair under i) from the pairs i < j returned by
+        neighbourlist.compute_pairs.
+        """
+        if half:
+            order = _group_order(i, N)
+            offsets = np.zeros(N+1, dtype=np.int32)
+            offsets[1:] = np.cumsum(np.bincount(i, minlength=N))
+            return cls(offsets, j[order], dist[order], dr[order], half=True)
+        first = np.concatenate((i, j))
+        order = _group_order(first, N)
+        offsets = np.zeros(N+1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(first, minlength=N))
+        indices = np.concatenate((j, i))[order]
+        distances = np.concatenate((dist, dist))[order]
+        displacements = np.concatenate((dr, -dr))[order]
+        return cls(offsets, indices, distances, displacements)
+
+    @classmethod
+    def from_dicts(cls, neighbours, distances, N=None):
+        """
+        Creates a csr_neighbourlist from a dictionary of lists (or a list of
+        lists) of neighbours and the corresponding distances. If distances
+        is None, all distances are set to zero.
+        """
+        if isinstance(neighbours, cls):
+            return neighbours
+        if not hasattr(neighbours, 'keys'):
+            neighbours = dict(enumerate(neighbours))
+            distances = dict(enumerate(distances))
+        keys = list(neighbours.keys())
+        if N is None:
+            N = max(keys) + 1 if len(keys) > 0 else 0
+        counts = np.zeros(N, dtype=np.int32)
+        for i in keys:
+            counts[i] = len(neighbours[i])
+        offsets = np.zeros(N+1, dtype=np.int32)
+        offsets[1:] = np.cumsum(counts)
+        indices = np.zeros(offsets[-1], dtype=np.int32)
+        dist = np.zeros(offsets[-1])
+        for i in keys:
+            indices[offsets[i]:offsets[i+1]] = neighbours[i]
+            if distances is not None:
+                dist[offsets[i]:offsets[i+1]] = distances[i]
+        return cls(offsets, indices, dist)
+
+    @property
+    def n_particles(self):
+        return np.size(self.offsets) - 1
+
+    @property
+    def n_entries(self):
+        return np.size(self.indices)
+
+    def rows(self):
+        """Index i of the particle each entry belongs to."""
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(self.n_particles, dtype=np.int32), np.diff(self.offsets))
+        return self._rows
+
+    def minimum_image(self, positions, L):
+        """
+        Minimum image vectors r_j - r_i of all entries for the given positions.
+
+        Parameters
+        ----------
+        positions : 2dim np.array (particle, dim)
+        L : 1dim np.array
+            Dimensions of the simulation box
+        """
+        dr = positions[self.indices] - positions[self.rows()]
+        return dr - L * np.round(dr / L)
+
+    def select(self, mask, distances=None, displacements=None):
+        """
+        Returns a new csr_neighbourlist with the entries where mask is True.
+
+        Parameters
+        ----------
+        mask : 1dim np.array, bool
+            One value per entry.
+        distances, displacements : np.array or None
+            Replace the distances / displacements of all entries before selecting.
+        """
+        if distances is None:
+            distances = self.distances
+        if displacements is None:
+            displacements = self.displacements
+        offsets = np.zeros(self.n_particles+1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(self.rows()[mask], minlength=self.n_particles))
+        if displacements is not None:
+            displacements = displacements[mask]
+        return csr_neighbourlist(offsets, self.indices[mask], distances[mask], displacements, self.half)
+
+    def neighbour_view(self):
+        """Dictionary like view of the neighbours of each particle."""
+        return csr_view(self.offsets, self.indices)
+
+    def distance_view(self):
+        """Dictionary like view of the distances to the neighbours of each particle."""
+        return csr_view(self.offsets, self.distances)
+
+    def to_dicts(self):
+        """
+        Returns
+        -------
+        neighbours, distances : dictionary of lists
+        """
+        bounds = self.offsets.tolist()
+        rows = list(map(slice, bounds[:-1], bounds[1:]))
+        # the garbage collector would scan the lists again after every
+        # few hundred rows, none of them can be part of a cycle
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            neighbours = dict(enumerate(map(self.indices.tolist().__getitem__, rows)))
+            distances = dict(enumerate(map(self.distances.tolist().__getitem__, rows)))
+        finally:
+            if enabled:
+                gc.enable()
+        return neighbours, distances
+
+    def __getitem__(self, i):
+        return self.indices[self.offsets[i]:self.offsets[i+1]].tolist()
+
+    def __iter__(self):
+        return iter(range(self.n_particles))
+
+    def __len__(self):
+        return self.n_particles
+
 
 class neighbourlist(object):
+    """
+    Cell-list neighbour search.
 
-    def __init__(self):
+    Parameters
+    ----------
+    backend : 'numpy', 'numba' or None, optional
+        Implementation of compute_pairs, see backend.select_backend.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = select_backend(backend)
         return
     
 
     def compute_neighbourlist(self, R, box_length, r_cutoff):
-        # computeneighbourlist
-        #return None
-
         """
         compute_neighbourlist(self, R, box_length, r_cutoff):
         returns list of neighbors within the cutoff radius for all particles
@@ -29,95 +293,222 @@ class neighbourlist(object):
         neighbors : dictionary of list
             For each particle the list of its neighbors
             (i.e. distance < r_cutoff) are returned.
+        distances : dictionary of list
+            For each particle the distances to its neighbors, in the
+            same order as in neighbors.
+
+        The pairs are found by compute_pairs. The rows are sorted into the order
+        of the scan of cells of width >= r_cutoff with the 27 cell stencil, and
+        the distances are computed as |R[i] - (R[j] + r_shift)| of the pair
+        i < j, like the original loop over the linked cell lists did, so the
+        dictionaries are the same.
         """
+        R = np.remainder(np.asarray(R, dtype=float), box_length)
+        N, dim = np.shape(R)
+        # pairs at the cutoff are decided by the distances below
+        if self.backend == 'numba':
+            i, j, dr = cell_list_pairs(R, box_length, r_cutoff * (1 + 1e-9))[:3]
+            shift = np.rint((R[i] + dr - R[j]).T / box_length).astype(int)
+        else:
+            i, j, shift = self.__scan_cells(R, box_length, r_cutoff * (1 + 1e-9))
+        # every pair as i < j with the image of j
+        sign = np.where(i < j, 1, -1)
+        i, j = np.minimum(i, j), np.maximum(i, j)
+
+        # the original loop computed R[i] - (R[j] + r_shift) with the image shift
+        # r_shift of j. matmul of stacks of vectors calls the BLAS dot product of
+        # np.linalg.norm, whose rounding depends on the 16 byte alignment of the
+        # vector: rows of 4 entries are aligned like the new array of every pair
+        d = np.zeros((len(i), 4))
+        for n in range(dim):
+            shift[n] *= sign
+            x = np.ascontiguousarray(R[:, n])
+            d[:, n] = x[i] - (x[j] + shift[n] * box_length)
+        d = d[:, :dim]
+        dist = np.sqrt(np.matmul(d[:, np.newaxis, :], d[:, :, np.newaxis])[:, 0, 0])
+        mask = dist <= r_cutoff
+        if not np.all(mask):
+            i, j, dist, shift = i[mask], j[mask], dist[mask], shift[:, mask]
+
+        # the loop visited the cells of width >= r_cutoff, for each cell c the
+        # 27 neighbouring cells in the order of their offsets and in every cell
+        # the particles by decreasing index. The pair (i, j) was found in the
+        # cell of i, at the offset (dx+1)*9 + (dy+1)*3 + (dz+1) = code[j] - code[i]
+        # + n_cells*(9*sx + 3*sy + sz) + 13 with the shift s of the image of j
+        n_cells = int(box_length / r_cutoff)
+        cell = np.minimum((R / (box_length / n_cells)).astype(int), n_cells - 1)
+        code = (cell[:, 0] * 3 + cell[:, 1]) * 3 + cell[:, 2]
+        cell = (cell[:, 0] * n_cells + cell[:, 1]) * n_cells + cell[:, 2]
+        offset = code[j] - code[i] + n_cells * ((shift[0] * 3 + shift[1]) * 3 + shift[2]) + 13
+        # stable sorts by the keys from the last to the first (radix sorts for small keys)
+        order = _group_order(N - 1 - j, N)
+        for key, n in ((N - 1 - i, N), (cell[i] * 27 + offset, 27 * n_cells**3)):
+            order = order[_group_order(key[order], n)]
+
+        # a pair is appended to the list of i and then to the one of j, entry
+        # e of the sorted pairs and entry e ^ 1 belong to the same pair
+        pairs = np.column_stack((i, j))[order].ravel()
+        entries = _group_order(pairs, N)
+        offsets = np.zeros(N+1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(pairs, minlength=N))
+        indices = pairs[entries ^ 1]
+        distances = dist[order[entries >> 1]]
+        return csr_neighbourlist(offsets, indices, distances).to_dicts()
+
+    def compute_csr_neighbourlist(self, R, box_length, r_cutoff, half=False):
+        """
+        compute_csr_neighbourlist(self, R, box_length, r_cutoff, half=False):
+        returns the neighbourlist within the cutoff radius as csr_neighbourlist
 
-        import numpy as np
+        Parameters
+        ----------
+        R : 2dim np.array (partictle, dim).
+            Distance to origin of every particle in all 3 dim
+        box_length : scalar number, positiv.
+            Length of simulation box
+        r_cutoff : scalar number, positiv.
+            Cutoff radius, above that the interaction of two particles
+            are neglegted.
+        half : bool
+            If True, every pair is only stored under i with i < j.
 
-        #from collections import defaultdict 
-        #neighbors = defaultdict(list)
-        neighbors = {}
-        distances = {}
+        Returns
+        -------
+        neighbours : csr_neighbourlist
+            Every pair is stored under i and under j, or only under i for a half list.
+            The rows hold the neighbours of compute_neighbourlist, but not in the same order.
+        """
+        i, j, dr, dist = self.compute_pairs(R, box_length, r_cutoff)
+        return csr_neighbourlist.from_pairs(np.shape(R)[0], i, j, dr, dist, half)
+
+    def compute_pairs(self, R, box_length, r_cutoff):
+        """
+        compute_pairs(self, R, box_length, r_cutoff):
+        vectorized cell-list search for all pairs within the cutoff radius
+
+        The particles are binned into cubic cells of edge length >= r_cutoff/2
+        by a stable argsort of their cell index. For each offset of the
+        neighbouring cells (half of the 5x5x5 stencil, if the box is large
+        enough) the candidate pairs of all particles are generated and filtered
+        with batched array operations, so there is no python loop over
+        particles or cells.
+
+        Parameters
+        ----------
+        R : 2dim np.array (partictle, dim).
+            Distance to origin of every particle in all 3 dim
+        box_length : scalar number, positiv.
+            Length of simulation box
+        r_cutoff : scalar number, positiv.
+            Cutoff radius, above that the interaction of two particles
+            are neglegted.
+
+        Returns
+        -------
+        i, j : 1dim np.array, int
+            Indices of the pairs, each pair (and periodic image) once with i < j.
+        dr : 2dim np.array (pair, dim)
+            Displacement vector pointing from particle i to the image of j.
+        distances : 1dim np.array
+            Length of dr, all distances are <= r_cutoff.
+        """
+        if self.backend == 'numba':
+            return cell_list_pairs(R, box_length, r_cutoff)
+        R = np.remainder(np.asarray(R, dtype=float), box_length)
+        i, j, shift = self.__scan_cells(R, box_length, r_cutoff)
+        dr = R[j] + shift.T * box_length - R[i]
+
+        # return every pair as i < j, dr still points from i to j
+        swap = i > j
+        i[swap], j[swap] = j[swap], i[swap]
+        dr[swap] *= -1
+        return i, j, dr, np.linalg.norm(dr, axis=1)
+
+    def __scan_cells(self, R, box_length, r_cutoff):
+        """
+        Cell-list search of compute_pairs for positions R inside the box.
+
+        Returns
+        -------
+        i, j : 1dim np.array, int
+            Indices of the pairs, each pair (and periodic image) once.
+        shift : 2dim np.array (dim, pair), int
+            Periodic image of j, R[j] + shift.T * box_length is within r_cutoff of R[i].
+        """
         N, dim = np.shape(R)
-        # assume same size in all N dimensions
-        n_cells = np.int(box_length / r_cutoff)
-        # divide simulation box into small cells of equal size r_c >= r_cutoff
-        r_c = box_length / n_cells 
-
-        #define head and list 
-        head = [-1] * (n_cells+1)**3
-        cllist = [-1] * N
-        for i in range(0, N):
-            #empty list of neighbors
-            neighbors[i] = []
-            distances[i] = []
-            # cell index of particle by its position
-            x = np.int(R[i][0] / r_c)
-            y = np.int(R[i][1] / r_c)
-            z = np.int(R[i][2] / r_c)
-            cell_index = x*n_cells*n_cells + y*n_cells + z
-            cllist[i] = head[cell_index]
-            # The last one goes to the head
-            head[cell_index] = i
-
-
-        # For all cells: Look for neighbors within neighboring cells
-        for cell in range(n_cells**3):
-            x = np.int(cell/(n_cells*n_cells)) % n_cells
-            y = np.int(cell/n_cells) % n_cells
-            z = cell % n_cells
-
-            nb = np.empty(dim)
-            r_shift = np.empty(dim)
-            # Scan the neighboring cells (including itself)
-            nb[0] = x-1
-            nb[1] = y-1
-            nb[2] = z-1
-            for nbcell_ind in range(3**3):
-                if nbcell_ind != 0:
-                    nb[2] += 1
-                    if nbcell_ind % 3 == 0:
-                        nb[2] = z-1
-                        nb[1] += 1
-                    if nbcell_ind % 9 == 0:
-                        nb[1] = y-1
-                        nb[0] += 1
-
-                # Shift image position of simulation box?
-                for d in range(dim):
-                    if (nb[d] < 0):
-                        r_shift[d] = -box_length
-                    elif (nb[d]>=n_cells):
-                        r_shift[d] = box_length
-                    else:
-                        r_shift[d] = 0.0
-                  
-                # Calculate cell index nbcell of neighbor cell
-                nbcell = np.int(((nb[0]+n_cells)%n_cells)* n_cells*n_cells
-                          + ((nb[1]+n_cells)%n_cells) * n_cells 
-                          + ((nb[2]+n_cells)%n_cells))
-                # where % pulls index back into appr. range
-
-                # Scan particle i in cell 
-                i = head[cell]
-                while(i != -1):
-                # Scan particle j in cell nbcell
-                    j = head[nbcell]
-                    while(j != -1):
-                    # Avoid double counting of pair (i, j)
-                        if (i<j):
-                            # dist of i, j smaller than cutoff?
-                            dist = np.linalg.norm(R[i]-(R[j]+r_shift))
-                            if (dist <= r_cutoff):
-                                neighbors[i].append(j)
-                                distances[i].append(dist)
-                                neighbors[j].append(i)
-                                distances[j].append(dist)
-
-
-                        j = cllist[j]
-                    i = cllist[i]
-                                    
-        return neighbors, distances
+
+        n_cells, r_c = cell_grid(box_length, r_cutoff)
+        # number of neighbouring cells to scan in each direction
+        n_shells = int(np.ceil(r_cutoff / r_c))
+
+        cell = np.minimum((R / r_c).astype(int), n_cells - 1)
+        cell_index = (cell[:, 0] * n_cells + cell[:, 1]) * n_cells + cell[:, 2]
+        # particles sorted by cell, the particles of cell c are
+        # order[start[c]:start[c]+counts[c]]
+        order = np.argsort(cell_index, kind='mergesort')
+        counts = np.bincount(cell_index, minlength=n_cells**dim)
+        start = np.cumsum(counts) - counts
+        R_sorted = R[order]
+        cell = cell[order]
+
+        # grid extended by n_shells layers of cells with the periodic images of
+        # the particles, so the candidates need no shift of the image position
+        n_ext = n_cells + 2 * n_shells
+        axis = np.arange(n_ext) - n_shells
+        ext = np.array(np.meshgrid(axis, axis, axis, indexing='ij')).reshape(dim, -1).T
+        source = np.remainder(ext, n_cells)
+        source = (source[:, 0] * n_cells + source[:, 1]) * n_cells + source[:, 2]
+        ext_counts = counts[source]
+        ext_start = np.cumsum(ext_counts) - ext_counts
+        # sorted index and position of the image of every particle of the extended grid
+        image = np.repeat(start[source] - ext_start, ext_counts) + np.arange(np.sum(ext_counts))
+        R_image = R_sorted[image] + np.repeat(np.floor_divide(ext, n_cells) * box_length, ext_counts, axis=0)
+        # the coordinates are gathered faster from 1dim arrays
+        X = [np.ascontiguousarray(R_sorted[:, d]) for d in range(dim)]
+        X_image = [np.ascontiguousarray(R_image[:, d]) for d in range(dim)]
+        home = ((cell[:, 0] + n_shells) * n_ext + cell[:, 1] + n_shells) * n_ext + cell[:, 2] + n_shells
+
+        offsets, half_stencil = cell_stencil(n_cells, r_c, r_cutoff)
+
+        r_cutoff_2 = r_cutoff**2
+        particles = np.arange(N)
+        pairs_i = []
+        pairs_j = []
+        for offset in offsets:
+            nbcell = home + (offset[0] * n_ext + offset[1]) * n_ext + offset[2]
+
+            # all candidates j in cell nbcell for every particle i (sorted
+            # indices of i, indices of the extended grid for j)
+            n_candidates = ext_counts[nbcell]
+            total = np.sum(n_candidates)
+            if total == 0:
+                continue
+            i = np.repeat(particles, n_candidates)
+            first = np.cumsum(n_candidates) - n_candidates
+            j = np.repeat(ext_start[nbcell] - first, n_candidates) + np.arange(total)
+
+            # avoid double counting of pair (i, j)
+            if not half_stencil or not np.any(offset):
+                mask = i < image[j]
+                i = i[mask]
+                j = j[mask]
+            dist_2 = 0
+            for d in range(dim):
+                x = X_image[d][j] - X[d][i]
+                dist_2 = dist_2 + x * x
+            mask = dist_2 <= r_cutoff_2
+            i = i[mask]
+            j = j[mask]
+            pairs_i.append(i)
+            pairs_j.append(j)
+
+        if len(pairs_i) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((dim, 0), dtype=int)
+        i = order[np.concatenate(pairs_i)]
+        j = np.concatenate(pairs_j)
+        # cell of the extended grid of every image
+        ext_cell = np.repeat(np.arange(n_ext**dim), ext_counts)[j]
+        return i, order[image[j]], np.floor_divide(ext, n_cells).T[:, ext_cell]
 
       
       
@@ -246,3 +637,93 @@ class neighbourlist(object):
                                         neighbor_list[j].append(i)
                                         distances[j].append(d)
         return neighbor_list, distances
+
+
+class verlet_neighbourlist(object):
+    """
+    Persistent neighbourlist with a skin buffer (Verlet list).
+
+    The list is built with the cell-list search at r_cutoff + r_skin. As long
+    as no particle has moved more than r_skin/2 since the last build, no pair
+    can have entered the cutoff sphere, so for every update only the distances
+    of the stored pairs are recomputed and filtered to r_cutoff.
+
+    Parameters
+    ----------
+    r_cutoff : scalar number, positiv
+        Cutoff radius of the returned neighbourlist.
+    r_skin : scalar number, positiv
+        Skin radius added to r_cutoff when the list is built.
+    box_length : scalar number, positiv
+        Length of the simulation box.
+    half : bool
+        If True, the returned lists are half lists (every pair once, i < j).
+    backend : 'numpy', 'numba' or None, optional
+        Backend of the cell-list search, see backend.select_backend.
+
+    Attributes
+    ----------
+    n_builds : int
+        Number of times the list was built from scratch.
+    n_updates : int
+        Number of calls to update.
+    """
+
+    def __init__(self, r_cutoff, r_skin, box_length, half=False, backend=None):
+        self.half = half
+        self.backend = select_backend(backend)
+        self.r_cutoff = r_cutoff
+        self.r_skin = r_skin
+        self.box_length = box_length
+        self.n_builds = 0
+        self.n_updates = 0
+        self.reference_positions = None
+        self.skin_list = None
+        return
+
+    def build(self, positions):
+        """Builds the list at r_cutoff + r_skin for the given positions."""
+        self.skin_list = neighbourlist(self.backend).compute_csr_neighbourlist(positions, self.box_length,
+                                                                   self.r_cutoff + self.r_skin, self.half)
+        self.reference_positions = np.array(positions, dtype=float)
+        self.n_builds += 1
+        return
+
+    def displacements(self, positions):
+        """
+        Minimum image displacement of every particle since the last build.
+        """
+        dr = positions - self.reference_positions
+        return dr - self.box_length * np.round(dr / self.box_length)
+
+    def max_displacement(self, positions):
+        """Largest displacement of a particle since the last build."""
+        if self.reference_positions is None:
+            return np.inf
+        return np.sqrt(np.max(np.sum(self.displacements(positions)**2, axis=1)))
+
+    def update(self, positions):
+        """
+        Returns the neighbourlist for the given positions, the list is only
+        rebuilt if a particle moved further than r_skin/2 since the last build.
+
+        Parameters
+        ----------
+        positions : 2dim np.array (particle, dim)
+
+        Returns
+        -------
+        neighbours : csr_neighbourlist
+            All pairs within r_cutoff with current distances and displacements.
+        """
+        self.n_updates += 1
+        if self.reference_positions is None or np.shape(positions) != np.shape(self.reference_positions) \
+                or self.max_displacement(positions) > 0.5 * self.r_skin:
+            self.build(positions)
+            dr = self.skin_list.displacements
+        else:
+            # the image of each stored pair is kept, only the motion since the build is added
+            u = self.displacements(positions)
+            dr = self.skin_list.displacements + u[self.skin_list.indices] - u[self.skin_list.rows()]
+        distances_2 = np.einsum('ij,ij->i', dr, dr)
+        return self.skin_list.select(distances_2 <= self.r_cutoff**2, np.sqrt(distances_2), dr)
@@ -0,0 +1,200 @@
+'''
+Asynchronous output of snapshots of a running simulation
+'''
+import os
+import sys
+import threading
+import queue
+import numpy as np
+from trajectory import hdf5_writer
+
+
+class output_pipeline(object):
+    '''
+    Hands snapshots of the simulation to consumers in a background thread, so
+    the integrator does not wait for the disk or for the analysis.
+
+    push copies the arrays of a snapshot into a bounded queue. A writer thread
+    takes the snapshots out in order and calls every consumer with them. An
+    error of a consumer is raised by the next push, flush or close.
+
+    Parameters
+    ----------
+    consumers : list of callables
+        consumer(snapshot) with a dictionary snapshot, see push.
+
+    queue_size : int, optional
+        Number of snapshots that can wait for the writer thread, default is 16.
+
+    when_full : 'block' or 'drop', optional
+        Back-pressure if the queue is full: 'block' (default) lets push wait for
+        the writer thread, 'drop' discards the snapshot and counts it in n_dropped.
+        Snapshots pushed with droppable=False are never discarded.
+
+    Attributes
+    ----------
+    n_pushed, n_dropped : int
+        Number of accepted and discarded snapshots.
+    '''
+
+    def __init__(self, consumers, queue_size=16, when_full='block'):
+        if when_full not in ('block', 'drop'):
+            raise ValueError("when_full must be 'block' or 'drop', not %r" % (when_full,))
+        self.consumers = list(consumers)
+        self.when_full = when_full
+        self.queue = queue.Queue(queue_size)
+        self.n_pushed = 0
+        self.n_dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def push(self, step, droppable=True, **data):
+        '''
+        Queues the snapshot {'step': step, **data}, arrays are copied. If
+        droppable is False, push waits for the writer thread also with
+        when_full='drop', e.g. for the energies of a run.
+
+        Returns
+        -------
+        accepted : bool
+            False if the snapshot was dropped.
+        '''
+        self.__check()
+        snapshot = {'step': step}
+        for key, value in data.items():
+            snapshot[key] = np.array(value, copy=True)
+        if self.when_full == 'block' or not droppable:
+            self.queue.put(snapshot)
+        else:
+            try:
+                self.queue.put_nowait(snapshot)
+            except queue.Full:
+                self.n_dropped += 1
+                return False
+        self.n_pushed += 1
+        return True
+
+    def flush(self):
+        '''
+        Waits until the consumers processed all queued snapshots.
+        '''
+        self.queue.join()
+        self.__check()
+        return
+
+    def close(self):
+        '''
+        Processes all queued snapshots and stops the writer thread.
+        '''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.__check()
+        return
+
+    def __check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def __run(self):
+        while True:
+            snapshot = self.queue.get()
+            try:
+                if snapshot is not None and self.error is None:
+                    for consumer in self.consumers:
+                        consumer(snapshot)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+            if snapshot is None:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # also on errors and KeyboardInterrupt, the queued snapshots are written
+        self.close()
+        return False
+
+
+class trajectory_output(object):
+    '''
+    Consumer that writes the frames of the snapshots to a trajectory_writer or
+    an hdf5_writer. An hdf5_writer also gets the velocities, the forces and
+    the scalar series ('energies', 'temperatures') of the snapshots.
+    '''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.hdf5 = isinstance(writer, hdf5_writer)
+        return
+
+    def __call__(self, snapshot):
+        if 'positions' in snapshot:
+            if self.hdf5:
+                self.writer.write(snapshot['positions'], snapshot['step'], snapshot.get('velocities'),
+                                  snapshot.get('forces'))
+            else:
+                self.writer.write(snapshot['positions'], snapshot['step'])
+        if self.hdf5:
+            for name in ('energies', 'temperatures'):
+                if name in snapshot:
+                    self.writer.append(name, snapshot['step'], snapshot[name])
+        return
+
+
+class rdf_output(object):
+    '''
+    Consumer that writes the radial distributions (md.get_radial_distribution)
+    of the positions of the snapshots. They are appended to a text file, two
+    lines per frame, or, for an hdf5_writer, to its series 'rdf'
+    (n_frames x 2 x n_bins). If keep is given, the text file is continued after
+    its first keep frames.
+    '''
+
+    def __init__(self, md_object, output, keep=None):
+        self.md_object = md_object
+        self.hdf5 = isinstance(output, hdf5_writer)
+        if self.hdf5:
+            self.file = output
+            return
+        lines = []
+        if keep is not None and os.path.exists(output):
+            with open(output) as old:
+                lines = old.readlines()[:2 * keep]
+        self.file = open(output, 'w')
+        self.file.writelines(lines)
+        return
+
+    def __call__(self, snapshot):
+        if 'positions' in snapshot:
+            histvector_particle_A, histvector_particle_B = self.md_object.get_radial_distribution(
+                positions=snapshot['positions'])
+            if self.hdf5:
+                self.file.append('rdf', snapshot['step'], [histvector_particle_A, histvector_particle_B])
+            else:
+                self.file.write(_line(histvector_particle_A) + "\n" + _line(histvector_particle_B) + "\n")
+        return
+
+    def flush(self):
+        self.file.flush()
+        return
+
+    def close(self):
+        # an hdf5_writer is closed by its owner
+        if not self.hdf5:
+            self.file.close()
+        return
+
+
+def _line(histogram):
+    # str of an array, on one line also for many bins
+    return np.array2string(np.asarray(histogram), max_line_width=sys.maxsize, threshold=sys.maxsize)
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class pair_displacements(object):
+    '''
+    Lazy replacement for the dense NxNx3 array d_Pos of all pair displacements.
+
+    d_Pos[a,b] = r_a - r_b is only computed for the particles a consumer asks
+    for, either single pairs, slices (d_Pos[a], d_Pos[a:b, c:d]) or blocks of
+    rows via chunks(). The memory needed at any time is bounded by the size of
+    one block instead of N*N*3.
+
+    Parameters
+    ----------
+    positions : Nx3 Array
+        Array with N rows and 3 columns. Contains the Positions of each Particle component wise.
+
+    max_elements : int, optional
+        Upper limit for the number of float values of one block returned by chunks().
+    '''
+
+    def __init__(self, positions, max_elements=2**22):
+        self.positions = positions
+        self.max_elements = max_elements
+        return
+
+    @classmethod
+    def from_dense(cls, d_Pos):
+        '''
+        Creates the provider from a dense NxNx3 d_Pos array. All consumers only
+        depend on position differences, so r_a - r_0 is used as position of a.
+        '''
+        return cls(np.asarray(d_Pos)[:, 0, :])
+
+    @property
+    def N(self):
+        return np.shape(self.positions)[0]
+
+    @property
+    def shape(self):
+        return (self.N, self.N, np.shape(self.positions)[1])
+
+    def pairs(self, i, j, L=None):
+        '''
+        Displacements r_i - r_j of the pairs (i[n], j[n]).
+
+        Parameters
+        ----------
+        i, j : 1D int Arrays
+            indices of the pairs
+
+        L : 3x1 Array, optional
+            If given, the minimum image convention is applied.
+
+        Returns
+        -------
+        d : len(i) x 3 Array
+        '''
+        d = self.positions[i] - self.positions[j]
+        if L is not None:
+            d = d - L * np.round(d / L)
+        return d
+
+    def chunk(self, start, stop, columns=slice(None)):
+        '''
+        Block d_Pos[start:stop, columns] of the displacement tensor.
+
+        Returns
+        -------
+        d : (stop-start) x M x 3 Array
+            d[a, b] = r_(start+a) - r_columns[b]
+        '''
+        return self.positions[start:stop, np.newaxis, :] - self.positions[columns][np.newaxis, :, :]
+
+    def chunks(self, width=1, rows=slice(None), columns=slice(None)):
+        '''
+        Iterates over blocks of rows of the displacement tensor.
+
+        Parameters
+        ----------
+        width : int, optional
+            Number of values the consumer creates per pair (e.g. number of k-vectors
+            or periodic images). The number of rows per block is chosen such that
+            rows*N*3*width does not exceed max_elements.
+
+        rows, columns : slice, optional
+            Part of the tensor to iterate over.
+
+        Yields
+        ------
+        start, stop : int
+            Rows of the block (indices into the positions).
+        d : (stop-start) x M x 3 Array
+            d[a, b] = r_(start+a) - r_columns[b]
+        '''
+        first, last, step = rows.indices(self.N)
+        assert step == 1, "only contiguous rows are supported"
+        n_columns = np.size(np.arange(self.N)[columns])
+        size = max(1, int(self.max_elements // max(1, 3 * n_columns * width)))
+        for start in range(first, last, size):
+            stop = min(start + size, last)
+            yield start, stop, self.chunk(start, stop, columns)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows = self.positions[key[0]]
+        columns = self.positions[key[1]] if len(key) > 1 else self.positions
+        if rows.ndim == 2 and columns.ndim == 2:
+            d = rows[:, np.newaxis, :] - columns[np.newaxis, :, :]
+        else:
+            d = rows - columns
+        if len(key) > 2:
+            d = d[(Ellipsis,) + tuple(key[2:])]
+        return d
+
+    def __array__(self, dtype=None):
+        # materializes the dense tensor, only for code that really needs all of it
+        d = self.chunk(0, self.N)
+        if dtype is not None:
+            d = d.astype(dtype)
+        return d
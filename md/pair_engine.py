@@ -0,0 +1,234 @@
+'''
+Fused evaluation of the Lennard-Jones and the real space coulomb interaction
+'''
+import numpy as np
+from scipy.special import erfc
+from neighbourlist import csr_neighbourlist
+
+
+class pair_engine(object):
+    '''
+    Computes the Lennard-Jones and the short range coulomb interaction in one
+    pass over a neighbourlist with cutoff max(r_cut_LJ, r_cut_coulomb).
+
+    Distances, species indices and charges products are computed once per pair
+    and shared by both interactions. The results follow the conventions of
+    md.get_forces and md.get_energy:
+
+    * forces: LJ forces switched with switch_parameter beyond r_switch (as
+      lennard_jones.compute_forces), real space coulomb forces without switch
+      (as coulomb.compute_forces with a neighbourlist)
+    * energy: the LJ energy is the sum of the per particle potentials (as
+      lennard_jones.compute_energy), the short range coulomb energy is
+      0.5 sum q_i phi_i with the switch between r_switch and r_cut_coulomb (as
+      coulomb.compute_energy)
+    * virial: W_ab = sum_pairs (r_i - r_j)_a F_ij,b of the pair forces
+
+    Parameters
+    ----------
+    coulomb : coulomb
+        Provides std, epsilon0 and the constant 1/(8 pi epsilon0).
+
+    Sigma, Epsilon : 3x1 Arrays
+        LJ parameters of the species pairs AA, AB, BB.
+
+    switch_parameter : 1D Array
+        Coefficients of the LJ switch polynomial, lowest order first.
+
+    r_switch : float
+        Distance where the switch functions kick in.
+
+    r_cut_LJ, r_cut_coulomb : float
+        Cutoff radii of the two interactions.
+
+    tables : pair_tables, optional
+        Interpolation tables used instead of lj_kernel and coulomb_kernel.
+    '''
+
+    def __init__(self, coulomb, Sigma, Epsilon, switch_parameter, r_switch, r_cut_LJ, r_cut_coulomb, tables=None):
+        self.coulomb = coulomb
+        self.tables = tables
+        self.sig6 = np.asarray(Sigma, dtype=float) ** 6
+        self.Epsilon = np.asarray(Epsilon, dtype=float)
+        self.switch_parameter = np.asarray(switch_parameter, dtype=float)
+        self.d_switch_parameter = np.polynomial.polynomial.polyder(self.switch_parameter)
+        self.r_switch = r_switch
+        self.r_cut_LJ = r_cut_LJ
+        self.r_cut_coulomb = r_cut_coulomb
+        self.r_cut = max(r_cut_LJ, r_cut_coulomb)
+        return
+
+    def __switchFunction(self, x, r_0, r_c):
+        """
+        1 -10x1**3 +15x1**4 -6x1**5 with x1 = (x-r_0)/(r_c-r_0), see coulomb.__switchFunction
+        """
+        rStar = (x - r_0) / (r_c - r_0)
+        return 1 - rStar ** 3 * (10 - 15 * rStar + 6 * rStar ** 2)
+
+    def lj_kernel(self, index_LJ, dist_2):
+        '''
+        Switched LJ potential and dV/dr / r of pairs.
+
+        Parameters
+        ----------
+        index_LJ : 1D int Array
+            species pair index labels[i,2] + labels[j,2] of every pair
+        dist_2 : 1D Array
+            squared distances
+
+        Returns
+        -------
+        potential, dV_r : 1D Arrays
+        '''
+        eps = self.Epsilon[index_LJ]
+        sig6_dist_ratio = self.sig6[index_LJ] / dist_2 ** 3
+        potential = 4 * eps * (sig6_dist_ratio ** 2 - sig6_dist_ratio)
+        dV_r = -24 * eps * (2 * sig6_dist_ratio ** 2 - sig6_dist_ratio) / dist_2
+        switched = dist_2 >= self.r_switch ** 2
+        if np.any(switched):
+            r = np.sqrt(dist_2[switched])
+            S = np.polynomial.polynomial.polyval(r, self.switch_parameter)
+            dS = np.polynomial.polynomial.polyval(r, self.d_switch_parameter)
+            dV_r[switched] = dV_r[switched] * S + potential[switched] * dS / r
+            potential[switched] *= S
+        return potential, dV_r
+
+    def coulomb_kernel(self, dist_2):
+        '''
+        Real space coulomb pair potential (switched between r_switch and r_cut_coulomb)
+        and dV/dr / r of the unswitched force, both per unit charge product q_i q_j.
+
+        Parameters
+        ----------
+        dist_2 : 1D Array
+            squared distances
+
+        Returns
+        -------
+        potential, dV_r : 1D Arrays
+        '''
+        std = self.coulomb.std
+        r = np.sqrt(dist_2)
+        erfc_r = erfc(r / (np.sqrt(2.0) * std)) / r
+        dV_r = -self.coulomb.constant / dist_2 * (erfc_r + np.sqrt(2.0 / np.pi) / std * np.exp(-dist_2 / 2.0 / std ** 2))
+        potential = self.coulomb.constant * erfc_r
+        switched = r >= self.r_switch
+        potential[switched] *= self.__switchFunction(r[switched], self.r_switch, self.r_cut_coulomb)
+        return potential, dV_r
+
+    def compute(self, positions, labels, L, neighbours):
+        '''
+        Forces, energy and virial of all pairs of the neighbourlist.
+
+        Parameters
+        ----------
+        positions : N x 3 Array
+
+        labels : N x 3 Array
+            The second column contains the charges, the third the species (0 or 1).
+
+        L : 3x1 Array
+            Dimensions of the simulation box
+
+        neighbours : dictionary of lists or csr_neighbourlist
+            all neighbours within max(r_cut_LJ, r_cut_coulomb)
+
+        Returns
+        -------
+        forces : N x 3 Array
+        energy : float
+        virial : 3 x 3 Array
+        '''
+        N = np.shape(positions)[0]
+        neighbours = csr_neighbourlist.from_dicts(neighbours, None, N)
+        return self.compute_pairs(positions, labels, L, neighbours.rows(), neighbours.indices, neighbours.half)
+
+    def pair_terms(self, dist_2, labels_i, labels_j):
+        '''
+        LJ and real space coulomb terms of pairs at the squared distances dist_2.
+
+        Parameters
+        ----------
+        dist_2 : 1D Array
+            squared minimum image distance of every pair
+
+        labels_i, labels_j : len(dist_2) x 3 Arrays
+            labels of the two particles of every pair
+
+        Returns
+        -------
+        dV_r : 1D Array
+            dV/dr / r of every pair, the force on i is dV_r * (r_j - r_i)
+        pair_energy : 1D Array
+            energy of every pair, the LJ potential is counted for both particles
+            (as lennard_jones.compute_energy), the coulomb potential once
+        '''
+        dV_r = np.zeros(len(dist_2))
+        pair_energy = np.zeros(len(dist_2))
+
+        # interpolation tables replace the analytic kernels, if given
+        kernels = self if self.tables is None else self.tables
+
+        lj = dist_2 < self.r_cut_LJ ** 2
+        if np.any(lj):
+            index_LJ = (labels_i[lj, 2] + labels_j[lj, 2]).astype(int)
+            potential, dV_r_LJ = kernels.lj_kernel(index_LJ, dist_2[lj])
+            dV_r[lj] += dV_r_LJ
+            pair_energy[lj] += 2 * potential
+
+        coul = dist_2 < self.r_cut_coulomb ** 2
+        if np.any(coul):
+            qq = labels_i[coul, 1] * labels_j[coul, 1]
+            potential, dV_r_coulomb = kernels.coulomb_kernel(dist_2[coul])
+            dV_r[coul] += qq * dV_r_coulomb
+            # 0.5 sum_i q_i phi_i counts every pair once
+            pair_energy[coul] += qq * potential
+        return dV_r, pair_energy
+
+    def compute_pairs(self, positions, labels, L, i, j, half):
+        '''
+        Forces, energy and virial of the entries (i[n], j[n]) of a neighbourlist,
+        e.g. of a part of its rows.
+
+        Parameters
+        ----------
+        positions : N x 3 Array
+
+        labels : N x 3 Array
+
+        L : 3x1 Array
+
+        i, j : 1D int Arrays
+            particle and neighbour index of every entry
+
+        half : bool
+            True, if the entries come from a half list
+
+        Returns
+        -------
+        forces : N x 3 Array
+        energy : float
+        virial : 3 x 3 Array
+        '''
+        N = np.shape(positions)[0]
+        # a full list contains every pair twice
+        pair_weight = 1.0 if half else 0.5
+
+        # r_j - r_i, recomputed as the list may be older than the positions
+        dr = positions[j] - positions[i]
+        L = np.asarray(L, dtype=float)
+        dr -= L * np.round(dr / L)
+        dist_2 = np.einsum('ij,ij->i', dr, dr)
+        dV_r, pair_energy = self.pair_terms(dist_2, labels[i], labels[j])
+        energy = pair_weight * np.sum(pair_energy)
+
+        forces = np.zeros((N, 3))
+        for axis in range(3):
+            forces[:, axis] = np.bincount(i, dV_r * dr[:, axis], minlength=N)
+            if half:
+                # Newton's third law, every pair is only stored once
+                forces[:, axis] -= np.bincount(j, dV_r * dr[:, axis], minlength=N)
+
+        # (r_i - r_j) x F_ij = -dr x dV_r dr
+        virial = -pair_weight * np.dot(dr.T * dV_r, dr)
+        return forces, energy, virial
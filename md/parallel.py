@@ -0,0 +1,360 @@
+'''
+Parallel evaluation of the pair forces over spatial slabs
+'''
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from functools import partial
+from neighbourlist import csr_neighbourlist
+from neighbourlist import cell_grid
+from reciprocal import structure_factor
+
+
+def slab_index(positions, box_length, r_cutoff, n_slabs):
+    '''
+    Assigns every particle to one of n_slabs slabs along x. The slabs are
+    contiguous layers of the cell grid of neighbourlist.compute_pairs.
+
+    Returns
+    -------
+    slab : 1D int Array
+    '''
+    n_cells, r_c = cell_grid(box_length, r_cutoff)
+    cell = np.minimum((np.remainder(positions[:, 0], box_length) / r_c).astype(int), n_cells - 1)
+    return cell * n_slabs // n_cells
+
+
+def slab_entries(offsets, rows):
+    '''
+    Indices of the entries of a csr neighbourlist that belong to the given rows.
+    '''
+    counts = offsets[rows + 1] - offsets[rows]
+    first = np.cumsum(counts) - counts
+    return np.repeat(offsets[rows] - first, counts) + np.arange(np.sum(counts))
+
+
+class shared_arrays(object):
+    '''
+    Numpy arrays in multiprocessing.shared_memory blocks, that worker processes
+    attach to by name (see _attach) instead of receiving pickled copies.
+    '''
+
+    def __init__(self):
+        self.blocks = {}
+        return
+
+    def share(self, key, array):
+        '''
+        Copies array into the block of key, which is only replaced if the size or
+        type changes.
+
+        Returns
+        -------
+        (key, name, shape, dtype) : arguments of _attach
+        '''
+        array = np.ascontiguousarray(array)
+        block, view = self.blocks.get(key, (None, None))
+        if view is None or view.shape != array.shape or view.dtype != array.dtype:
+            if block is not None:
+                # the view has to be released before the block can be closed
+                del self.blocks[key], view
+                self.__free(block)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            self.blocks[key] = (block, view)
+        view[...] = array
+        return (key, block.name, array.shape, array.dtype)
+
+    def close(self):
+        '''
+        Frees all blocks.
+        '''
+        blocks = [block for block, view in self.blocks.values()]
+        self.blocks = {}
+        for block in blocks:
+            self.__free(block)
+        return
+
+    def __free(self, block):
+        block.close()
+        block.unlink()
+        return
+
+
+# state of a worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(**state):
+    _worker.update(state)
+    _worker['shared'] = {}
+    return
+
+
+def _attach(key, name, shape, dtype):
+    '''
+    Array key in the shared memory block name. A worker process attaches to a
+    block once and detaches, when the parent replaced the block of key.
+    '''
+    block, view = _worker['shared'].get(key, (None, None))
+    if block is None or block.name != name:
+        if block is not None:
+            # the view has to be released before the block can be closed
+            del _worker['shared'][key], view
+            block.close()
+        block = shared_memory.SharedMemory(name=name)
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        _worker['shared'][key] = (block, view)
+    return view
+
+
+def _process_slab(L, half, rows, positions_block, offsets_block, indices_block):
+    positions = _attach(*positions_block)
+    offsets = _attach(*offsets_block)
+    indices = _attach(*indices_block)
+    entries = slab_entries(offsets, rows)
+    i = np.repeat(rows, offsets[rows + 1] - offsets[rows])
+    return _worker['engine'].compute_pairs(positions, _worker['labels'], L, i, indices[entries], half)
+
+
+class parallel_pair_engine(object):
+    '''
+    Evaluates pair_engine.compute with n_workers in a concurrent.futures pool.
+
+    The particles are split into spatial slabs along x (layers of the cell
+    grid of the neighbourlist). Every task computes the forces, energy and
+    virial of the neighbourlist rows of one slab, the partial results are
+    summed at the end. With a half list, the forces of a slab also act on
+    particles of the neighbouring slabs, so every task returns a full N x 3
+    force array.
+
+    Parameters
+    ----------
+    engine : pair_engine
+
+    labels : N x 3 Array
+        labels of the particles, sent to the process workers once
+
+    n_workers : int
+        Number of threads or processes.
+
+    executor : 'thread' or 'process', optional
+        Threads share all arrays and scale as far as the NumPy kernels release
+        the GIL. Processes get the engine once and the positions and the
+        neighbourlist through multiprocessing.shared_memory. Default is 'thread'.
+
+    n_slabs : int, optional
+        Number of slabs, default is 2*n_workers for some load balancing.
+    '''
+
+    def __init__(self, engine, labels, n_workers, executor='thread', n_slabs=None):
+        if executor not in ('thread', 'process'):
+            raise ValueError("executor must be 'thread' or 'process', not %r" % (executor,))
+        self.engine = engine
+        self.labels = np.asarray(labels, dtype=float)
+        self.n_workers = n_workers
+        self.executor = executor
+        self.n_slabs = 2 * n_workers if n_slabs is None else n_slabs
+        self.pool = None
+        self.shared = shared_arrays()
+        return
+
+    def __getstate__(self):
+        # a copy starts its own pool and shared memory when it is used
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['shared'] = shared_arrays()
+        return state
+
+    def __start(self):
+        if self.executor == 'thread':
+            self.pool = ThreadPoolExecutor(self.n_workers)
+        else:
+            self.pool = ProcessPoolExecutor(self.n_workers, initializer=partial(_init_worker, engine=self.engine,
+                                                                                labels=self.labels))
+        return
+
+    def compute(self, positions, labels, L, neighbours):
+        '''
+        Forces, energy and virial of all pairs of the neighbourlist, see pair_engine.compute.
+        '''
+        if self.executor == 'process' and not np.array_equal(labels, self.labels):
+            # the process workers got the labels at their start
+            self.close()
+            self.labels = np.asarray(labels, dtype=float)
+        if self.pool is None:
+            self.__start()
+        N = np.shape(positions)[0]
+        neighbours = csr_neighbourlist.from_dicts(neighbours, None, N)
+        positions = np.asarray(positions, dtype=float)
+        L = np.asarray(L, dtype=float)
+        slab = slab_index(positions, L[0], self.engine.r_cut, self.n_slabs)
+        order = np.argsort(slab, kind='mergesort')
+        bounds = np.searchsorted(slab[order], np.arange(self.n_slabs + 1))
+        slabs = [order[bounds[s]:bounds[s + 1]] for s in range(self.n_slabs) if bounds[s + 1] > bounds[s]]
+
+        if self.executor == 'thread':
+            futures = [self.pool.submit(self.__thread_slab, positions, labels, L, neighbours, rows)
+                       for rows in slabs]
+        else:
+            blocks = (self.shared.share('positions', positions), self.shared.share('offsets', neighbours.offsets),
+                      self.shared.share('indices', neighbours.indices))
+            futures = [self.pool.submit(_process_slab, L, neighbours.half, rows, *blocks) for rows in slabs]
+
+        forces = np.zeros((N, 3))
+        energy = 0.0
+        virial = np.zeros((3, 3))
+        # reduction in the order of the slabs, so the result does not depend on the scheduling
+        for future in futures:
+            F, E, W = future.result()
+            forces += F
+            energy += E
+            virial += W
+        return forces, energy, virial
+
+    def __thread_slab(self, positions, labels, L, neighbours, rows):
+        entries = slab_entries(neighbours.offsets, rows)
+        i = np.repeat(rows, neighbours.offsets[rows + 1] - neighbours.offsets[rows])
+        return self.engine.compute_pairs(positions, labels, L, i, neighbours.indices[entries], neighbours.half)
+
+    def close(self):
+        '''
+        Shuts the pool down and frees the shared memory.
+        '''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.shared.close()
+        return
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _reciprocal_shard(shard, positions_block, charges_block):
+    '''
+    Forces, energy, virial and potential of the k-vectors of one shard. The
+    structure factor is computed from scratch, so the result does not depend on
+    which worker ran the shard before.
+    '''
+    k_list = np.array_split(_worker['k_list'], _worker['n_shards'])[shard]
+    positions = _attach(*positions_block)
+    charges = _attach(*charges_block)
+    reciprocal_sum = structure_factor(k_list, _worker['std'], _worker['volume'], _worker['epsilon0'],
+                                      _worker['box_length'])
+    reciprocal_sum.compute(charges, positions)
+    # exp(i k r_i) kernel(k) S(k)^*, its real part gives the potential, its imaginary part the forces
+    weights = reciprocal_sum.phases * (reciprocal_sum.kernel * np.conj(reciprocal_sum.S))
+    forces = charges[:, np.newaxis] * np.dot(weights.imag, k_list)
+    return (forces, reciprocal_sum.compute_energy(), reciprocal_sum.compute_virial(),
+            np.sum(weights.real, axis=1))
+
+
+class sharded_structure_factor(object):
+    '''
+    Ewald reciprocal space sum with the k-vectors split into n_shards shards,
+    that are evaluated by a pool of worker processes. Provides update,
+    compute_energy, compute_potential, compute_virial and compute_forces like
+    reciprocal.structure_factor.
+
+    The sum over k is separable: every shard computes S(k) of its k-vectors
+    from all particles and its partial forces, energy, virial and potential.
+    Positions and charges are passed through shared memory, the k-vectors once
+    at the start of the pool. The pool is started by the first update. The partial results are reduced in the order of
+    the shards, so for a fixed n_shards the results do not depend on n_workers
+    or on the scheduling.
+
+    Parameters
+    ----------
+    k_list, std, volume, epsilon0, box_length :
+        see reciprocal.structure_factor
+
+    n_workers : int
+        Number of worker processes.
+
+    n_shards : int, optional
+        Number of shards of k_list, default is n_workers.
+    '''
+
+    def __init__(self, k_list, std, volume, epsilon0, box_length=None, n_workers=2, n_shards=None):
+        self.k_list = k_list
+        self.std = std
+        self.n_workers = n_workers
+        self.n_shards = n_workers if n_shards is None else n_shards
+        self.volume = volume
+        self.epsilon0 = epsilon0
+        self.box_length = box_length
+        self.pool = None
+        self.shared = shared_arrays()
+        self.charges = None
+        self.positions = None
+        self.results = None
+        return
+
+    def __getstate__(self):
+        # a copy starts its own pool and shared memory when it is used
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['shared'] = shared_arrays()
+        return state
+
+    def __start(self):
+        self.pool = ProcessPoolExecutor(self.n_workers, initializer=partial(
+            _init_worker, k_list=np.asarray(self.k_list, dtype=float), std=self.std, volume=self.volume,
+            epsilon0=self.epsilon0, box_length=self.box_length, n_shards=self.n_shards))
+        return
+
+    def update(self, charges, positions):
+        '''
+        Evaluates all shards for the given configuration, unless it did not change.
+        '''
+        if (self.results is not None and np.shape(positions) == self.positions.shape
+                and np.array_equal(positions, self.positions) and np.array_equal(charges, self.charges)):
+            return
+        if self.pool is None:
+            self.__start()
+        self.charges = np.array(charges, dtype=float)
+        self.positions = np.array(positions, dtype=float)
+        blocks = (self.shared.share('positions', self.positions), self.shared.share('charges', self.charges))
+        futures = [self.pool.submit(_reciprocal_shard, shard, *blocks) for shard in range(self.n_shards)]
+        forces, energy, virial, potential = futures[0].result()
+        for future in futures[1:]:
+            F, E, W, phi = future.result()
+            forces = forces + F
+            energy = energy + E
+            virial = virial + W
+            potential = potential + phi
+        self.results = (forces, energy, virial, potential)
+        return
+
+    def compute_forces(self):
+        return self.results[0]
+
+    def compute_energy(self):
+        return self.results[1]
+
+    def compute_virial(self):
+        return self.results[2]
+
+    def compute_potential(self):
+        return self.results[3]
+
+    def close(self):
+        '''
+        Shuts the pool down and frees the shared memory.
+        '''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.shared.close()
+        return
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
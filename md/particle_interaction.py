@@ -1,5 +1,14 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
 from boxvectors import directions as directions
+from neighbourlist import csr_neighbourlist
+from pair_displacements import pair_displacements
+from reciprocal import spme
+from reciprocal import fft_size
+from reciprocal import structure_factor
+from backend import select_backend
+from parallel import sharded_structure_factor
+from backend import lj_pair_forces
+from backend import coulomb_pair_forces
 import numpy as np
 import time
 from scipy.special import erfc
@@ -44,18 +53,48 @@ class  coulomb(__particle_interaction):
         '''
         creates a coloumb object with properties that do not change over time
 
-        description is missing
-
+        Keyword arguments
+        -----------------
+        epsilon0 : float
+            vacuum permittivity in the units of the simulation
+        k_cut : float
+            cutoff of the reciprocal space sum
+        reciprocal : 'ewald' or 'spme'
+            method for the long range part, the direct sum over k_list or the
+            Smooth Particle Mesh Ewald method (see reciprocal.spme)
+        order : int
+            order of the B-splines of the SPME method, default 4
+        grid : int or 3 ints
+            number of grid points of the SPME method, by default chosen from k_cut
+        backend : 'numpy', 'numba' or None
+            implementation of the short range forces on a neighbourlist, see backend.select_backend
+        n_workers : int
+            if larger than 1, the k-vectors of the 'ewald' sum are split over a pool of
+            n_workers processes (see parallel.sharded_structure_factor), default 1
+        n_shards : int
+            number of shards of k_list for n_workers > 1, the results are reproducible
+            for a fixed number of shards, default n_workers
         '''
 
         self.epsilon0 = kwargs.pop('epsilon0', epsilon_0)
         k_cut = kwargs.pop('k_cut', 4 * p_error / (float)(L[0]))
+        self.reciprocal = kwargs.pop('reciprocal', 'ewald')
+        self.order = kwargs.pop('order', 4)
+        self.grid = kwargs.pop('grid', None)
+        self.backend = select_backend(kwargs.pop('backend', None))
+        self.n_workers = kwargs.pop('n_workers', 1)
+        self.n_shards = kwargs.pop('n_shards', None)
+        if self.reciprocal not in ('ewald', 'spme'):
+            raise ValueError('Unknown method for the reciprocal space: ' + str(self.reciprocal))
 
         self.std = np.sqrt(2 * p_error) / (float)(k_cut)
         self.n_boxes_short_range = n_boxes_short_range
         self.constant = 1 / (8 * np.pi * self.epsilon0)        # prefactor for the short range potential/forces
         self.volume = L[0] ** 3                            # Volume of box
+        self.box_length = L[0]
         self.k_list = self.__create_k_list(k_cut,L[0])
+        self.structure_factor = None
+        self.spme = self.__create_spme(k_cut, L[0])
         return
 
     def compute_optimal_cutoff(self, p_error, L, labels, neighbours, distances, r_switch, r_cut, positions):
@@ -76,13 +115,24 @@ class  coulomb(__particle_interaction):
 
         R_opt_cut = np.sqrt(p_error / (float)(np.pi)) * (factor * T_k / (float)(T_r)) ** (1 / 6.0) * \
                     (L[0] / (positions.shape[1] ** (1 / 6.0)))
+        # r_cut is the largest allowed cutoff, the neighbourlist kernels use the minimum image convention
+        R_opt_cut = min(R_opt_cut, r_cut)
         K_opt_cut = 2 * p_error / R_opt_cut
-
-        self.k_list = self.__create_k_list(K_opt_cut,L[0])
-        self.std = np.sqrt(2 * p_error) / (float)(K_opt_cut)
+        self.set_cutoff(p_error, L, K_opt_cut)
 
         return (R_opt_cut, K_opt_cut, self.std)
 
+    def set_cutoff(self, p_error, L, k_cut, k_list=None):
+        '''
+        Sets the cutoff of the reciprocal space sum and the matching std, as
+        compute_optimal_cutoff does, without the timing run (e.g. for a cutoff
+        read from a checkpoint). A given k_list is used instead of the one of k_cut.
+        '''
+        self.k_list = self.__create_k_list(k_cut, L[0]) if k_list is None else np.array(k_list, dtype=float)
+        self.std = np.sqrt(2 * p_error) / (float)(k_cut)
+        self.spme = self.__create_spme(k_cut, L[0])
+        return
+
     def __create_k_list(self, k_cutoff, boxlength):
 
         # maximum factor for k (k_max = 2*pi/L *n_max)
@@ -99,6 +149,45 @@ class  coulomb(__particle_interaction):
 
         return k_list
 
+    def __get_structure_factor(self, charges, positions):
+        '''
+        Returns the structure factor updated to the given configuration. It is created
+        again, whenever k_list or std were replaced (e.g. by compute_optimal_cutoff).
+        '''
+        if (self.structure_factor is None or self.structure_factor.k_list is not self.k_list
+                or self.structure_factor.std != self.std):
+            if isinstance(self.structure_factor, sharded_structure_factor):
+                self.structure_factor.close()
+            if self.n_workers > 1:
+                self.structure_factor = sharded_structure_factor(self.k_list, self.std, self.volume, self.epsilon0,
+                                                                 self.box_length, self.n_workers, self.n_shards)
+            else:
+                self.structure_factor = structure_factor(self.k_list, self.std, self.volume, self.epsilon0,
+                                                         self.box_length)
+        self.structure_factor.update(charges, positions)
+        return self.structure_factor
+
+    def close(self):
+        '''
+        Stops the worker processes of a sharded reciprocal sum (n_workers > 1).
+        '''
+        if isinstance(self.structure_factor, sharded_structure_factor):
+            self.structure_factor.close()
+        self.structure_factor = None
+        return
+
+    def __create_spme(self, k_cutoff, boxlength):
+        '''
+        Creates the SPME solver for the current std, if it is the selected method.
+        Without a given grid, the grid resolves twice the largest k-vector of k_list.
+        '''
+        if self.reciprocal != 'spme':
+            return None
+        grid = self.grid
+        if grid is None:
+            grid = fft_size(max(2 * k_cutoff * boxlength / np.pi, 2 * self.order))
+        return spme(boxlength, self.std, self.epsilon0, grid, self.order)
+
     def compute_potential(self,labels, positions, neighbours, distances, r_s, r_c):
         """
         short range potential
@@ -112,7 +201,7 @@ class  coulomb(__particle_interaction):
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
             Particle A should have the label 0 and Particle B should have the label 1. The first column contains the masses, the second the charge.
 
-        neighbours : dictionary of lists
+        neighbours : dictionary of lists or csr_neighbourlist
             all neighbours within given cutoff radius + skin radius
 
         distances : like neighbours
@@ -135,7 +224,7 @@ class  coulomb(__particle_interaction):
         Calculates a switch function that is for calculating the Potential.
 
         x1 = (x-r_0)/(r_c-r_0)
-        return 2x1**2 -3x**2 +1
+        return 1 -10x1**3 +15x1**4 -6x1**5
 
         Parameters
         ----------
@@ -154,7 +243,7 @@ class  coulomb(__particle_interaction):
         rStar = (x - r_0) / (r_c - r_0)
         rStarSquare = rStar**2
         rStarSquareSquare = rStarSquare**2
-        return -6 * rStar * rStarSquareSquare + 15 * rStarSquareSquare - 10*rStarSquareSquare*rStarSquare + 1
+        return -6 * rStar * rStarSquareSquare + 15 * rStarSquareSquare - 10*rStarSquare*rStar + 1
 
 
     def __short_range_potential(self, labels, neighbours, distances, r_s, r_c):#distances should have the same format/order as the neighborlist
@@ -169,7 +258,7 @@ class  coulomb(__particle_interaction):
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
             Particle A should have the label 0 and Particle B should have the label 1. The first column contains the masses, the second the charge.
 
-        neighbours : dictionary of lists
+        neighbours : dictionary of lists or csr_neighbourlist
             all neighbours within given cutoff radius + skin radius
 
         distances : like neighbours
@@ -181,15 +270,22 @@ class  coulomb(__particle_interaction):
             ..the short range potential at the position of each particle. The potentials within the array are in the same order as the positions in the positions array.
         """
         n_particles = np.shape(labels)[0]
+        neighbours = csr_neighbourlist.from_dicts(neighbours, distances, n_particles)
+        i = neighbours.rows()
+        j = neighbours.indices
+        absDistance = neighbours.distances
+        charges = np.asarray(labels[:, 1], dtype=float)
+
+        #short range coulomb potential of all pairs, switched beyond r_s
+        potential = 1 / absDistance * erfc(absDistance / (np.sqrt(2) * self.std))
+        switched = absDistance >= r_s
+        potential[switched] *= self.__switchFunction(absDistance[switched], r_s, r_c)
         shortPotential = np.zeros(n_particles,dtype=float)
+        shortPotential += np.bincount(i, charges[j] * potential, minlength=n_particles)
 
-        for i in neighbours:
-            for j,absDistance in zip(neighbours[i],distances[i]):#TIMEPROBLEM http://stackoverflow.com/questions/1663807/how-can-i-iterate-through-two-lists-in-parallel-in-python
-
-                if absDistance < r_s:
-                    shortPotential[i] += labels[j, 1] / absDistance * erfc(absDistance / (np.sqrt(2) * self.std))       #calculating and summing the short range coulomb potential
-                else:
-                    shortPotential[i] += self.__switchFunction(absDistance, r_s, r_c) * (labels[j, 1] / absDistance * erfc(absDistance / (np.sqrt(2) * self.std)))
+        if neighbours.half:
+            #every pair is only stored once, the potential at j is added here
+            shortPotential += np.bincount(j, charges[i] * potential, minlength=n_particles)
 
         shortPotential *= self.constant
         return shortPotential
@@ -214,104 +310,13 @@ class  coulomb(__particle_interaction):
                 vector : N x 1 Array
                     Array with the potential at each particle position
         '''
-        
-        # initializes all necessary arrays, which will be reused => COMMENT (@daviezz): I Would delete them here. They get over written anyway.
-        #matrix = np.zeros((self.k_list.shape[1],positions.shape[1]))
-        #vector = np.zeros(self.k_list.shape[1])
-        #return_vector = np.zeros(positions.shape[1])
-
-        # compute 1 x K vector of |k|^2 =
-        #
-        # [
-        # k11^2 + k21^2 + k31^2 ,
-        # k12^2 + k22^2 + k32^2 ,
-        # k13^2 + k23^2 + k33^2 ,
-        # ...
-        # ]
-        # with ki = (k1i k2i k3i)
-        # each row is like going through k
-
-        vector = np.sum(np.square(self.k_list), axis = 1)
-
-        # compute 1 x K vector of the Gaussian part exp(-sigma^2 * |k|^2) / |k|^2
-        #
-        # [
-        # exp(-sigma^2 * (k11^2 + k21^2 + k31^2)) / (k11^2 + k21^2 + k31^2) ,
-        # exp(-sigma^2 * (k12^2 + k22^2 + k32^2)) / (k12^2 + k22^2 + k32^2) ,
-        # exp(-sigma^2 * (k13^2 + k23^2 + k33^2)) / (k13^2 + k23^2 + k33^2) ,
-        # ...
-        # ]
-        # with ki = (k1i k2i k3i)
-        # each row is like going through k
-
-        vector = np.divide(np.exp(-np.multiply(vector, self.std ** 2 / (float)(2))), vector)
-
-        # compute K x R matrix of the scalar <k,r> =
-        #
-        # [
-        # [k1r1, k1r2, k1r3, ...] ,
-        # [k2r1, k2r2, k2r3, ...] ,
-        # [k3r1, k3r2, k3r3, ...] ,
-        # [...]
-        # ]
-        # with ri = (rxi, ryi, rzi) and ki = (k1i k2i k3i)
-        # going through the rows is like going through the k values
-        # going through the columns is like going through the positions r
-
-        matrix = np.dot(self.k_list, np.transpose(positions))
-
-        # compute 1 x K vector of the elementwise product of the Gaussian part and the structural factor {elementwise product}
-        #
-        # [
-        # k1r1q1 + k1r2q2 + k1r3q3 + ... ,
-        # k2r1q1 + k2r2q2 + k2r3q3 + ... ,
-        # k3r1q1 + k3r2q2 + k3r3q3 + ... ,
-        # ...
-        # ]
-        #
-        # *
-        #
-        # [
-        # (exp(-sigma^2 * (k11^2 + k21^2 + k31^2)) / (k11^2 + k21^2 + k31^2)) * (k1r1q1 + k1r2q2 + k1r3q3 + ...) ,
-        # (exp(-sigma^2 * (k12^2 + k22^2 + k32^2)) / (k12^2 + k22^2 + k32^2)) * (k2r1q1 + k2r2q2 + k2r3q3 + ...) ,
-        # (exp(-sigma^2 * (k13^2 + k23^2 + k33^2)) / (k13^2 + k23^2 + k33^2)) * (k3r1q1 + k3r2q2 + k3r3q3 + ...) ,
-        # ...
-        # ]
-        # with ki = (k1i k2i k3i) and qi = [q1, q2, q3, ...]
-        # each row is like going through k
-
-        vector = np.multiply(vector, np.dot(np.exp(-1j * matrix), charges))
-
-        # compute 1 x R vector of the potential phi = transpose[matrix] * elementwise product {inner product}
-        #
-        # [
-        # [k1r1, k2r1, k3r1, ...] ,
-        # [k1r2, k2r2, k3r2, ...] ,
-        # [k1r3, k2r3, k3r3, ...] ,
-        # [...]
-        # ]
-        #
-        # *
-        #
-        # [
-        # (exp(-sigma^2 * (k11^2 + k21^2 + k31^2)) / (k11^2 + k21^2 + k31^2)) * (k1r1q1 + k1r2q2 + k1r3q3 + ...) ,
-        # (exp(-sigma^2 * (k12^2 + k22^2 + k32^2)) / (k12^2 + k22^2 + k32^2)) * (k2r1q1 + k2r2q2 + k2r3q3 + ...) ,
-        # (exp(-sigma^2 * (k13^2 + k23^2 + k33^2)) / (k13^2 + k23^2 + k33^2)) * (k3r1q1 + k3r2q2 + k3r3q3 + ...) ,
-        # ...
-        # ]
-        #
-        # =
-        #
-        # [
-        # matrix[0,0] * vector[0] + matrix[0,1] * vector[1] + matrix[0,2] * vector[2] + ...
-        # matrix[1,0] * vector[0] + matrix[1,1] * vector[1] + matrix[1,2] * vector[2] + ...
-        # matrix[2,0] * vector[0] + matrix[2,1] * vector[1] + matrix[2,2] * vector[2] + ...
-        # ]
-
-        return_vector = np.dot(np.exp(1j*np.transpose(matrix)), vector)
-        return_vector = np.multiply(return_vector, 1 / (float)(self.volume * self.epsilon0))
-
-        return return_vector.real
+        if self.spme is not None:
+            return self.spme.compute_potential(charges, positions)
+
+        # phi_i = 1/(V epsilon0) sum_k exp(-sigma^2 |k|^2 / 2) / |k|^2 * Re(exp(i k r_i) * S(k)^*)
+        # with the structure factor S(k) = sum_j q_j exp(i k r_j), which is only updated
+        # for the particles that moved since the last call
+        return self.__get_structure_factor(charges, positions).compute_potential()
 
     def compute_energy(self,labels,positions, neighbours, distances, r_s, r_c):
 
@@ -388,25 +393,149 @@ class  coulomb(__particle_interaction):
                     float value of the total long range energy
         '''
         
-        #calculates the long range potential
-        long_range_potential = self.__long_range_potential(labels[:,1],positions)
-
         # calculates the self-interaction potential
-        self_energy = np.sum(np.array(labels[:,1]) ** 2) / (float)(2 * self.epsilon0 * self.std * np.power(2 * np.pi, 1.5))
+        self_energy = self.compute_self_energy(labels[:,1])
+
+        if self.spme is not None:
+            return self.spme.compute_energy(labels[:,1], positions) - self_energy
+
+        # 1/(2 V epsilon0) sum_k exp(-sigma^2 |k|^2 / 2) / |k|^2 |S(k)|^2, O(K) once S(k) is known
+        return self.__get_structure_factor(labels[:,1], positions).compute_energy() - self_energy
+
+    def compute_long_range(self, labels, positions):
+        '''
+        Reciprocal space forces, energy (minus the self energy, as in compute_energy)
+        and virial tensor of one configuration.
+
+        Parameters
+        ----------
+        labels: Nx3 Array
+            The second column contains the charges.
 
-        return 0.5 * np.sum(np.multiply(long_range_potential,labels[:,1])) - self_energy
+        positions: N x 3 Array
 
-    def compute_forces(self,d_Pos, Labels,L):
+        Returns
+        -------
+        forces : N x 3 Array
+        energy : float
+        virial : 3 x 3 Array
         '''
+        charges = labels[:,1]
+        if self.spme is not None:
+            forces, energy, virial = self.spme.compute_forces_energy_virial(charges, positions)
+        else:
+            reciprocal_sum = self.__get_structure_factor(charges, positions)
+            forces = reciprocal_sum.compute_forces()
+            energy = reciprocal_sum.compute_energy()
+            virial = reciprocal_sum.compute_virial()
+        return forces, energy - self.compute_self_energy(charges), virial
+
+    def compute_self_energy(self, charges):
+        '''
+        Self energy sum_i q_i^2 / (2 epsilon0 std (2 pi)^(3/2)) of the Gaussian charge
+        distributions, which the reciprocal space sum contains and the long range energy subtracts.
+
+        Parameters
+        ----------
+        charges : N x 1 Array
 
-        please add here description
+        Returns
+        -------
+        self_energy : float
+        '''
+        return np.sum(np.array(charges) ** 2) / (float)(2 * self.epsilon0 * self.std * np.power(2 * np.pi, 1.5))
 
+    def compute_forces(self,d_Pos, Labels,L, neighbours=None):
         '''
-        
-        Coulumb_forces = self.__short_range_forces(d_Pos, Labels,L) + self.__long_range_forces(d_Pos, Labels)
+        Calculates the coulomb forces as sum of the short- and long-range part.
+
+        Parameters
+        ----------
+        d_Pos: pair_displacements or NxNx3 Array
+            Displacements d_Pos[a,b] = r_a - r_b. A dense array is only read once to
+            recover the positions, both parts then work on blocks of rows.
+
+        Labels: Nx3 Array
+            Array with N rows and 3 Columns. The first column contains the masses, the second the charge.
+
+        L:3x1 Array
+            Array containg the Dimensions of the Simulation box
+
+        neighbours: dictionary of lists or csr_neighbourlist, optional
+            Neighbourlist within the real space cutoff r_cut_coulomb. If given, the short-range
+            part is only evaluated for these pairs with minimum image displacements,
+            otherwise for all pairs in all n_boxes_short_range periodic images.
+
+        Returns
+        -------
+        Coulumb_forces: Nx3 Array
+        '''
+        if not isinstance(d_Pos, pair_displacements):
+            d_Pos = pair_displacements.from_dense(d_Pos)
+
+        if neighbours is None:
+            Force_short_range = self.__short_range_forces(d_Pos, Labels,L)
+        else:
+            Force_short_range = self.__short_range_forces_neighbourlist(d_Pos.positions, Labels, L, neighbours)
+
+        Coulumb_forces = Force_short_range + self.__long_range_forces(d_Pos, Labels)
 
         return Coulumb_forces
       
+    def __short_range_forces_neighbourlist(self, positions, Labels, L, neighbours):
+        ''' Calculate the short range coulomb Force for the pairs of a neighbourlist
+
+        Every pair is evaluated once with its minimum image displacement, so the
+        cutoff of the neighbourlist has to be smaller than L/2.
+
+        Parameters
+        ---------------
+
+        positions: Nx3 Array
+            Array with N rows and 3 Columns. Contains the Positions of each Particle component wise.
+
+        Labels: Nx3 Array
+            Array with N rows and 3 Columns. The first column contains the masses, the second the charge.
+
+        L:3x1 Array
+            Array containg the Dimensions of the Simulation box
+
+        neighbours: dictionary of lists or csr_neighbourlist
+            entry i contains all neighbours of particle i within the real space cutoff
+
+        Returns
+        --------------
+
+        Force_short_range: Nx3 Array
+            Array with N rows and 3 Columns. Each Row i contains the short-range-Force acting upon Particle i componentwise. 
+
+        '''
+        N = np.shape(positions)[0]
+        neighbours = csr_neighbourlist.from_dicts(neighbours, None, N)
+        charges = np.asarray(Labels[:,1], dtype=float)
+        if self.backend == 'numba':
+            return coulomb_pair_forces(np.asarray(positions, dtype=float), neighbours.offsets, neighbours.indices,
+                                       neighbours.half, np.asarray(L, dtype=float), charges, self.std, self.constant)
+        i = neighbours.rows()
+        j = neighbours.indices
+
+        # r_j - r_i
+        dr = neighbours.minimum_image(positions, np.asarray(L, dtype=float))
+        r2 = np.einsum('ij,ij->i', dr, dr)
+        r = np.sqrt(r2)
+        coefficient = charges[i]*charges[j]/r2*(erfc( r/np.sqrt(2.0) /self.std) /r
+                                                +np.sqrt(2.0/np.pi) /self.std *np.exp( -r2 /2.0 /self.std**2 ) )
+        coefficient /= (8*np.pi*self.epsilon0)
+
+        # force on i points along r_i - r_j = -dr
+        Force_short_range = np.zeros((N,3))
+        for axis in range(3):
+            Force_short_range[:,axis] = -np.bincount(i, coefficient*dr[:,axis], minlength=N)
+            if neighbours.half:
+                # Newton's third law, the pair is stored only once
+                Force_short_range[:,axis] += np.bincount(j, coefficient*dr[:,axis], minlength=N)
+
+        return Force_short_range
 
     def __short_range_forces(self,d_Pos, Labels,L):
 
@@ -415,11 +544,8 @@ class  coulomb(__particle_interaction):
         Parameters
         ---------------
 
-        d_Pos: NxNx3 Array
-            Array with N rows and 3 Columns, each row i contains the x,y and z coordinates of particle i.
-
-        R: Nx1 Array
-            Array with N entries. Contains each Particles Distance to the coordinate origin.
+        d_Pos: pair_displacements
+            Provider of the displacements d_Pos[a,b] = r_a - r_b.
 
         Labels: Nx3 Array
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
@@ -442,57 +568,26 @@ class  coulomb(__particle_interaction):
         K[:,2] *=L[2]
 
         N = d_Pos.shape[0]
-        Force_short_range = np.zeros((N,3))
-        
-        
- 
-        d_Pos_fix = np.zeros(((N-1 )*N,3))
-        d_Pos_fix[:,0] = np.delete(d_Pos[:,:,0].reshape(-1),np.where(np.linalg.norm(d_Pos,axis=2).reshape(-1)==0)).reshape((N-1)*N)
-        d_Pos_fix[:,1] = np.delete(d_Pos[:,:,1].reshape(-1),np.where(np.linalg.norm(d_Pos,axis=2).reshape(-1)==0)).reshape((N-1)*N)
-        d_Pos_fix[:,2] = np.delete(d_Pos[:,:,2].reshape(-1),np.where(np.linalg.norm(d_Pos,axis=2).reshape(-1)==0)).reshape((N-1)*N)
-
-        Pos_Comb = np.zeros((K.shape[0], (N-1)*N,3))
-        Pos_Comb[:,:,0]=np.add.outer(K[:,0],d_Pos_fix[:,0]) # x
-        Pos_Comb[:,:,1]=np.add.outer(K[:,1],d_Pos_fix[:,1]) # y
-        Pos_Comb[:,:,2]=np.add.outer(K[:,2],d_Pos_fix[:,2]) # z
-
-
-        ind = np.where(np.linalg.norm(d_Pos,axis=2).reshape(-1)==0)[0]
-        ind_1 =(np.cumsum(np.ones(ind.shape))*N-N).astype(int)
-
-        Pos_Comb_norm_1 = np.linalg.norm(Pos_Comb, axis=2)
-        Pos_Comb_norm_2 = np.power(Pos_Comb_norm_1,2)
-
-        charges = np.multiply.outer(Labels[:,1],np.ones(N)).reshape(-1)
-        charges = np.delete(charges, np.where(np.linalg.norm(d_Pos,axis=2).reshape(-1)==0))
-
+        charges = np.asarray(Labels[:,1], dtype=float)
         F_short = np.zeros((N,3))
-        #x
-        F_short[:,0] =np.sum(np.insert(np.sum(charges*Pos_Comb[:,:,0]/Pos_Comb_norm_2
-                                              *(erfc( Pos_Comb_norm_1/np.sqrt(2.0) /self.std) /Pos_Comb_norm_1 
-                                                +np.sqrt(2.0/np.pi) /self.std *np.exp( -Pos_Comb_norm_2 /2.0 /self.std**2 ) )
-                                              ,axis=0)
-                                       ,ind_1,0).reshape(N,N) 
-                             ,axis=0)
-        #y
-        F_short[:,1] =np.sum(np.insert(np.sum(charges*Pos_Comb[:,:,1]/Pos_Comb_norm_2
-                                              *(erfc( Pos_Comb_norm_1/np.sqrt(2.0) /self.std) /Pos_Comb_norm_1 
-                                                +np.sqrt(2.0/np.pi) /self.std *np.exp( -Pos_Comb_norm_2 /2.0 /self.std**2 ) )
-                                              ,axis=0)
-                                       ,ind_1,0).reshape(N,N) 
-                             ,axis=0)
-        #z
-        F_short[:,2] =np.sum(np.insert(np.sum(charges*Pos_Comb[:,:,2]/Pos_Comb_norm_2
-                                              *(erfc( Pos_Comb_norm_1/np.sqrt(2.0) /self.std) /Pos_Comb_norm_1 
-                                                +np.sqrt(2.0/np.pi) /self.std *np.exp( -Pos_Comb_norm_2 /2.0 /self.std**2 ) )
-                                              ,axis=0)
-                                       ,ind_1,0).reshape(N,N) 
-                             ,axis=0)
+
+        # the periodic images are added one after another to a block of rows a,
+        # so only one (rows)xNx3 array exists at a time
+        for start, stop, d_chunk in d_Pos.chunks(width=4):
+            # pairs of identical positions (a == b) do not interact, in no image
+            mask = np.linalg.norm(d_chunk, axis=2) != 0
+            q = charges[start:stop, np.newaxis]
+            for k in K:
+                Pos_Comb = d_chunk + k
+                Pos_Comb_norm_2 = np.einsum('abi,abi->ab', Pos_Comb, Pos_Comb)
+                Pos_Comb_norm_1 = np.sqrt(Pos_Comb_norm_2)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    prefactor = q/Pos_Comb_norm_2*(erfc( Pos_Comb_norm_1/np.sqrt(2.0) /self.std) /Pos_Comb_norm_1
+                                                   +np.sqrt(2.0/np.pi) /self.std *np.exp( -Pos_Comb_norm_2 /2.0 /self.std**2 ) )
+                prefactor = np.where(mask, prefactor, 0)
+                F_short += np.einsum('ab,abi->bi', prefactor, Pos_Comb)
         F_short*=np.outer(Labels[::-1,1],np.ones(3))/(8*np.pi*self.epsilon0)
 
-        F_short
-        
-        
         return F_short
 
 
@@ -503,8 +598,8 @@ class  coulomb(__particle_interaction):
         Parameters
         ---------------
 
-        d_Pos: NxNx3 Array
-            Array with N rows and 3 Columns, each row i contains the x,y and z coordinates of particle i.
+        d_Pos: pair_displacements
+            Provider of the displacements d_Pos[a,b] = r_a - r_b.
             
         Labels: Nx3 Array
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
@@ -519,28 +614,25 @@ class  coulomb(__particle_interaction):
             Array with N rows and 3 Columns. Each Row i contains the long-range-Force acting upon Particle i componentwise. 
 
         '''
-        # k_i = - k_j for one pair i,j, delete one of them
-        k1 = np.delete(self.k_list, (np.arange((np.shape(self.k_list)[0])/2)), axis=0)
-        
-        # compute scalar product between k and (r_i - r_j), SPM = MxNxN array, M = number of k-vectors, N = number of particles
-        SPM = np.tensordot(k1,d_Pos,(1,2))
-        # compute right sum in equation, return MxN array
-        sum1= (np.tensordot(Labels[:,1],np.sin(SPM), axes =(0,2)))
-        
-        # compute |k|^2
-        k_betqua = np.linalg.norm(k1,axis=1)**2
-        # obtain Mx3 array
-        k_betqua_right_size = np.outer(k_betqua, np.ones(3))
-        # compute exp(std^2*|k|^2/2)*k/|k|^2
-        k = np.exp(-self.std**2*k_betqua_right_size/2)*k1/k_betqua_right_size
-        # executes sum over all k and multiplication with q_i / (V*epsilon_0)
-        Force_long_range = np.tensordot(sum1, k, (0,0))*(np.outer(Labels[:,1],np.ones(3))/self.volume/self.epsilon0)*2
-        return Force_long_range
+        if self.spme is not None:
+            return self.spme.compute_forces(Labels[:,1], d_Pos.positions)
+
+        # F_i = q_i/(V epsilon0) sum_k exp(-sigma^2 |k|^2 / 2) k / |k|^2 * Im(exp(i k r_i) * S(k)^*)
+        return self.__get_structure_factor(Labels[:,1], d_Pos.positions).compute_forces()
 
 
 class lennard_jones(__particle_interaction):
+    '''
+    class to compute the Lennard-Jones interaction
 
-    def __init__(self):
+    Parameters
+    ----------
+    backend : 'numpy', 'numba' or None, optional
+        implementation of compute_forces, see backend.select_backend
+    '''
+
+    def __init__(self, backend=None):
+        self.backend = select_backend(backend)
         return
 
     def __switchFunction(self,x,r_0,r_c):
@@ -549,7 +641,7 @@ class lennard_jones(__particle_interaction):
         Calculates a switch function that is for calculating the Potential.
 
         x1 = (x-r_0)/(r_c-r_0)
-        return 2x1**2 -3x**2 +1
+        return 1 -10x1**3 +15x1**4 -6x1**5
 
         Parameters
         ----------
@@ -568,7 +660,7 @@ class lennard_jones(__particle_interaction):
         rStar       = (x-r_0)/(r_c-r_0)
         rStarSquare = rStar**2
         rStarSquareSquare = rStarSquare**2
-        return -6 * rStar * rStarSquareSquare + 15 * rStarSquareSquare - 10*rStarSquareSquare*rStarSquare + 1
+        return -6 * rStar * rStarSquareSquare + 15 * rStarSquareSquare - 10*rStarSquare*rStar + 1
 
     def compute_potential(self, sigma, epsilon, labels, neighbours, distances, r_s, r_c):
         """
@@ -582,7 +674,7 @@ class lennard_jones(__particle_interaction):
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
             Particle A should have the label 0 and Particle B should have the label 1. The first column contains the masses, the second the charge.
 
-        neighbours : dictionary of lists
+        neighbours : dictionary of lists or csr_neighbourlist
             all neighbours within given cutoff radius + skin radius
 
         distances : like neighbours
@@ -600,16 +692,22 @@ class lennard_jones(__particle_interaction):
                 ..the short range potential at the position of each particle. The potentials within the array are in the same order as the positions in the positions array.
         """
         n_particles = np.shape(labels)[0]
+        neighbours = csr_neighbourlist.from_dicts(neighbours, distances, n_particles)
+        i = neighbours.rows()
+        j = neighbours.indices
+        absDistance = neighbours.distances
+        index_LJ = (labels[i,2]+labels[j,2]).astype(int)
+
+        sigmaPoSix = (np.asarray(sigma, dtype=float)[index_LJ]/absDistance)**6               #precalulating the sixth power
+        potential = 4*np.asarray(epsilon, dtype=float)[index_LJ]*(sigmaPoSix**2-sigmaPoSix)  #calculating the Lennard Jones potential of all pairs
+        switched = absDistance >= r_s
+        potential[switched] *= self.__switchFunction(absDistance[switched],r_s,r_c)
         shortPotentialL = np.zeros(n_particles,dtype=float)
+        shortPotentialL += np.bincount(i, potential, minlength=n_particles)
 
-        for i in neighbours:
-            for j,absDistance in zip(neighbours[i],distances[i]):#TIMEPROBLEM http://stackoverflow.com/questions/1663807/how-can-i-iterate-through-two-lists-in-parallel-in-python
-                #print i,j,absDistance,labels[i,2]+labels[j,2]#, (sigma[labels[i,2]+labels[j,2]]/absDistance)**6
-                sigmaPoSix = (sigma[int(labels[i,2]+labels[j,2])]/absDistance)**6                                       #precalulating the sixth power
-                if absDistance<r_s:
-                    shortPotentialL[i] += 4*epsilon[int(labels[i,2]+labels[j,2])]*(sigmaPoSix**2-sigmaPoSix)                #calculating and summing the Lennard Jones potential
-                else:
-                    shortPotentialL[i] += self.__switchFunction(absDistance,r_s,r_c)*(4 * epsilon[int(labels[i, 2] + labels[j, 2])] * (sigmaPoSix ** 2 - sigmaPoSix))
+        if neighbours.half:
+            #every pair is only stored once, the potential at j is added here
+            shortPotentialL += np.bincount(j, potential, minlength=n_particles)
         return shortPotentialL
 
     def compute_energy(self, sigma, epsilon, labels, neighbours, distances, r_s, r_c):
@@ -622,7 +720,7 @@ class lennard_jones(__particle_interaction):
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
             Particle A should have the label 1 and Particle B should have the label 0. The first column contains the masses, the second the charge.
 
-        neighbours : dictionary of lists
+        neighbours : dictionary of lists or csr_neighbourlist
             all neighbours within given cutoff radius + skin radius
 
         distances : like neighbours
@@ -667,13 +765,13 @@ class lennard_jones(__particle_interaction):
             Array with N rows and ? Columns. The third Column should contain labels, that specify the chemical species of the Particles.
             Particle A should have the label 0 and Particle B should have the label 1. The first column contains the masses, the second the charge.
 
-        switch_parameter: 4x1 Array
-            Array that contains the coefficient values for the switch polynomial
+        switch_parameter: 1D Array
+            Coefficients c_k of the switch polynomial S(r) = sum_k c_k r^k, lowest order first.
 
         r_switch: float
             Distance where the switch function kicks in. 
 
-        neighbours: dictionary of lists
+        neighbours: dictionary of lists or csr_neighbourlist
             all neighbours within given cutoff radius + skin radius
         Returns
         --------------
@@ -682,47 +780,46 @@ class lennard_jones(__particle_interaction):
             Array with N rows and 3 Columns. Each Row i contains the LJ-Force acting upon Particle i componentwise. 
 
         '''
-        #Get Neighbour-List, naive_Dists should be replaced in the future by Nils' Work
-        
-
         N = np.size(Positions[:,0])
-        Force_LJ = np.zeros((N,3))
-
-        for i in np.arange(N):
-            #Find the Indices that should be used for sigma and eps (by adding the corresponding labels)
-            index_LJ = (Labels[i,2]*np.ones(N) +Labels[:,2]).astype('int')
-
-            #Create Arrays that contain the approriate Values for sigma and eps, depending on the interaction pair.
-            sig6 =(Sigma*np.ones( (N,3) ) )[0,index_LJ]**6
-            eps = (Epsilon*np.ones( (N,3) ) )[0,index_LJ]
+        neighbours = csr_neighbourlist.from_dicts(neighbours, None, N)
+        if self.backend == 'numba':
+            return lj_pair_forces(np.asarray(Positions, dtype=float), neighbours.offsets, neighbours.indices,
+                                  neighbours.half, np.asarray(L, dtype=float), np.asarray(Labels[:,2], dtype=np.int64),
+                                  np.asarray(Sigma, dtype=float)**6, np.asarray(Epsilon, dtype=float),
+                                  np.asarray(switch_parameter, dtype=float), r_switch)
+        i = neighbours.rows()
+        j = neighbours.indices
+        #the neighbourlist may be older than Positions, so the displacements r_j - r_i are recomputed
+        Displacements = neighbours.minimum_image(Positions, np.asarray(L, dtype=float))
+        dist_2 = np.einsum('ij,ij->i', Displacements, Displacements)
+
+        #Find the Indices that should be used for sigma and eps (by adding the corresponding labels)
+        index_LJ = (Labels[i,2] +Labels[j,2]).astype('int')
+        sig6 = (np.asarray(Sigma, dtype=float)**6)[index_LJ]
+        eps = np.asarray(Epsilon, dtype=float)[index_LJ]
+
+        #sigma to distance ratio
+        sig6_dist_ratio = sig6 /dist_2**3
+        potential = 4 *eps *(sig6_dist_ratio**2 -sig6_dist_ratio)
+        #dV/dr divided by r, the force on i is dV/dr /r *(r_j - r_i)
+        dV_r = -24 *eps *(2 *sig6_dist_ratio**2 -sig6_dist_ratio) /dist_2
+
+        #In the switched region the potential is V*S with the switch polynomial
+        #S(r) = sum_k switch_parameter[k] r^k, so dV/dr becomes V'*S + V*S'
+        switched = dist_2 >= r_switch**2
+        if np.any(switched):
+            dist = np.sqrt(dist_2[switched])
+            S = np.polynomial.polynomial.polyval(dist, switch_parameter)
+            dS = np.polynomial.polynomial.polyval(dist, np.polynomial.polynomial.polyder(switch_parameter))
+            dV_r[switched] = dV_r[switched] *S +potential[switched] *dS /dist
 
-            Positions_Difference = Positions - Positions[i,:] 
-            
-            Positions_Difference[:,0] = np.fmod(Positions_Difference[:,0],(L[0]/2))
-            Positions_Difference[:,1] = np.fmod(Positions_Difference[:,1],(L[1]/2))
-            Positions_Difference[:,2] = np.fmod(Positions_Difference[:,2],(L[2]/2))
-            
-            #Calculate the Distances
-            dist = np.linalg.norm(Positions_Difference, axis = 1)
-            dist_8 = dist**8
-            dist_2 = dist**2
-            for j in neighbours[i]:
-
-                #Calculate the Value of the switch Function
-                Switch = (switch_parameter[0]+switch_parameter[1]*dist[j]+switch_parameter[2]*dist_2[j]+switch_parameter[3]*dist[j]*dist_2[j])
-                #Calculate the derivate of the switch Function
-                d_Switch = (switch_parameter[1]/(2*np.sqrt(dist[j])) +switch_parameter[2] + 1.5*switch_parameter[3]*np.sqrt(dist[j]))
-
-                #sigma to distance ratio
-                sig6_dist_ratio = sig6[j] /dist[j]**6
-
-                if dist[j] < r_switch:
-                    #This is the Analytical Expression for the LJ force
-                    Force_LJ[i,:] += 48.0 *eps[j] *sig6[j] *Positions_Difference[j,:] /dist_8[j] *(-sig6_dist_ratio +0.5)
-                else:
-                    #This is the derivative of the switch-function, used to cut the LJ-Potential
-                    Force_LJ[i,:] += 8.0 *eps[j] *Positions_Difference[i,:] *sig6_dist_ratio*(
-                    (6 /dist_2[j]*(-sig6_dist_ratio +0.5)*Switch ) +(d_Switch)*( sig6_dist_ratio-1)) 
+        Force_LJ = np.zeros((N,3))
+        for axis in range(3):
+            Force_pairs = dV_r *Displacements[:,axis]
+            Force_LJ[:,axis] = np.bincount(i, Force_pairs, minlength=N)
+            if neighbours.half:
+                #Newton's third law, every pair is only stored once
+                Force_LJ[:,axis] -= np.bincount(j, Force_pairs, minlength=N)
 
         return Force_LJ
      
@@ -0,0 +1,593 @@
+'''
+Reciprocal space part of the Ewald summation
+'''
+import numpy as np
+
+
+def fft_size(n):
+    '''
+    Smallest number >= n with no prime factors other than 2, 3 and 5.
+    numpy.fft is fastest for these sizes.
+    '''
+    n = max(int(np.ceil(n)), 1)
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def bspline_weights(w, order):
+    '''
+    Values and derivatives of the cardinal B-spline M_n for the points w + j, j = 0, ..., n-1.
+
+    The spline is built with the recursion
+    M_n(x) = x/(n-1) M_(n-1)(x) + (n-x)/(n-1) M_(n-1)(x-1),
+    all points and all particles at once.
+
+    Parameters
+    ----------
+    w : np.array
+        Fractional part of the scaled coordinates, values in [0,1).
+
+    order : int
+        Order n of the spline, the spline is nonzero on (0,n).
+
+    Returns
+    -------
+    M : np.array, shape w.shape + (order,)
+        M[..., j] = M_n(w + j)
+
+    dM : np.array, shape w.shape + (order,)
+        dM[..., j] = M_n'(w + j) = M_(n-1)(w + j) - M_(n-1)(w + j - 1)
+    '''
+    w = np.asarray(w, dtype=float)[..., np.newaxis]
+    j = np.arange(order)
+    # M_1 is the indicator function of [0,1)
+    M = np.zeros(w.shape[:-1] + (order,))
+    M[..., 0] = 1
+    dM = None
+    for n in range(2, order + 1):
+        # shifted[..., j] = M_(n-1)(w + j - 1)
+        shifted = np.zeros(M.shape)
+        shifted[..., 1:] = M[..., :-1]
+        if n == order:
+            dM = M - shifted
+        M = ((w + j) * M + (n - w - j) * shifted) / (n - 1)
+    return M, dM
+
+
+def bspline_moduli(K, order):
+    '''
+    Squared moduli |b(m)|^2 of the Euler exponential spline for one grid axis.
+
+    Parameters
+    ----------
+    K : int
+        Number of grid points along the axis.
+
+    order : int
+        Order of the B-spline.
+
+    Returns
+    -------
+    moduli : np.array, shape (K,)
+    '''
+    M, dM = bspline_weights(np.zeros(1), order)
+    m = np.arange(K)
+    denominator = np.dot(np.exp(2j * np.pi * np.outer(m, np.arange(order - 1)) / K), M[0, 1:])
+    denominator = np.abs(denominator) ** 2
+    # for odd orders the sum vanishes at m = K/2, the value is taken from the neighbours there
+    zero = np.where(denominator < 1e-10)[0]
+    denominator[zero] = 0.5 * (denominator[zero - 1] + denominator[(zero + 1) % K])
+    return 1.0 / denominator
+
+
+class spme(object):
+    '''
+    Smooth Particle Mesh Ewald (SPME) method for the reciprocal space part of the
+    coulomb interaction.
+
+    The charges are spread onto a regular grid with cardinal B-splines, the
+    convolution with the Ewald kernel exp(-std^2 k^2/2)/k^2 is done with numpy.fft.
+    The costs are O(N order^3 + K log K) instead of O(N K) for the direct sum
+    over k-vectors. The results agree with the direct sum over all k-vectors of
+    the grid up to the interpolation error, which decreases with the order and
+    the number of grid points.
+
+    Parameters
+    ----------
+    L : 3x1 Array
+        Dimensions of the simulation box
+
+    std : float
+        Standard deviation of the Gaussian charge distributions of the Ewald summation.
+
+    epsilon0 : float
+        Vacuum permittivity in the units of the simulation.
+
+    grid : int or 3 ints
+        Number of grid points along each axis.
+
+    order : int, optional
+        Order of the B-splines, at least 3 so that the forces are continuous.
+
+    Attributes
+    ----------
+    n_solves : int
+        Number of grid solutions. The last one is kept, so energy, potential,
+        virial and forces of the same charges and positions share one solution.
+    '''
+
+    def __init__(self, L, std, epsilon0, grid, order=4):
+        if order < 3:
+            raise ValueError('The order of the B-splines has to be at least 3')
+        self.L = np.asarray(L, dtype=float) * np.ones(3)
+        self.grid = tuple(int(K) for K in np.asarray(grid) * np.ones(3, dtype=int))
+        self.order = order
+        self.std = std
+        self.epsilon0 = epsilon0
+        self.volume = np.prod(self.L)
+        self.influence = self.__influence_function()
+        self.charges = None
+        self.positions = None
+        self.solution = None
+        self.n_solves = 0
+        return
+
+    def __wavevectors(self):
+        '''
+        Components of the k-vectors of the grid, broadcastable to the grid shape,
+        only the part of the last axis needed by rfftn.
+        '''
+        k = [2 * np.pi * np.fft.fftfreq(K, d=L / K) for K, L in zip(self.grid, self.L)]
+        k[2] = k[2][:self.grid[2] // 2 + 1]
+        return k[0][:, np.newaxis, np.newaxis], k[1][np.newaxis, :, np.newaxis], k[2][np.newaxis, np.newaxis, :]
+
+    def __influence_function(self):
+        '''
+        Ewald kernel times the B-spline moduli on the half of the grid needed by rfftn.
+        '''
+        kx, ky, kz = self.__wavevectors()
+        k_squared = kx ** 2 + ky ** 2 + kz ** 2
+        k_squared[0, 0, 0] = 1
+        G = np.exp(-self.std ** 2 * k_squared / 2) / k_squared
+        # the k = 0 term is excluded, the system is neutral
+        G[0, 0, 0] = 0
+        B = (bspline_moduli(self.grid[0], self.order)[:, np.newaxis, np.newaxis]
+             * bspline_moduli(self.grid[1], self.order)[np.newaxis, :, np.newaxis]
+             * bspline_moduli(self.grid[2], self.order)[np.newaxis, np.newaxis, :kz.shape[2]])
+        return G * B / (self.volume * self.epsilon0)
+
+    def __spread(self, positions):
+        '''
+        Grid points and B-spline weights of every particle.
+
+        Returns
+        -------
+        index : N x order^3 Array
+            Flat indices of the grid points each particle is spread to.
+        M, dM : lists of three N x order Arrays
+            B-spline values and derivatives per axis.
+        '''
+        u = np.remainder(positions / self.L, 1.0) * self.grid
+        k0 = np.floor(u).astype(int)
+        w = u - k0
+        j = np.arange(self.order)
+        M = []
+        dM = []
+        index = []
+        for axis in range(3):
+            M_axis, dM_axis = bspline_weights(w[:, axis], self.order)
+            M.append(M_axis)
+            dM.append(dM_axis)
+            # the weight M_n(w+j) belongs to the grid point k0 - j
+            index.append(np.remainder(k0[:, axis, np.newaxis] - j, self.grid[axis]))
+        index = ((index[0][:, :, np.newaxis, np.newaxis] * self.grid[1] + index[1][:, np.newaxis, :, np.newaxis])
+                 * self.grid[2] + index[2][:, np.newaxis, np.newaxis, :])
+        return index.reshape(len(positions), -1), M, dM
+
+    @staticmethod
+    def __outer(x, y, z):
+        return (x[:, :, np.newaxis, np.newaxis] * y[:, np.newaxis, :, np.newaxis]
+                * z[:, np.newaxis, np.newaxis, :]).reshape(len(x), -1)
+
+    def __solve(self, charges, positions):
+        '''
+        Spreads the charges and computes the potential on the grid, unless the
+        charges and positions are the same as in the last call.
+
+        Returns
+        -------
+        index, M, dM : see __spread
+        Q : grid of the spread charges
+        Q_k : rfftn of Q
+        Phi : potential on the grid
+        '''
+        if (self.solution is not None and np.shape(positions) == self.positions.shape
+                and np.array_equal(positions, self.positions) and np.array_equal(charges, self.charges)):
+            return self.solution
+        charges = np.array(charges, dtype=float)
+        positions = np.array(positions, dtype=float)
+        index, M, dM = self.__spread(positions)
+        W = self.__outer(M[0], M[1], M[2])
+        Q = np.bincount(index.ravel(), (charges[:, np.newaxis] * W).ravel(), minlength=np.prod(self.grid))
+        Q = Q.reshape(self.grid)
+        Q_k = np.fft.rfftn(Q)
+        Phi = np.fft.irfftn(Q_k * self.influence, s=self.grid) * np.prod(self.grid)
+        self.charges = charges
+        self.positions = positions
+        self.solution = (index, M, dM, Q, Q_k, Phi)
+        self.n_solves += 1
+        return self.solution
+
+    def __forces(self, charges, index, M, dM, Phi):
+        '''
+        Forces from the potential on the grid, see compute_forces.
+        '''
+        Phi = Phi.ravel()[index]
+        forces = np.zeros((len(charges), 3))
+        forces[:, 0] = np.sum(self.__outer(dM[0], M[1], M[2]) * Phi, axis=1) * self.grid[0] / self.L[0]
+        forces[:, 1] = np.sum(self.__outer(M[0], dM[1], M[2]) * Phi, axis=1) * self.grid[1] / self.L[1]
+        forces[:, 2] = np.sum(self.__outer(M[0], M[1], dM[2]) * Phi, axis=1) * self.grid[2] / self.L[2]
+        return -np.asarray(charges, dtype=float)[:, np.newaxis] * forces
+
+    def __virial(self, Q_k):
+        '''
+        Virial tensor from the half spectrum of rfftn, see compute_virial. The
+        planes of the last axis that stand for k and -k are counted twice.
+        '''
+        multiplicity = np.full(Q_k.shape[2], 2.0)
+        multiplicity[0] = 1
+        if self.grid[2] % 2 == 0:
+            multiplicity[-1] = 1
+        energy = 0.5 * self.influence * np.abs(Q_k) ** 2 * multiplicity
+        k = self.__wavevectors()
+        k_squared = k[0] ** 2 + k[1] ** 2 + k[2] ** 2
+        k_squared[0, 0, 0] = 1
+        factor = energy * 2 * (1 / k_squared + self.std ** 2 / 2)
+        # -k is k on the Nyquist plane of an even axis, so on the full grid the terms
+        # k_a k_b of k and -k cancel if exactly one of the axes a and b is at its Nyquist plane
+        nyquist = [(self.grid[axis] % 2 == 0) & (np.arange(k[axis].size).reshape(k[axis].shape) == self.grid[axis] // 2)
+                   for axis in range(3)]
+        virial = np.eye(3) * np.sum(energy)
+        for a in range(3):
+            for b in range(3):
+                virial[a, b] -= np.sum(factor * k[a] * k[b] * (nyquist[a] == nyquist[b]))
+        return virial
+
+    def compute_energy(self, charges, positions):
+        '''
+        Reciprocal space energy 1/(2 V epsilon0) sum_k exp(-std^2 k^2/2)/k^2 |S(k)|^2
+
+        Parameters
+        ----------
+        charges : N x 1 Array
+
+        positions : N x 3 Array
+
+        Returns
+        -------
+        energy : float
+        '''
+        index, M, dM, Q, Q_k, Phi = self.__solve(charges, positions)
+        return 0.5 * np.sum(Q * Phi)
+
+    def compute_potential(self, charges, positions):
+        '''
+        Reciprocal space potential at the position of every particle
+
+        Parameters
+        ----------
+        charges : N x 1 Array
+
+        positions : N x 3 Array
+
+        Returns
+        -------
+        potential : N x 1 Array
+        '''
+        index, M, dM, Q, Q_k, Phi = self.__solve(charges, positions)
+        W = self.__outer(M[0], M[1], M[2])
+        return np.sum(W * Phi.ravel()[index], axis=1)
+
+    def compute_virial(self, charges, positions):
+        '''
+        Reciprocal space virial tensor W_ab = -dE/d(strain_ab)
+        = sum_k E(k) (delta_ab - 2 k_a k_b (1/|k|^2 + std^2/2))
+
+        Parameters
+        ----------
+        charges : N x 1 Array
+
+        positions : N x 3 Array
+
+        Returns
+        -------
+        virial : 3 x 3 Array
+        '''
+        return self.__virial(self.__solve(charges, positions)[4])
+
+    def compute_forces(self, charges, positions):
+        '''
+        Reciprocal space forces, the negative gradient of compute_energy
+
+        Parameters
+        ----------
+        charges : N x 1 Array
+
+        positions : N x 3 Array
+
+        Returns
+        -------
+        forces : N x 3 Array
+        '''
+        index, M, dM, Q, Q_k, Phi = self.__solve(charges, positions)
+        return self.__forces(charges, index, M, dM, Phi)
+
+    def compute_forces_energy_virial(self, charges, positions):
+        '''
+        Forces, energy and virial tensor from one spreading of the charges and
+        one pair of FFTs, see compute_forces, compute_energy and compute_virial.
+
+        Parameters
+        ----------
+        charges : N x 1 Array
+
+        positions : N x 3 Array
+
+        Returns
+        -------
+        forces : N x 3 Array
+        energy : float
+        virial : 3 x 3 Array
+        '''
+        index, M, dM, Q, Q_k, Phi = self.__solve(charges, positions)
+        return self.__forces(charges, index, M, dM, Phi), 0.5 * np.sum(Q * Phi), self.__virial(Q_k)
+
+
+def phase_tables(positions, box_length, n_max):
+    '''
+    Per-axis phase factors exp(i 2 pi m x / L) for m = -n_max, ..., n_max.
+
+    Only the base phase exp(i 2 pi x / L) is computed with np.exp, the
+    higher powers follow by the recurrence exp(i 2 pi (m+1) x / L) = exp(i 2 pi m x / L) * base,
+    the negative ones are the complex conjugates.
+
+    Parameters
+    ----------
+    positions : N x 3 Array
+
+    box_length : float
+        Length of the cubic simulation box.
+
+    n_max : int
+        Largest multiple of 2 pi / L in the tables.
+
+    Returns
+    -------
+    tables : 3 x N x (2 n_max + 1) complex Array
+        tables[a, i, n_max + m] = exp(i 2 pi m positions[i, a] / L)
+    '''
+    positions = np.asarray(positions, dtype=float)
+    base = np.exp(2j * np.pi * positions.T / box_length)
+    tables = np.ones((3, len(positions), 2 * n_max + 1), dtype=complex)
+    if n_max > 0:
+        powers = np.cumprod(np.repeat(base[:, :, np.newaxis], n_max, axis=2), axis=2)
+        tables[:, :, n_max + 1:] = powers
+        tables[:, :, n_max - 1::-1] = np.conj(powers)
+    return tables
+
+
+def reciprocal_energy(kernel, S):
+    '''
+    Reciprocal space energy 1/2 sum_k kernel(k) |S(k)|^2.
+
+    Parameters
+    ----------
+    kernel : K x 1 Array
+        exp(-std^2 |k|^2 / 2) / |k|^2 / (V epsilon0), see structure_factor.
+
+    S : ... x K complex Array
+        Structure factors, e.g. of one configuration or of a batch of replicas.
+
+    Returns
+    -------
+    energy : float or ... Array
+    '''
+    return 0.5 * np.sum(kernel * np.abs(S) ** 2, axis=-1)
+
+
+def reciprocal_virial(k_list, kernel, std, S):
+    '''
+    Reciprocal space virial tensor W_ab = -dE/d(strain_ab)
+    = sum_k E(k) (delta_ab - 2 k_a k_b (1/|k|^2 + std^2/2)) of the structure factors S (... x K).
+
+    Returns
+    -------
+    virial : ... x 3 x 3 Array
+    '''
+    k_squared = np.sum(np.square(k_list), axis=1)
+    energy = 0.5 * kernel * np.abs(S) ** 2
+    factor = energy * 2 * (1 / k_squared + std ** 2 / 2)
+    return (np.sum(energy, axis=-1)[..., np.newaxis, np.newaxis] * np.eye(3)
+            - np.einsum('...k,ka,kb->...ab', factor, k_list, k_list))
+
+
+def reciprocal_forces(k_list, kernel, charges, phases, S):
+    '''
+    Reciprocal space forces q_i sum_k kernel(k) k Im(exp(i k r_i) S(k)^*).
+
+    Parameters
+    ----------
+    charges : N x 1 Array
+
+    phases : ... x N x K complex Array
+        exp(i k r_i), see structure_factor.compute_phases.
+
+    S : ... x K complex Array
+
+    Returns
+    -------
+    forces : ... x N x 3 Array
+    '''
+    weights = (phases * (kernel * np.conj(S))[..., np.newaxis, :]).imag
+    return charges[:, np.newaxis] * np.dot(weights, k_list)
+
+
+class structure_factor(object):
+    '''
+    Ewald reciprocal space sum formulated with the structure factor
+    S(k) = sum_j q_j exp(i k r_j).
+
+    The phases exp(i k r_j) and S(k) are kept between calls. After a full
+    computation in O(K N), moving n particles only costs O(K n), and the
+    energy 1/(2 V epsilon0) sum_k exp(-std^2 k^2/2)/k^2 |S(k)|^2 is then available
+    in O(K). Potentials and forces need the phases of all particles and
+    cost O(K N). Energy, potential and forces of the same configuration
+    share the stored phases, nothing is recomputed between them.
+
+    Parameters
+    ----------
+    k_list : K x 3 Array
+        k-vectors of the sum, k and -k both have to be contained.
+
+    std : float
+        Standard deviation of the Gaussian charge distributions of the Ewald summation.
+
+    volume : float
+        Volume of the simulation box.
+
+    epsilon0 : float
+        Vacuum permittivity in the units of the simulation.
+
+    box_length : float, optional
+        Length of the cubic box. If the k-vectors are multiples of 2 pi / box_length,
+        exp(i k r) is built from per-axis tables (see phase_tables), so that only
+        3 N complex exponentials are evaluated instead of K N.
+
+    n_refresh : int, optional
+        S(k) is summed again over all particles after every n_refresh incremental
+        moves, so that the rounding errors of the updates do not accumulate.
+
+    Attributes
+    ----------
+    S : K x 1 complex Array
+        Structure factor of the last configuration.
+    n_full : int
+        Number of computations of S(k) from scratch, including the sums of n_refresh.
+    n_incremental : int
+        Number of incremental updates.
+    '''
+
+    def __init__(self, k_list, std, volume, epsilon0, box_length=None, n_refresh=1000):
+        self.k_list = k_list
+        self.std = std
+        # integer components of the k-vectors in units of 2 pi / L
+        self.n = None
+        if box_length is not None:
+            n = np.asarray(k_list) * box_length / (2 * np.pi)
+            if np.allclose(n, np.round(n)):
+                self.n = np.round(n).astype(int)
+                self.n_max = int(np.max(np.abs(self.n))) if len(self.n) > 0 else 0
+        self.box_length = box_length
+        self.n_refresh = n_refresh
+        k_squared = np.sum(np.square(self.k_list), axis=1)
+        # exp(-std^2 |k|^2 / 2) / |k|^2 / (V epsilon0)
+        self.kernel = np.exp(-std ** 2 * k_squared / 2.0) / k_squared / (volume * epsilon0)
+        self.charges = None
+        self.positions = None
+        self.phases = None
+        self.S = None
+        self.n_full = 0
+        self.n_incremental = 0
+        return
+
+    def compute_phases(self, positions):
+        '''
+        exp(i k r) for all given positions and all k-vectors, len(positions) x K.
+        '''
+        if self.n is None:
+            return np.exp(1j * np.dot(positions, self.k_list.T))
+        tables = phase_tables(positions, self.box_length, self.n_max)
+        n = self.n + self.n_max
+        return tables[0][:, n[:, 0]] * tables[1][:, n[:, 1]] * tables[2][:, n[:, 2]]
+
+    def compute(self, charges, positions):
+        '''
+        Computes the phases and the structure factor from scratch.
+        '''
+        self.charges = np.array(charges, dtype=float)
+        self.positions = np.array(positions, dtype=float)
+        self.phases = self.compute_phases(self.positions)
+        self.S = np.dot(self.charges, self.phases)
+        self.n_full += 1
+        return self.S
+
+    def move(self, indices, new_positions):
+        '''
+        Moves the particles indices to new_positions and updates S(k) in O(K len(indices)),
+        every n_refresh moves S(k) is summed over all particles in O(K N).
+
+        Parameters
+        ----------
+        indices : 1D int Array
+            Indices of the moved particles.
+
+        new_positions : len(indices) x 3 Array
+        '''
+        indices = np.atleast_1d(indices)
+        new_positions = np.asarray(new_positions, dtype=float).reshape(len(indices), 3)
+        new_phases = self.compute_phases(new_positions)
+        self.S = self.S + np.dot(self.charges[indices], new_phases - self.phases[indices])
+        self.phases[indices] = new_phases
+        self.positions[indices] = new_positions
+        self.n_incremental += 1
+        if self.n_incremental % self.n_refresh == 0:
+            # the stored phases are exact, only S(k) drifts
+            self.S = np.dot(self.charges, self.phases)
+            self.n_full += 1
+        return self.S
+
+    def update(self, charges, positions):
+        '''
+        Brings S(k) to the given configuration. Only the particles whose position
+        changed are updated, unless more than half of them moved or the charges changed.
+        '''
+        if (self.S is None or np.shape(positions) != self.positions.shape
+                or not np.array_equal(charges, self.charges)):
+            return self.compute(charges, positions)
+        moved = np.where(np.any(positions != self.positions, axis=1))[0]
+        if len(moved) == 0:
+            return self.S
+        if 2 * len(moved) > np.shape(positions)[0]:
+            return self.compute(charges, positions)
+        return self.move(moved, np.asarray(positions)[moved])
+
+    def compute_energy(self):
+        '''
+        Reciprocal space energy of the current configuration, O(K).
+        '''
+        return reciprocal_energy(self.kernel, self.S)
+
+    def compute_potential(self):
+        '''
+        Reciprocal space potential at the position of every particle.
+        '''
+        return np.dot(self.phases, self.kernel * np.conj(self.S)).real
+
+    def compute_virial(self):
+        '''
+        Reciprocal space virial tensor W_ab = -dE/d(strain_ab)
+        = sum_k E(k) (delta_ab - 2 k_a k_b (1/|k|^2 + std^2/2)), O(K).
+        '''
+        return reciprocal_virial(self.k_list, self.kernel, self.std, self.S)
+
+    def compute_forces(self):
+        '''
+        Reciprocal space forces q_i sum_k kernel(k) k Im(exp(i k r_i) S(k)^*).
+        '''
+        return reciprocal_forces(self.k_list, self.kernel, self.charges, self.phases, self.S)
@@ -0,0 +1,242 @@
+'''
+Batched simulation of many replicas of one system
+'''
+import numpy as np
+from neighbourlist import neighbourlist
+from reciprocal import structure_factor
+from reciprocal import reciprocal_energy
+from reciprocal import reciprocal_forces
+from reciprocal import reciprocal_virial
+from distribution import maxwellboltzmann
+
+
+class replicas(object):
+    '''
+    R replicas of the same system (same particles, box and interactions) with
+    their own positions, velocities and thermostat temperatures, propagated
+    together by a velocity Verlet step that works on (R, N, 3) arrays.
+
+    The LJ and real space coulomb pairs of all replicas are kept in one flat
+    Verlet list over the R*N particles and evaluated by pair_engine.pair_terms
+    in one call. The list is built replica by replica with the cell-list search
+    (neighbourlist.compute_pairs), which is rare thanks to the skin. The Ewald
+    reciprocal sum uses the structure factors of all replicas, computed from
+    the phases of blocks of replicas. Energies and virials are resolved per
+    replica. Apart from the list builds, there is no python loop over the
+    replicas, except over blocks to bound the memory.
+
+    Parameters
+    ----------
+    positions, velocities : R x N x 3 Arrays
+
+    labels : N x 3 Array
+        masses, charges and species, the same in all replicas
+
+    L : 3x1 Array
+        Dimensions of the simulation box.
+
+    T : float or R x 1 Array
+        Temperature of the Andersen thermostat of every replica.
+
+    pair_engine : pair_engine
+        LJ and real space coulomb kernels and cutoffs.
+
+    coulomb : coulomb
+        Provides k_list, std, volume and epsilon0 of the reciprocal space sum.
+
+    dt : float
+        Timestep.
+
+    p_rea : float
+        Reassignment probability of the Andersen thermostat, 0 for NVE.
+
+    r_skin : float, optional
+        Skin of the Verlet list, default 0.1 * r_cut.
+
+    max_elements : int, optional
+        Upper limit for the number of values of the phases exp(i k r) of one block of
+        replicas, a block holds at least one replica (N x K values).
+    '''
+
+    def __init__(self, positions, velocities, labels, L, T, pair_engine, coulomb, dt, p_rea, r_skin=None,
+                 max_elements=2**22):
+        self.positions = np.array(positions, dtype=float)
+        self.velocities = np.array(velocities, dtype=float)
+        self.R, self.N = np.shape(self.positions)[:2]
+        self.labels = np.asarray(labels, dtype=float)
+        self.L = np.asarray(L, dtype=float)
+        self.T = np.broadcast_to(np.asarray(T, dtype=float), (self.R,)).copy()
+        self.pair_engine = pair_engine
+        self.dt = dt
+        self.p_rea = p_rea
+        self.r_skin = 0.1 * pair_engine.r_cut if r_skin is None else r_skin
+        self.max_elements = max_elements
+
+        self.reciprocal_sum = structure_factor(coulomb.k_list, coulomb.std, coulomb.volume, coulomb.epsilon0,
+                                               coulomb.box_length)
+        self.self_energy = coulomb.compute_self_energy(self.labels[:, 1])
+        self.search = neighbourlist(coulomb.backend)
+        self.masses = self.labels[:, 0][np.newaxis, :, np.newaxis]
+
+        self.reference_positions = None
+        self.n_builds = 0
+        self.forces, self.energy, self.virial = self.compute_forces(self.positions)
+        return
+
+    @classmethod
+    def from_md(cls, md_object, T, p_rea=None):
+        '''
+        len(T) replicas of the system of an md object, the velocities of every
+        replica are drawn from the Maxwell-Boltzmann distribution at its temperature.
+        '''
+        T = np.asarray(T, dtype=float)
+        R = len(T)
+        N = md_object.N
+        positions = np.repeat(md_object.positions[np.newaxis], R, axis=0)
+        velocities = maxwellboltzmann().sample_distribution(R * N, np.tile(md_object.labels[:, 0], R),
+                                                            np.repeat(T, N)).reshape(R, N, 3)
+        p_rea = md_object.p_rea if p_rea is None else p_rea
+        return cls(positions, velocities, md_object.labels, md_object.L, T, md_object.pair_engine,
+                   md_object.coulomb, md_object.dt, p_rea)
+
+    def __minimum_image(self, dr):
+        return dr - self.L * np.round(dr / self.L)
+
+    def build(self, positions):
+        '''
+        Verlet list of all replicas at r_cut + r_skin, every pair i < j once.
+        The pairs of every replica come from the cell-list search.
+        '''
+        r_list = self.pair_engine.r_cut + self.r_skin
+        pairs_i = []
+        pairs_j = []
+        for replica in range(self.R):
+            i, j = self.search.compute_pairs(positions[replica], self.L[0], r_list)[:2]
+            # indices into the flat R*N arrays
+            pairs_i.append(replica * self.N + i)
+            pairs_j.append(replica * self.N + j)
+        self.pairs_i = np.concatenate(pairs_i)
+        self.pairs_j = np.concatenate(pairs_j)
+        self.pairs_replica = self.pairs_i // self.N
+        self.reference_positions = positions.copy()
+        self.n_builds += 1
+        return
+
+    def __update_list(self, positions):
+        if self.reference_positions is not None:
+            moved = self.__minimum_image(positions - self.reference_positions)
+            if np.max(np.einsum('rnx,rnx->rn', moved, moved)) <= (0.5 * self.r_skin) ** 2:
+                return
+        self.build(positions)
+        return
+
+    def compute_pair_forces(self, positions):
+        '''
+        LJ and real space coulomb forces, energies and virials of all replicas,
+        with the conventions of pair_engine.compute.
+
+        Returns
+        -------
+        forces : R x N x 3 Array
+        energy : R x 1 Array
+        virial : R x 3 x 3 Array
+        '''
+        self.__update_list(positions)
+        flat = positions.reshape(-1, 3)
+        i, j = self.pairs_i, self.pairs_j
+        dr = self.__minimum_image(flat[j] - flat[i])
+        dist_2 = np.einsum('ij,ij->i', dr, dr)
+        dV_r, pair_energy = self.pair_engine.pair_terms(dist_2, self.labels[i % self.N], self.labels[j % self.N])
+
+        n = self.R * self.N
+        forces = np.zeros((n, 3))
+        for axis in range(3):
+            forces[:, axis] = np.bincount(i, dV_r * dr[:, axis], minlength=n)
+            forces[:, axis] -= np.bincount(j, dV_r * dr[:, axis], minlength=n)
+        energy = np.bincount(self.pairs_replica, pair_energy, minlength=self.R)
+        virial = np.zeros((self.R, 3, 3))
+        for a in range(3):
+            for b in range(3):
+                virial[:, a, b] = -np.bincount(self.pairs_replica, dV_r * dr[:, a] * dr[:, b], minlength=self.R)
+        return forces.reshape(self.R, self.N, 3), energy, virial
+
+    def compute_long_range(self, positions):
+        '''
+        Ewald reciprocal space forces, energies (minus the self energy) and
+        virials of all replicas, see structure_factor.
+
+        Returns
+        -------
+        forces : R x N x 3 Array
+        energy : R x 1 Array
+        virial : R x 3 x 3 Array
+        '''
+        reciprocal_sum = self.reciprocal_sum
+        k_list = reciprocal_sum.k_list
+        kernel = reciprocal_sum.kernel
+        charges = self.labels[:, 1]
+        forces = np.zeros((self.R, self.N, 3))
+        S = np.zeros((self.R, len(k_list)), dtype=complex)
+        block = max(1, int(self.max_elements // max(1, self.N * len(k_list))))
+        for start in range(0, self.R, block):
+            stop = min(start + block, self.R)
+            phases = reciprocal_sum.compute_phases(positions[start:stop].reshape(-1, 3))
+            phases = phases.reshape(stop - start, self.N, len(k_list))
+            S[start:stop] = np.einsum('n,rnk->rk', charges, phases)
+            forces[start:stop] = reciprocal_forces(k_list, kernel, charges, phases, S[start:stop])
+
+        energy = reciprocal_energy(kernel, S)
+        virial = reciprocal_virial(k_list, kernel, reciprocal_sum.std, S)
+        return forces, energy - self.self_energy, virial
+
+    def compute_forces(self, positions):
+        '''
+        Total forces, energies and virials of all replicas, see md.get_forces_energy_virial.
+        '''
+        forces, energy, virial = self.compute_pair_forces(positions)
+        forces_long, energy_long, virial_long = self.compute_long_range(positions)
+        return forces + forces_long, energy + energy_long, virial + virial_long
+
+    def step(self):
+        '''
+        One velocity Verlet step of all replicas with the Andersen thermostat,
+        see dynamics.velocity_verlet_integrator.
+        '''
+        positions = np.remainder(self.positions + self.velocities * self.dt
+                                 + self.forces / self.masses * self.dt ** 2, self.L)
+        forces, self.energy, self.virial = self.compute_forces(positions)
+        self.velocities += (self.forces + forces) / (2 * self.masses) * self.dt
+        self.positions = positions
+        self.forces = forces
+
+        if self.p_rea > 0:
+            replica, particle = np.nonzero(np.random.uniform(size=(self.R, self.N)) < self.p_rea)
+            if len(replica) > 0:
+                self.velocities[replica, particle] = maxwellboltzmann().sample_distribution(
+                    len(replica), self.labels[particle, 0], self.T[replica])
+        return
+
+    def run(self, N_steps, Energy_save=1):
+        '''
+        Propagates all replicas by N_steps steps.
+
+        Returns
+        -------
+        energies : (N_steps // Energy_save) x R Array
+            potential energy of every replica after every Energy_save steps
+        '''
+        energies = []
+        for n in range(1, N_steps + 1):
+            self.step()
+            if n % Energy_save == 0:
+                energies.append(self.energy.copy())
+        return np.array(energies).reshape(-1, self.R)
+
+    def temperatures(self, kB=0.0001987191):
+        '''
+        Instantaneous temperature of every replica, see dynamics.Thermometer.
+        '''
+        m = self.labels[:, 0]
+        CM = np.einsum('n,rnx->rx', m, self.velocities) / np.sum(m)
+        internal = self.velocities - CM[:, np.newaxis, :]
+        return np.einsum('n,rnx,rnx->r', m, internal, internal) / kB / (3 * self.N - 3)
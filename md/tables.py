@@ -0,0 +1,142 @@
+'''
+Interpolation tables of the pair functions of pair_engine
+'''
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+
+class pair_tables(object):
+    '''
+    Lookup tables of the switched LJ and the real space coulomb pair functions
+    versus r^2, a drop in replacement for pair_engine.lj_kernel and
+    pair_engine.coulomb_kernel.
+
+    Energy and dV/dr / r are sampled on a uniform grid in r^2 between r_min and
+    the cutoff, for LJ once per species pair index labels[i,2] + labels[j,2]
+    and for coulomb once per unit charge product. Looking up r^2 instead of r
+    avoids the square root, erfc and exp calls and the powers of the analytic
+    kernels. Pairs closer than r_min fall back to the analytic kernels.
+
+    Parameters
+    ----------
+    engine : pair_engine
+        Provides the analytic kernels and the cutoffs. The tables are only valid
+        for the std, r_switch, cutoffs and LJ parameters of the engine at
+        construction time.
+
+    r_min : float
+        Smallest distance of the tables.
+
+    n_points : int, optional
+        Number of grid points of every table. Default is 4096.
+
+    kind : 'cubic' or 'linear', optional
+        Cubic spline or linear interpolation between the grid points. Default is 'cubic'.
+    '''
+
+    def __init__(self, engine, r_min, n_points=4096, kind='cubic'):
+        if kind not in ('cubic', 'linear'):
+            raise ValueError("kind must be 'cubic' or 'linear', not %r" % (kind,))
+        if n_points < 2:
+            raise ValueError("a table needs at least 2 points")
+        self.engine = engine
+        self.kind = kind
+        self.n_points = int(n_points)
+        self.r_min = r_min
+
+        self.x_LJ = np.linspace(r_min ** 2, engine.r_cut_LJ ** 2, self.n_points)
+        self.x_coulomb = np.linspace(r_min ** 2, engine.r_cut_coulomb ** 2, self.n_points)
+
+        # coefficients of the LJ tables, the intervals of the 3 species pairs one after another
+        potential, dV_r = [], []
+        for index in range(3):
+            y_potential, y_dV_r = engine.lj_kernel(np.full(self.n_points, index), self.x_LJ)
+            potential.append(self.__fit(self.x_LJ, y_potential))
+            dV_r.append(self.__fit(self.x_LJ, y_dV_r))
+        self.potential_LJ = np.hstack(potential)
+        self.dV_r_LJ = np.hstack(dV_r)
+
+        y_potential, y_dV_r = engine.coulomb_kernel(self.x_coulomb)
+        self.potential_coulomb = self.__fit(self.x_coulomb, y_potential)
+        self.dV_r_coulomb = self.__fit(self.x_coulomb, y_dV_r)
+        return
+
+    def __fit(self, x, y):
+        '''
+        Polynomial coefficients of every interval, highest order first, in the
+        local coordinate t = x - x[k].
+
+        Returns
+        -------
+        c : (degree+1) x (len(x)-1) Array
+        '''
+        if self.kind == 'cubic':
+            return CubicSpline(x, y).c
+        return np.array([np.diff(y) / np.diff(x), y[:-1]])
+
+    def lj_kernel(self, index_LJ, dist_2):
+        '''
+        Interpolated switched LJ potential and dV/dr / r, see pair_engine.lj_kernel.
+        '''
+        inside = dist_2 >= self.x_LJ[0]
+        if not np.all(inside):
+            potential, dV_r = self.engine.lj_kernel(index_LJ, dist_2)
+            potential[inside], dV_r[inside] = self.lj_kernel(index_LJ[inside], dist_2[inside])
+            return potential, dV_r
+        k, t = self.__locate(self.x_LJ, dist_2)
+        k += np.asarray(index_LJ, dtype=int) * (self.n_points - 1)
+        return self.__horner(self.potential_LJ, k, t), self.__horner(self.dV_r_LJ, k, t)
+
+    def coulomb_kernel(self, dist_2):
+        '''
+        Interpolated real space coulomb potential and dV/dr / r per unit charge
+        product, see pair_engine.coulomb_kernel.
+        '''
+        inside = dist_2 >= self.x_coulomb[0]
+        if not np.all(inside):
+            potential, dV_r = self.engine.coulomb_kernel(dist_2)
+            potential[inside], dV_r[inside] = self.coulomb_kernel(dist_2[inside])
+            return potential, dV_r
+        k, t = self.__locate(self.x_coulomb, dist_2)
+        return self.__horner(self.potential_coulomb, k, t), self.__horner(self.dV_r_coulomb, k, t)
+
+    def __locate(self, x, dist_2):
+        '''
+        Interval k of every dist_2 on the uniform grid x and the local coordinate t = dist_2 - x[k].
+        '''
+        h = x[1] - x[0]
+        k = np.minimum(((dist_2 - x[0]) / h).astype(int), self.n_points - 2)
+        return k, dist_2 - x[k]
+
+    def __horner(self, c, k, t):
+        value = c[0].take(k)
+        for order in range(1, c.shape[0]):
+            value *= t
+            value += c[order].take(k)
+        return value
+
+    def check(self):
+        '''
+        Accuracy self-check against the analytic kernels of the engine.
+
+        All tables are compared at the midpoints of their intervals, where the
+        interpolation error is largest.
+
+        Returns
+        -------
+        error : float
+            Largest deviation of any table, relative to the largest absolute
+            value of the analytic function on the table.
+        '''
+        error = 0.0
+        for index in range(3):
+            x = 0.5 * (self.x_LJ[1:] + self.x_LJ[:-1])
+            index_LJ = np.full(len(x), index)
+            exact = self.engine.lj_kernel(index_LJ, x)
+            table = self.lj_kernel(index_LJ, x)
+            for e, t in zip(exact, table):
+                error = max(error, np.max(np.abs(t - e)) / np.max(np.abs(e)))
+        x = 0.5 * (self.x_coulomb[1:] + self.x_coulomb[:-1])
+        for e, t in zip(self.engine.coulomb_kernel(x), self.coulomb_kernel(x)):
+            error = max(error, np.max(np.abs(t - e)) / np.max(np.abs(e)))
+        return error
@@ -0,0 +1,274 @@
+'''
+Replica exchange (parallel tempering) of md systems at a ladder of temperatures
+'''
+import copy
+import numpy as np
+from multiprocessing import Pipe
+from multiprocessing import Process
+from multiprocessing.util import Finalize
+from distribution import maxwellboltzmann
+
+
+def _advance(md_object, N_steps):
+    '''
+    Propagates an md object by N_steps steps (as md.get_traj) and returns its energy.
+    '''
+    for n in range(N_steps):
+        md_object.positions, md_object.velocities, md_object.forces = md_object.propagte_system()
+        md_object.neighbours_LJ, md_object.distances_LJ = md_object.update_neighbourlist_LJ()
+        md_object.neighbours_coulomb, md_object.distances_coulomb = md_object.update_neighbourlist_coulomb()
+    return md_object.get_energy()
+
+
+def _set_temperature(md_object, T):
+    '''
+    Moves an md object to the thermostat temperature T, the velocities are
+    rescaled by sqrt(T / T_old).
+    '''
+    md_object.velocities = md_object.velocities * np.sqrt(T / float(md_object.T))
+    md_object.T = T
+    return
+
+
+def _execute(md_object, command, args):
+    if command == 'run':
+        return _advance(md_object, *args)
+    if command == 'temperature':
+        return _set_temperature(md_object, *args)
+    if command == 'state':
+        return md_object.positions, md_object.velocities
+    raise ValueError('Unknown command: ' + str(command))
+
+
+def _replica_process(md_object, connection, seed):
+    '''
+    Event loop of a replica process, executes the commands received on
+    connection on its md object until it receives None or the connection is closed.
+    '''
+    np.random.seed(seed)
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        try:
+            result = _execute(md_object, *message)
+        except Exception as error:
+            result = error
+        connection.send(result)
+    connection.close()
+    # worker pools and shared memory of the md object
+    md_object.close()
+    return
+
+
+def _stop_replicas(connections, processes):
+    '''
+    Stops the replica processes, also at the exit of the interpreter (see multiprocessing.util.Finalize).
+    '''
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (OSError, ValueError):
+            pass
+        connection.close()
+    for process in processes:
+        process.join()
+    return
+
+
+class parallel_tempering(object):
+    '''
+    Parallel tempering with md replicas, each propagated by the velocity Verlet
+    integrator with the Andersen thermostat at one temperature of a ladder.
+
+    After every N_steps steps, the energies of the replicas (md.get_energy)
+    are compared and neighbouring temperatures are exchanged with the
+    Metropolis probability min(1, exp((1/kT_k - 1/kT_k+1) (E_k - E_k+1))).
+    The even and the odd neighbouring pairs are tried in turns. An exchange
+    swaps the temperatures of the two replicas and rescales their velocities,
+    which is equivalent to swapping their configurations: every md object
+    keeps its positions, neighbourlists and Ewald k-vectors, nothing is set up
+    again or sent between processes.
+
+    Parameters
+    ----------
+    md_objects : list of md
+        One replica per temperature, md_objects[k] starts at temperatures[k].
+
+    temperatures : 1D Array
+        Ascending temperature ladder.
+
+    processes : bool, optional
+        If True (default), every replica lives in its own process and the
+        replicas are propagated in parallel. Otherwise they run one after
+        another in this process.
+
+    seed : int, optional
+        Seed of the exchanges, the thermostat of replica r is seeded with seed + 1 + r.
+        Default is random.
+
+    kB : float, optional
+        Boltzmann constant in the units of the energy, the default is the one
+        of the thermostat (see distribution.maxwellboltzmann).
+
+    Attributes
+    ----------
+    replica_at : 1D int Array
+        replica_at[k] is the index of the replica at temperatures[k].
+
+    attempts, accepted : 1D int Arrays
+        Number of tried and accepted exchanges of the temperatures k and k+1.
+
+    history : list of 1D int Arrays
+        replica_at after every exchange step.
+    '''
+
+    def __init__(self, md_objects, temperatures, processes=True, seed=None, kB=0.0001987191):
+        self.temperatures = np.asarray(temperatures, dtype=float)
+        if len(md_objects) != len(self.temperatures):
+            raise ValueError('%d replicas for %d temperatures' % (len(md_objects), len(self.temperatures)))
+        if np.any(np.diff(self.temperatures) <= 0):
+            raise ValueError('the temperatures have to be ascending')
+        self.kB = kB
+        self.random = np.random.RandomState(seed)
+        self.replica_at = np.arange(len(self.temperatures))
+        self.attempts = np.zeros(len(self.temperatures) - 1, dtype=int)
+        self.accepted = np.zeros(len(self.temperatures) - 1, dtype=int)
+        self.history = []
+        self.n_exchanges = 0
+
+        for md_object, T in zip(md_objects, self.temperatures):
+            if md_object.T != T:
+                _set_temperature(md_object, T)
+        self.md_objects = md_objects
+        self.connections = None
+        self.processes = None
+        self.finalizer = None
+        if processes:
+            seeds = self.random.randint(2 ** 31, size=len(md_objects)) if seed is None else seed + 1 + np.arange(len(md_objects))
+            self.connections = []
+            self.processes = []
+            for md_object, replica_seed in zip(md_objects, seeds):
+                parent, child = Pipe()
+                # not daemonic, so the md objects can start their own worker pools
+                process = Process(target=_replica_process, args=(md_object, child, replica_seed))
+                process.start()
+                child.close()
+                self.connections.append(parent)
+                self.processes.append(process)
+            self.finalizer = Finalize(self, _stop_replicas, args=(self.connections, self.processes), exitpriority=10)
+        elif seed is not None:
+            np.random.seed(seed + 1)
+        return
+
+    @classmethod
+    def from_md(cls, md_object, temperatures, processes=True, seed=None):
+        '''
+        Replicas of one md object, with velocities drawn from the
+        Maxwell-Boltzmann distribution at every temperature.
+        '''
+        md_objects = []
+        for T in temperatures:
+            replica = copy.deepcopy(md_object)
+            replica.velocities = maxwellboltzmann().sample_distribution(md_object.N, md_object.labels[:, 0], T)
+            replica.T = T
+            md_objects.append(replica)
+        return cls(md_objects, temperatures, processes, seed)
+
+    def __call(self, commands):
+        '''
+        Executes commands[r] = (command, args) on replica r, in parallel if the
+        replicas run in processes.
+        '''
+        if self.connections is None:
+            return [_execute(self.md_objects[r], *commands[r]) for r in range(len(commands))]
+        for connection, command in zip(self.connections, commands):
+            connection.send(command)
+        results = [connection.recv() for connection in self.connections]
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    def exchange(self, energies):
+        '''
+        Tries to exchange the temperatures of neighbouring replicas.
+
+        Parameters
+        ----------
+        energies : 1D Array
+            energies[r] is the energy of replica r.
+        '''
+        beta = 1 / (self.kB * self.temperatures)
+        temperature_of = np.empty(len(self.replica_at))
+        for k in range(self.n_exchanges % 2, len(self.temperatures) - 1, 2):
+            a, b = self.replica_at[k], self.replica_at[k + 1]
+            delta = (beta[k] - beta[k + 1]) * (energies[a] - energies[b])
+            self.attempts[k] += 1
+            if delta >= 0 or self.random.uniform() < np.exp(delta):
+                self.accepted[k] += 1
+                self.replica_at[k], self.replica_at[k + 1] = b, a
+        temperature_of[self.replica_at] = self.temperatures
+        self.__call([('temperature', (T,)) for T in temperature_of])
+        self.n_exchanges += 1
+        self.history.append(self.replica_at.copy())
+        return
+
+    def run(self, N_exchanges, N_steps):
+        '''
+        N_exchanges times: propagates all replicas by N_steps steps and tries
+        the exchanges.
+
+        Returns
+        -------
+        energies : N_exchanges x n_temperatures Array
+            Energies before every exchange, ordered by temperature.
+        '''
+        energies = np.zeros((N_exchanges, len(self.temperatures)))
+        for n in range(N_exchanges):
+            energy = np.array(self.__call([('run', (N_steps,))] * len(self.temperatures)))
+            energies[n] = energy[self.replica_at]
+            self.exchange(energy)
+        return energies
+
+    def acceptance_rates(self):
+        '''
+        Fraction of the accepted exchanges between the temperatures k and k+1.
+        '''
+        return self.accepted / np.maximum(self.attempts, 1).astype(float)
+
+    def statistics(self):
+        '''
+        Table of the exchange statistics of all neighbouring temperatures.
+        '''
+        lines = ['%10s %10s %9s %9s %10s' % ('T_k', 'T_k+1', 'attempts', 'accepted', 'acceptance')]
+        for k, rate in enumerate(self.acceptance_rates()):
+            lines.append('%10.2f %10.2f %9d %9d %9.1f%%' % (self.temperatures[k], self.temperatures[k + 1],
+                                                             self.attempts[k], self.accepted[k], 100 * rate))
+        return '\n'.join(lines)
+
+    def configurations(self):
+        '''
+        Positions and velocities at every temperature, ordered by temperature.
+        '''
+        states = self.__call([('state', ())] * len(self.temperatures))
+        return [states[r] for r in self.replica_at]
+
+    def close(self):
+        '''
+        Stops the replica processes.
+        '''
+        if self.finalizer is not None:
+            self.finalizer()
+            self.finalizer = None
+            self.connections = None
+        return
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -15,12 +15,43 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import copy
+import pickle
+import time
+import pytest
 import numpy as np
+from scipy.special import erfc
+from scipy.constants import epsilon_0
 
 # from .api import md
 from particle_interaction import coulomb
 from particle_interaction import lennard_jones
 from neighbourlist import neighbourlist
+from pair_displacements import pair_displacements
+from reciprocal import spme
+from reciprocal import structure_factor
+from reciprocal import phase_tables
+from tables import pair_tables
+from backend import available_backends
+from backend import cell_list_pairs
+from backend import select_backend
+from parallel import parallel_pair_engine
+from parallel import sharded_structure_factor
+from domain import domain_decomposition
+from domain import pipe_transport
+from replicas import replicas
+from tempering import parallel_tempering
+from trajectory import trajectory_writer
+from trajectory import read_header
+from trajectory import frame_dtype
+from trajectory import export_xyz
+from trajectory import trajectory_reader
+from trajectory import xyz_reader
+from trajectory import hdf5_writer
+from trajectory import hdf5_reader
+from output import output_pipeline
+from pair_engine import pair_engine
 import Initial_Test_Parameters as ip
 from md import System
 from md import md
@@ -57,6 +88,27 @@ neighbours = neighbourlist().compute_neighbourlist(Test_Positions, Test_L[0], r_
 Test_dt = ip.dt
 
 
+def _small_md(**options):
+    '''
+    md object of 64 ions of the NaCl rock salt lattice (Na first) with small random displacements
+    in a box of 6 Angstroem, the other parameters are from Initial_Test_Parameters. The forces are
+    computed. The keyword arguments replace the arguments of md.
+    '''
+    grid = np.arange(4) * 1.5 + 0.75
+    Positions = np.array(np.meshgrid(grid, grid, grid)).reshape(3, -1).T + np.random.rand(64, 3) * 0.1
+    species = (np.sum(np.round((Positions - 0.75) / 1.5), axis=1) % 2).astype(int)
+    order = np.argsort(species, kind='mergesort')
+    Labels = np.repeat([[22.99, 1.0, 0.0], [35.45, -1.0, 1.0]], 32, axis=0)
+    arguments = dict(positions=Positions[order], properties=Labels, velocities=np.random.randn(64, 3),
+                     forces=np.zeros((64, 3)), box=np.array([6.0] * 3), Temperature=ip.T, Sigma_LJ=ip.sigma,
+                     Epsilon_LJ=ip.epsilon, r_switch=2.0, r_cut_LJ=2.4, n_boxes_short_range=1, dt=ip.dt, p_rea=0,
+                     p_error=ip.p, Symbols=np.array(Symbols))
+    arguments.update(options)
+    MDobj = md(**arguments)
+    MDobj.forces = MDobj.get_forces()
+    return MDobj
+
+
 def test_get_dircetions():
     from boxvectors import directions
     # Create Test Array
@@ -84,7 +136,8 @@ def test_coulomb_forces():
     Force = c.compute_forces(Test_d_Pos,
                              Test_Labels,
                              Test_L)
-    assert np.all(Force[0, :] == -Force[1, :]), "coulomb force is broken"
+    # the reciprocal part is summed via the structure factor, so actio = reactio holds up to rounding
+    assert np.allclose(Force[0, :], -Force[1, :], rtol=1e-12, atol=0), "coulomb force is broken"
 
 
 def test_LJ_forces():
@@ -100,6 +153,40 @@ def test_LJ_forces():
     assert np.all(Force[0, :] == -Force[1, :]), "lennard Jones force is broken"
 
 
+def test_LJ_forces_switched():
+    # forces are the negative gradient of the switched LJ energy, also between r_switch and r_cut
+    box_length = 8.0
+    L = np.array([box_length] * 3)
+    grid = np.arange(4) * 2.0 + 0.5
+    R = np.array(np.meshgrid(grid, grid, grid)).reshape(3, -1).T + np.random.rand(64, 3) * 0.3
+    labels = np.zeros((64, 3))
+    labels[32:, 2] = 1
+    r_s, r_c = 2.6, 3.2
+    A = np.array([[1, r_s, r_s ** 2, r_s ** 3, r_s ** 4, r_s ** 5],
+                  [1, r_c, r_c ** 2, r_c ** 3, r_c ** 4, r_c ** 5],
+                  [0, 1, 2 * r_s, 3 * r_s ** 2, 4 * r_s ** 3, 5 * r_s ** 4],
+                  [0, 1, 2 * r_c, 3 * r_c ** 2, 4 * r_c ** 3, 5 * r_c ** 4],
+                  [0, 0, 2, 6 * r_s, 12 * r_s ** 2, 20 * r_s ** 3],
+                  [0, 0, 2, 6 * r_c, 12 * r_c ** 2, 20 * r_c ** 3]])
+    switch = np.linalg.solve(A, [1, 0, 0, 0, 0, 0])
+    LJ = lennard_jones()
+
+    def energy(R):
+        neighbours = neighbourlist().compute_csr_neighbourlist(R, box_length, r_c)
+        return 0.5 * np.sum(LJ.compute_potential(ip.sigma, ip.epsilon, labels, neighbours, None, r_s, r_c))
+
+    neighbours = neighbourlist().compute_csr_neighbourlist(R, box_length, r_c)
+    Force = LJ.compute_forces(R, ip.sigma, ip.epsilon, labels, L, switch, r_s, neighbours)
+    h = 1e-6
+    for a in (0, 17, 40):
+        for axis in range(3):
+            R_plus, R_minus = R.copy(), R.copy()
+            R_plus[a, axis] += h
+            R_minus[a, axis] -= h
+            dE = (energy(R_plus) - energy(R_minus)) / (2 * h)
+            assert abs(Force[a, axis] + dE) < 1e-5 * np.max(np.abs(Force)), "LJ force is not the gradient of the energy"
+
+
 def test_neighborlist():
     N = 100
     R = np.random.rand(N, 3)
@@ -138,6 +225,854 @@ def test_neighborlist():
     assert n1 == n2
 
 
+def test_neighborlist_order():
+    # the original linked cell list loop, which defines the order of the rows
+    N = 120
+    box_length = 3.0
+    r_cutoff = 0.9
+    R = np.random.rand(N, 3) * box_length
+    n_cells = int(box_length / r_cutoff)
+    cell = np.minimum((R / (box_length / n_cells)).astype(int), n_cells - 1)
+    members = {}
+    for i in range(N):
+        members.setdefault(tuple(cell[i]), []).insert(0, i)
+    neighbours = {i: [] for i in range(N)}
+    distances = {i: [] for i in range(N)}
+    for c in np.ndindex(n_cells, n_cells, n_cells):
+        for offset in np.ndindex(3, 3, 3):
+            nb = np.array(c) + offset - 1
+            r_shift = np.floor_divide(nb, n_cells) * box_length
+            for i in members.get(c, []):
+                for j in members.get(tuple(np.remainder(nb, n_cells)), []):
+                    if i < j:
+                        dist = np.linalg.norm(R[i] - (R[j] + r_shift))
+                        if dist <= r_cutoff:
+                            neighbours[i].append(j)
+                            distances[i].append(dist)
+                            neighbours[j].append(i)
+                            distances[j].append(dist)
+
+    from neighbourlist import neighbourlist as nbl
+    for backend in available_backends():
+        n1, dist = nbl(backend).compute_neighbourlist(R, box_length, r_cutoff)
+        assert n1 == neighbours, "rows are not in the order of the cell list loop"
+        assert dist == distances, "distances differ from the cell list loop"
+
+
+def test_neighborlist_pairs():
+    N = 60
+    box_length = 3.0
+    R = np.random.rand(N, 3) * box_length
+    from neighbourlist import neighbourlist as nbl
+    for r_cutoff in [0.7, 1.4]:
+        i, j, dr, dist = nbl().compute_pairs(R, box_length, r_cutoff)
+        assert np.all(i < j), "pairs should be stored once with i < j"
+        assert np.all(dist <= r_cutoff), "pair outside of cutoff radius"
+        # displacements are the minimum image vectors from i to j
+        naive = R[j] - R[i]
+        naive -= box_length * np.round(naive / box_length)
+        assert np.allclose(dr, naive), "wrong displacement vectors"
+        assert np.allclose(dist, np.linalg.norm(naive, axis=1)), "wrong distances"
+
+        D = R[:, np.newaxis, :] - R[np.newaxis, :, :]
+        D -= box_length * np.round(D / box_length)
+        n_naive = np.sum(np.triu(np.linalg.norm(D, axis=2) <= r_cutoff, 1))
+        assert n_naive == np.size(i), "pairs are missing"
+
+
+def test_csr_neighbourlist():
+    from neighbourlist import csr_neighbourlist
+    N = 40
+    box_length = 3.0
+    R = np.random.rand(N, 3) * box_length
+    nbl = neighbourlist()
+    neighbours, distances = nbl.compute_neighbourlist(R, box_length, 1.2)
+    csr = nbl.compute_csr_neighbourlist(R, box_length, 1.2)
+    assert csr.offsets.dtype == np.int32 and csr.indices.dtype == np.int32, "csr arrays should be int32"
+    assert csr.displacements.shape == (csr.n_entries, 3), "one displacement vector per entry"
+    for i in range(N):
+        # the rows of the csr list are not sorted into the order of the dictionaries
+        assert sorted(csr[i]) == sorted(neighbours[i]), "csr view differs from the neighbour dictionary"
+        assert np.allclose(sorted(csr.distance_view()[i]), sorted(distances[i])), "csr view differs from the distance dictionary"
+    assert np.allclose(csr.displacements, csr.minimum_image(R, np.array([box_length] * 3))), "wrong displacements"
+
+    labels = np.zeros((N, 3))
+    labels[:, 0] = 1
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    labels[N // 2:, 2] = 1
+    from_dicts = csr_neighbourlist.from_dicts(neighbours, distances)
+    assert from_dicts.to_dicts() == (neighbours, distances), "from_dicts changed the order of the neighbours"
+    LJ = lennard_jones()
+    P1 = LJ.compute_potential(ip.sigma, ip.epsilon, labels, neighbours, distances, r_s=1.0, r_c=1.2)
+    P2 = LJ.compute_potential(ip.sigma, ip.epsilon, labels, csr, None, r_s=1.0, r_c=1.2)
+    assert np.allclose(P1, P2), "LJ potential depends on the neighbourlist format"
+
+
+def test_verlet_neighbourlist():
+    from neighbourlist import verlet_neighbourlist
+    N = 50
+    box_length = 4.0
+    R = np.random.rand(N, 3) * box_length
+    verlet = verlet_neighbourlist(1.0, 0.4, box_length)
+    for step in range(20):
+        csr = verlet.update(R)
+        reference = neighbourlist().compute_neighbourlist(R, box_length, 1.0)[0]
+        for i in range(N):
+            assert sorted(csr[i]) == sorted(reference[i]), "Verlet list misses or adds neighbours"
+        assert np.allclose(csr.displacements, csr.minimum_image(R, np.array([box_length] * 3))), "stale displacements"
+        R = np.remainder(R + 0.02 * (np.random.rand(N, 3) - 0.5), box_length)
+    assert verlet.n_updates == 20, "updates are not counted"
+    assert 1 <= verlet.n_builds < 20, "the Verlet list should not be rebuilt every step"
+
+
+def test_half_neighbourlist():
+    N = 40
+    box_length = 4.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:, 0] = 1
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    labels[N // 2:, 2] = 1
+    full = neighbourlist().compute_csr_neighbourlist(R, box_length, 1.5)
+    half = neighbourlist().compute_csr_neighbourlist(R, box_length, 1.5, half=True)
+    assert 2 * half.n_entries == full.n_entries, "the half list should store every pair once"
+    assert np.all(half.rows() < half.indices), "the half list should only contain i < j"
+
+    LJ = lennard_jones()
+    F_full = LJ.compute_forces(R, ip.sigma, ip.epsilon, labels, L, switch_parameter, 1.4, full)
+    F_half = LJ.compute_forces(R, ip.sigma, ip.epsilon, labels, L, switch_parameter, 1.4, half)
+    assert np.allclose(F_full, F_half), "LJ forces differ for the half list"
+    P_full = LJ.compute_potential(ip.sigma, ip.epsilon, labels, full, None, r_s=1.2, r_c=1.5)
+    P_half = LJ.compute_potential(ip.sigma, ip.epsilon, labels, half, None, r_s=1.2, r_c=1.5)
+    assert np.allclose(P_full, P_half), "LJ potential differs for the half list"
+    c = coulomb(n_boxes_short_range, L, p_error)
+    P_full = c.compute_potential(labels, R, full, None, 1.2, 1.5)
+    P_half = c.compute_potential(labels, R, half, None, 1.2, 1.5)
+    assert np.allclose(P_full, P_half), "coulomb potential differs for the half list"
+
+
+def test_pair_displacements():
+    N = 30
+    R = np.random.rand(N, 3) * 4.0
+    dense = np.zeros((N, N, 3))
+    for i in range(3):
+        dense[:, :, i] = np.subtract.outer(R[:, i], R[:, i])
+    d_Pos = pair_displacements(R, max_elements=200)
+    assert np.allclose(np.asarray(d_Pos), dense), "materialized displacements differ from the dense tensor"
+    assert np.allclose(d_Pos[3], dense[3]) and np.allclose(d_Pos[2:5, 7:9, 1], dense[2:5, 7:9, 1]), "indexing differs"
+    blocks = list(d_Pos.chunks(rows=slice(5, N), columns=slice(0, 10)))
+    assert len(blocks) > 1, "small max_elements should give several blocks"
+    assert np.allclose(np.concatenate([d for start, stop, d in blocks]), dense[5:, :10]), "blocks differ"
+
+    labels = np.zeros((N, 3))
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    c = coulomb(1, np.array([4.0] * 3), p_error)
+    assert np.allclose(c.compute_forces(d_Pos, labels, np.array([4.0] * 3)),
+                       c.compute_forces(dense, labels, np.array([4.0] * 3))), "coulomb forces differ for the provider"
+
+    # the histogram only needs the method, not a fully set up simulation
+    sim = md.__new__(md)
+    distances = np.linalg.norm(dense, axis=2)
+    expected = np.array([np.sum((distances > i * 0.5) & (distances < i * 0.5 + 0.5)) for i in range(4)])
+    expected = expected / (4 * np.pi / 3 * ((np.arange(4) * 0.5 + 0.5) ** 3 - (np.arange(4) * 0.5) ** 3)) / N
+    assert np.allclose(sim.radial_distribution(distances, 0.5, 2.0, N, 1.0), expected), "radial distribution is wrong"
+    assert np.allclose(sim.radial_distribution((distances[i:i + 7] for i in range(0, N, 7)), 0.5, 2.0, N, 1.0),
+                       expected), "blocked radial distribution differs"
+
+
+def test_coulomb_forces_neighbourlist():
+    N = 60
+    box_length = 6.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    c = coulomb(1, L, p_error)
+    # narrow gaussians, so the pairs beyond the cutoff and the further images do not contribute
+    c.std = 0.49 * box_length / 7.5
+    d_Pos = pair_displacements(R)
+    F_dense = c.compute_forces(d_Pos, labels, L)
+    for half in (False, True):
+        neighbours = neighbourlist().compute_csr_neighbourlist(R, box_length, 0.49 * box_length, half)
+        F_list = c.compute_forces(d_Pos, labels, L, neighbours)
+        assert np.max(np.abs(F_list - F_dense)) < 1e-10 * np.max(np.abs(F_dense)), \
+            "short range coulomb forces of the neighbourlist differ"
+
+
+def test_jit_backend():
+    # the loop kernels also run without numba (uncompiled), so they are checked in any environment
+    assert select_backend('numpy') == 'numpy'
+    assert select_backend('numba') in ('numpy', 'numba')
+    N = 50
+    box_length = 6.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    for r_cut in (1.9, 3.5):
+        # both backends scan the same cells and stencil in the same order
+        pairs = cell_list_pairs(R, box_length, r_cut)
+        pairs_ref = neighbourlist('numpy').compute_pairs(R, box_length, r_cut)
+        for result, reference in zip(pairs, pairs_ref):
+            assert np.array_equal(result, reference), "cell list finds different pairs"
+
+    labels = np.zeros((N, 3))
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    labels[N // 2:, 2] = 1
+    switch_parameter = np.array([1, 0.5, -0.1, 0.01])
+    c = coulomb(1, L, p_error)
+    for half in (False, True):
+        neighbours = neighbourlist().compute_csr_neighbourlist(R, box_length, 2.5, half)
+        LJ = lennard_jones()
+        F_LJ = LJ.compute_forces(R, ip.sigma, ip.epsilon, labels, L, switch_parameter, 2.0, neighbours)
+        F_C = c.compute_forces(pair_displacements(R), labels, L, neighbours)
+        LJ.backend = c.backend = 'numba'
+        assert np.allclose(LJ.compute_forces(R, ip.sigma, ip.epsilon, labels, L, switch_parameter, 2.0, neighbours),
+                           F_LJ), "jitted LJ forces differ"
+        assert np.allclose(c.compute_forces(pair_displacements(R), labels, L, neighbours), F_C), \
+            "jitted coulomb forces differ"
+        c.backend = 'numpy'
+
+
+def test_spme():
+    N = 40
+    box_length = 8.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    # reference: direct sum over all k-vectors up to a large cutoff
+    ewald = coulomb(1, L, p_error, k_cut=6.0)
+    grid = coulomb(1, L, p_error, k_cut=6.0, reciprocal='spme', order=6, grid=32)
+    ewald.std = grid.std = 0.8
+    grid.spme = spme(box_length, 0.8, grid.epsilon0, 32, 6)
+    F_ewald = ewald.compute_forces(pair_displacements(R), labels, L)
+    F_spme = grid.compute_forces(pair_displacements(R), labels, L)
+    assert np.max(np.abs(F_spme - F_ewald)) < 1e-3 * np.max(np.abs(F_ewald)), "SPME forces differ from the Ewald sum"
+    P_ewald = ewald.compute_potential(labels, R, {}, {}, 1.0, 1.5)
+    P_spme = grid.compute_potential(labels, R, {}, {}, 1.0, 1.5)
+    assert np.max(np.abs(P_spme - P_ewald)) < 1e-4 * np.max(np.abs(P_ewald)), "SPME potential differs from the Ewald sum"
+
+    # the forces are the negative gradient of the energy
+    h = 1e-5
+    R_plus, R_minus = R.copy(), R.copy()
+    R_plus[3, 1] += h
+    R_minus[3, 1] -= h
+    dE = grid.spme.compute_energy(labels[:, 1], R_plus) - grid.spme.compute_energy(labels[:, 1], R_minus)
+    assert abs(-dE / (2 * h) - grid.spme.compute_forces(labels[:, 1], R)[3, 1]) < 1e-4 * np.max(np.abs(F_spme)), \
+        "SPME forces are not the gradient of the SPME energy"
+
+    # forces, energy and virial from one solve on the grid
+    F, E, W = grid.compute_long_range(labels, R)
+    F_ref, E_ref, W_ref = ewald.compute_long_range(labels, R)
+    assert np.allclose(F, grid.spme.compute_forces(labels[:, 1], R), rtol=0, atol=1e-12)
+    assert np.isclose(E - E_ref, grid.spme.compute_energy(labels[:, 1], R) - ewald.structure_factor.compute_energy(),
+                      rtol=1e-12, atol=1e-12)
+    assert np.max(np.abs(W - W_ref)) < 1e-3 * np.max(np.abs(W_ref)), "SPME virial differs from the Ewald sum"
+
+    # every entry point reuses the solution of the same configuration
+    solver = spme(box_length, 0.8, grid.epsilon0, 32, 6)
+    E = solver.compute_energy(labels[:, 1], R)
+    P = solver.compute_potential(labels[:, 1], R)
+    F = solver.compute_forces(labels[:, 1], R)
+    W = solver.compute_virial(labels[:, 1], R)
+    assert solver.n_solves == 1, "the grid was solved more than once for the same configuration"
+    assert np.allclose(P, grid.spme.compute_potential(labels[:, 1], R), rtol=0, atol=1e-12)
+    R_moved = R.copy()
+    R_moved[0] += 0.1
+    solver.compute_forces(labels[:, 1], R_moved)
+    assert solver.n_solves == 2, "a new configuration has to be solved again"
+    # the cache holds a copy, changing the positions in place is a new configuration
+    R_moved[1] += 0.1
+    solver.compute_forces(labels[:, 1], R_moved)
+    assert solver.n_solves == 3
+    F_all, E_all, W_all = solver.compute_forces_energy_virial(labels[:, 1], R)
+    assert solver.n_solves == 4
+    assert np.array_equal(F_all, F) and E_all == E and np.array_equal(W_all, W)
+
+
+def test_structure_factor():
+    N = 30
+    box_length = 6.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    c = coulomb(1, L, p_error, k_cut=3.0)
+    sf = structure_factor(c.k_list, c.std, c.volume, c.epsilon0)
+    sf.compute(labels[:, 1], R)
+
+    # pairwise reference of the force: 2 q_i/(V epsilon0) sum_(half k) G(k) k sum_j q_j sin(k (r_i - r_j))
+    d = R[:, np.newaxis, :] - R[np.newaxis, :, :]
+    k_half = c.k_list[len(c.k_list) // 2:]
+    k_squared = np.sum(k_half ** 2, axis=1)
+    G = np.exp(-c.std ** 2 * k_squared / 2) / k_squared
+    sin_sum = np.tensordot(np.sin(np.tensordot(d, k_half, (2, 1))), labels[:, 1], (1, 0))
+    F_reference = 2 * labels[:, 1, np.newaxis] * np.dot(sin_sum * G, k_half) / (c.volume * c.epsilon0)
+    assert np.allclose(sf.compute_forces(), F_reference), "structure factor forces are wrong"
+
+    # moving a few particles updates S(k) incrementally to the same result
+    R_new = R.copy()
+    R_new[[2, 7]] += 0.3
+    sf.update(labels[:, 1], R_new)
+    assert sf.n_incremental == 1, "a small move should not recompute S(k) from scratch"
+    S_incremental = sf.S.copy()
+    E_incremental = sf.compute_energy()
+    sf.compute(labels[:, 1], R_new)
+    assert np.allclose(S_incremental, sf.S), "incremental update of S(k) is wrong"
+    assert np.isclose(E_incremental, sf.compute_energy()), "energy after incremental update is wrong"
+
+    # many single particle moves do not let S(k) drift away from a computation from scratch
+    sf = structure_factor(c.k_list, c.std, c.volume, c.epsilon0, box_length, n_refresh=100)
+    sf.compute(labels[:, 1], R)
+    reference = structure_factor(c.k_list, c.std, c.volume, c.epsilon0, box_length)
+    for step in range(250):
+        R[step % N] = np.remainder(R[step % N] + 0.1 * (np.random.rand(3) - 0.5), box_length)
+        sf.move(step % N, R[step % N])
+        if step == 199:
+            assert sf.n_full == 3, "S(k) was not summed again after n_refresh moves"
+            assert np.allclose(sf.S, reference.compute(labels[:, 1], R), rtol=0, atol=1e-12 * N)
+    assert sf.n_incremental == 250 and sf.n_full == 3
+    assert np.allclose(sf.S, reference.compute(labels[:, 1], R), rtol=0, atol=1e-12 * N), "S(k) drifts"
+    assert np.isclose(sf.compute_energy(), reference.compute_energy())
+
+
+def test_sharded_structure_factor():
+    N = 40
+    box_length = 8.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    charges = np.where(np.arange(N) % 2 == 0, 1.0, -1.0)
+    c = coulomb(1, L, p_error, k_cut=4.0)
+    reference = structure_factor(c.k_list, c.std, box_length ** 3, c.epsilon0, box_length)
+    reference.compute(charges, R)
+    results = []
+    for n_workers in (1, 2):
+        sharded = sharded_structure_factor(c.k_list, c.std, box_length ** 3, c.epsilon0, box_length, n_workers, 3)
+        sharded.update(charges, R)
+        results.append((sharded.compute_forces(), sharded.compute_energy(), sharded.compute_virial(),
+                        sharded.compute_potential()))
+        sharded.close()
+    for result, expected in zip(results[0], (reference.compute_forces(), reference.compute_energy(),
+                                             reference.compute_virial(), reference.compute_potential())):
+        assert np.allclose(result, expected, rtol=1e-12, atol=1e-12 * np.max(np.abs(expected)))
+    # for a fixed number of shards the result does not depend on the number of workers
+    for a, b in zip(results[0], results[1]):
+        assert np.array_equal(a, b), "sharded reciprocal sum is not deterministic"
+
+
+def test_phase_tables():
+    box_length = 5.0
+    R = np.random.rand(20, 3) * 3 * box_length - box_length
+    c = coulomb(1, np.array([box_length] * 3), p_error, k_cut=4.0)
+    tables = phase_tables(R, box_length, 3)
+    assert np.allclose(tables[1, :, 3 + 2], np.exp(2j * np.pi * 2 * R[:, 1] / box_length)), "phase table is wrong"
+    assert np.allclose(tables[2, :, 3 - 3], np.exp(-2j * np.pi * 3 * R[:, 2] / box_length)), "phase table is wrong"
+    separable = structure_factor(c.k_list, c.std, c.volume, c.epsilon0, box_length)
+    assert separable.n is not None, "k_list should be recognized as multiples of 2 pi / L"
+    assert np.allclose(separable.compute_phases(R), np.exp(1j * np.dot(R, c.k_list.T))), \
+        "separable phases differ from exp(i k r)"
+
+
+def test_pair_potentials():
+    N = 40
+    box_length = 5.0
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:N // 2, 1] = 1
+    labels[N // 2:, 1] = -1
+    labels[N // 2:, 2] = 1
+    r_s, r_c = 1.5, 2.0
+    neighbours, distances = neighbourlist().compute_neighbourlist(R, box_length, r_c)
+    c = coulomb(1, np.array([box_length] * 3), p_error)
+    LJ = lennard_jones()
+    switch = lambda r: np.where(r < r_s, 1., 1 - 10 * ((r - r_s) / (r_c - r_s)) ** 3
+                                + 15 * ((r - r_s) / (r_c - r_s)) ** 4 - 6 * ((r - r_s) / (r_c - r_s)) ** 5)
+    P_C = np.zeros(N)
+    P_LJ = np.zeros(N)
+    for i in range(N):
+        for j, r in zip(neighbours[i], distances[i]):
+            P_C[i] += labels[j, 1] * erfc(r / (np.sqrt(2) * c.std)) / r * switch(r) / (8 * np.pi * c.epsilon0)
+            k = int(labels[i, 2] + labels[j, 2])
+            P_LJ[i] += 4 * ip.epsilon[k] * ((ip.sigma[k] / r) ** 12 - (ip.sigma[k] / r) ** 6) * switch(r)
+    assert np.allclose(c._coulomb__short_range_potential(labels, neighbours, distances, r_s, r_c), P_C), \
+        "short range coulomb potential is wrong"
+    assert np.allclose(LJ.compute_potential(ip.sigma, ip.epsilon, labels, neighbours, distances, r_s, r_c), P_LJ), \
+        "LJ potential is wrong"
+
+
+def test_fused_pairs():
+    MDobj = _small_md()
+    Positions, Labels = MDobj.positions, MDobj.labels
+    Forces, Energy, Virial = MDobj.get_forces_energy_virial()
+    assert np.allclose(Forces, MDobj.get_forces()), "fused forces differ from get_forces"
+    assert np.isclose(Energy, MDobj.get_energy()), "fused energy differs from get_energy"
+
+    # for a cluster that does not cross the box boundary the pair virial is sum_i r_i x F_i
+    cluster = Positions[:8] * 0.5 + 10.0
+    engine = MDobj.pair_engine
+    neighbours = neighbourlist().compute_csr_neighbourlist(cluster, 30.0, engine.r_cut)
+    F, E, W = engine.compute(cluster, Labels[:8], np.array([30.0] * 3), neighbours)
+    assert np.allclose(W, np.dot(cluster.T, F)), "pair virial is wrong"
+    half = neighbourlist().compute_csr_neighbourlist(cluster, 30.0, engine.r_cut, half=True)
+    F_half, E_half, W_half = engine.compute(cluster, Labels[:8], np.array([30.0] * 3), half)
+    assert np.allclose(F, F_half) and np.isclose(E, E_half) and np.allclose(W, W_half), "half list differs"
+
+
+def test_pair_tables():
+    MDobj = _small_md(tables='cubic')
+    Positions, Labels, L = MDobj.positions, MDobj.labels, MDobj.L
+    engine = MDobj.pair_engine
+    assert engine.tables.check() < 1e-6, "cubic tables are not accurate"
+    neighbours = neighbourlist().compute_csr_neighbourlist(Positions, L[0], engine.r_cut)
+    F_table, E_table, W_table = engine.compute(Positions, Labels, L, neighbours)
+    # tables are read by the pair engine, they switch on fused_pairs for get_forces, get_energy and the integrator
+    assert MDobj.fused_pairs
+    F_long, E_long, W_long = MDobj.coulomb.compute_long_range(Labels, Positions)
+    assert np.allclose(MDobj.get_forces(), F_table + F_long, rtol=1e-12, atol=1e-12)
+    assert np.isclose(MDobj.get_energy(), E_table + E_long, rtol=1e-12)
+    engine.tables = None
+    F, E, W = engine.compute(Positions, Labels, L, neighbours)
+    assert np.allclose(F_table, F, rtol=1e-5, atol=1e-8 * np.max(np.abs(F))), "tabulated forces are wrong"
+    assert np.isclose(E_table, E, rtol=1e-6), "tabulated energy is wrong"
+    assert np.allclose(W_table, W, rtol=1e-5, atol=1e-8 * np.max(np.abs(W))), "tabulated virial is wrong"
+
+    linear = pair_tables(engine, 1.0, 64, 'linear')
+    assert linear.check() > pair_tables(engine, 1.0, 64, 'cubic').check(), "cubic should beat linear interpolation"
+    # pairs closer than r_min use the analytic functions
+    dist_2 = np.array([0.25, 1.5, 4.0])
+    index_LJ = np.array([0, 1, 2])
+    assert linear.lj_kernel(index_LJ, dist_2)[0][0] == engine.lj_kernel(index_LJ, dist_2)[0][0]
+    assert linear.coulomb_kernel(dist_2)[1][0] == engine.coulomb_kernel(dist_2)[1][0]
+
+
+def test_parallel_pair_engine():
+    N = 120
+    box_length = 8.0
+    L = np.array([box_length] * 3)
+    R = np.random.rand(N, 3) * box_length
+    labels = np.zeros((N, 3))
+    labels[:, 1] = np.where(np.arange(N) % 2 == 0, 1.0, -1.0)
+    labels[:, 2] = np.arange(N) % 2
+    c = coulomb(1, L, p_error)
+    c.std = 0.8
+    engine = pair_engine(c, ip.sigma, ip.epsilon, np.array([1.0, 0.0, 0.0, 0.0]), 2.0, 2.4, 3.0)
+    for half in (False, True):
+        neighbours = neighbourlist().compute_csr_neighbourlist(R, box_length, engine.r_cut, half)
+        F, E, W = engine.compute(R, labels, L, neighbours)
+        for executor in ('thread', 'process'):
+            parallel = parallel_pair_engine(engine, labels, 2, executor, n_slabs=3)
+            F_p, E_p, W_p = parallel.compute(R, labels, L, neighbours)
+            # a second call reuses the pool and the shared memory
+            F_p, E_p, W_p = parallel.compute(R, labels, L, neighbours)
+            parallel.close()
+            assert np.allclose(F_p, F, rtol=1e-12, atol=1e-12 * np.max(np.abs(F))), "parallel forces differ"
+            assert np.isclose(E_p, E, rtol=1e-12) and np.allclose(W_p, W, rtol=1e-12, atol=1e-12 * np.max(np.abs(W)))
+
+
+def _domain_run(transport, engine, c, L, Positions, Velocities, Labels):
+    decomposition = domain_decomposition(transport, engine, c, L, Positions, Velocities, Labels)
+    first_ids = decomposition.ids.copy()
+    energies = decomposition.run(10, ip.dt)
+    return decomposition.gather(), energies, not np.array_equal(first_ids, np.sort(decomposition.ids))
+
+
+def test_domain_decomposition():
+    box_length = 14.0
+    L = np.array([box_length] * 3)
+    grid = np.arange(6) * box_length / 6
+    Positions = np.array(np.meshgrid(grid, grid, grid)).reshape(3, -1).T + np.random.rand(216, 3) * 0.1
+    species = (np.sum(np.round(Positions / (box_length / 6)), axis=1) % 2).astype(int)
+    Labels = np.zeros((216, 3))
+    Labels[:, 0] = 22.99
+    Labels[:, 1] = np.where(species == 0, 1.0, -1.0)
+    Labels[:, 2] = species
+    # a drift along x moves particles across the slab boundaries
+    Velocities = np.random.randn(216, 3) * 0.01
+    Velocities[:, 0] += 300
+    c = coulomb(1, L, ip.p, epsilon0=epsilon_0 / (36.938 * 10 ** -9), k_cut=2.0)
+    c.std = 1.0
+    engine = pair_engine(c, np.array([2.5, 2.8, 3.1]), np.array([0.1, 0.1, 0.1]), np.array([1.0, 0.0, 0.0, 0.0]),
+                         4.0, 4.5, 4.5)
+
+    # a single domain is the serial reference
+    serial = domain_decomposition(pipe_transport.create(1)[0], engine, c, L, Positions, Velocities, Labels)
+    neighbours = neighbourlist().compute_csr_neighbourlist(Positions, box_length, engine.r_cut)
+    F, E, W = engine.compute(Positions, Labels, L, neighbours)
+    F_long, E_long, W_long = c.compute_long_range(Labels, Positions)
+    assert np.allclose(serial.forces, F + F_long) and np.isclose(serial.energy, E + E_long)
+    reference = _domain_run(pipe_transport.create(1)[0], engine, c, L, Positions, Velocities, Labels)
+
+    for (positions, velocities, forces), energies, migrated in pipe_transport.spawn(
+            2, _domain_run, engine, c, L, Positions, Velocities, Labels):
+        assert migrated, "no particle changed its domain"
+        assert np.allclose(positions, reference[0][0], rtol=0, atol=1e-10)
+        assert np.allclose(velocities, reference[0][1], rtol=1e-10, atol=1e-12)
+        assert np.allclose(energies, reference[1], rtol=1e-12), "domain decomposition changes the trajectory"
+
+
+def test_replicas():
+    box_length = 14.0
+    L = np.array([box_length] * 3)
+    grid = np.arange(6) * box_length / 6
+    lattice = np.array(np.meshgrid(grid, grid, grid)).reshape(3, -1).T
+    species = (np.sum(np.round(lattice / (box_length / 6)), axis=1) % 2).astype(int)
+    Labels = np.zeros((216, 3))
+    Labels[:, 0] = 22.99
+    Labels[:, 1] = np.where(species == 0, 1.0, -1.0)
+    Labels[:, 2] = species
+    Positions = lattice + np.random.rand(3, 216, 3) * 0.3
+    Velocities = np.random.randn(3, 216, 3) * 5
+    c = coulomb(1, L, ip.p, epsilon0=epsilon_0 / (36.938 * 10 ** -9), k_cut=2.0)
+    c.std = 1.0
+    engine = pair_engine(c, np.array([2.5, 2.8, 3.1]), np.array([0.1, 0.1, 0.1]), np.array([1.0, 0.0, 0.0, 0.0]),
+                         4.0, 4.5, 4.5)
+    batch = replicas(Positions, Velocities, Labels, L, [300.0, 600.0, 900.0], engine, c, ip.dt, 0.0)
+    batch.run(5)
+    for r in range(3):
+        # every replica follows the trajectory of a separate serial run
+        serial = domain_decomposition(pipe_transport.create(1)[0], engine, c, L, Positions[r], Velocities[r], Labels)
+        serial.run(5, ip.dt)
+        positions, velocities, forces = serial.gather()
+        assert np.allclose(batch.positions[r], positions, rtol=0, atol=1e-10)
+        assert np.allclose(batch.velocities[r], velocities, rtol=1e-10, atol=1e-12)
+        assert np.isclose(batch.energy[r], serial.energy, rtol=1e-10)
+        assert np.allclose(batch.virial[r], serial.virial, rtol=1e-10, atol=1e-10 * np.max(np.abs(serial.virial)))
+    m = Labels[:, 0]
+    internal = batch.velocities[1] - np.dot(m, batch.velocities[1]) / np.sum(m)
+    assert np.isclose(batch.temperatures()[1], np.sum(m[:, np.newaxis] * internal ** 2) / 0.0001987191 / 645)
+
+
+def test_parallel_tempering():
+    MDobj = _small_md(fused_pairs=True)
+    temperatures = np.array([100.0, 200.0, 400.0])
+    md_objects = []
+    for T in temperatures:
+        replica = copy.deepcopy(MDobj)
+        replica.velocities = np.random.randn(64, 3) * 0.1
+        md_objects.append(replica)
+
+    results = []
+    for processes in (False, True):
+        tempering = parallel_tempering(copy.deepcopy(md_objects), temperatures, processes, seed=1, kB=1.0)
+        energies = tempering.run(4, 2)
+        configurations = tempering.configurations()
+        tempering.close()
+        results.append((energies, tempering.history, configurations))
+        # the even and the odd neighbours are tried in turns
+        assert np.array_equal(tempering.attempts, [2, 2])
+        # kB = 1 makes every exchange likely
+        assert np.sum(tempering.accepted) > 0 and np.all(tempering.acceptance_rates() <= 1)
+        assert np.array_equal(np.sort(tempering.replica_at), np.arange(3))
+    # replicas in processes follow the serial exchanges exactly
+    assert np.allclose(results[0][0], results[1][0], rtol=1e-12)
+    assert np.array_equal(results[0][1], results[1][1])
+    for serial, parallel in zip(results[0][2], results[1][2]):
+        assert np.allclose(serial[0], parallel[0]) and np.allclose(serial[1], parallel[1])
+
+    # a much higher energy moves to the higher temperature, never to the lower one
+    tempering = parallel_tempering(copy.deepcopy(md_objects), temperatures, processes=False)
+    tempering.exchange(np.array([0.0, 1e6, 0.0]))
+    tempering.exchange(np.array([0.0, 1e6, 0.0]))
+    assert np.array_equal(tempering.accepted, [0, 1]) and np.array_equal(tempering.replica_at, [0, 2, 1])
+
+
+def test_force_cache():
+    for fused_pairs in (False, True):
+        MDobj = _small_md(fused_pairs=fused_pairs)
+        assert MDobj.get_forces() is MDobj.forces, "the forces of the same positions are computed twice"
+        calls = []
+        compute_forces = MDobj.lennard_jones.compute_forces
+        engine_compute = MDobj.pair_engine.compute
+        MDobj.lennard_jones.compute_forces = lambda *args, **kwargs: calls.append(1) or compute_forces(*args, **kwargs)
+        MDobj.pair_engine.compute = lambda *args, **kwargs: calls.append(1) or engine_compute(*args, **kwargs)
+        version = MDobj.positions_version
+        for step in range(3):
+            MDobj.positions, MDobj.velocities, MDobj.forces = MDobj.propagte_system()
+            assert MDobj.get_forces() is MDobj.forces
+            MDobj.get_energy()
+        assert len(calls) == 3, "one force evaluation per step"
+        assert MDobj.positions_version == version + 3
+        # the forces of the step belong to the new positions
+        del MDobj.lennard_jones.compute_forces, MDobj.pair_engine.compute
+        Energy = MDobj.get_energy()
+        MDobj.positions = MDobj.positions.copy()
+        assert np.allclose(MDobj.get_forces(), MDobj.forces, rtol=1e-10, atol=1e-10)
+        assert np.isclose(MDobj.get_energy(), Energy, rtol=1e-10)
+
+
+def test_trajectory_writer(tmp_path):
+    path = str(tmp_path / 'traj.bin')
+    species = np.array([0, 1, 1, 0])
+    frames = np.random.rand(10, 4, 3) * 5
+    writer = trajectory_writer(path, species, np.array(['Na', 'Cl']), np.array([5.0] * 3), buffer_frames=3,
+                               preallocate=4)
+    for n in range(6):
+        writer.write(frames[n], 10 * n)
+    writer.flush()
+    with open(path, 'rb') as f:
+        assert read_header(f)[0] == 6, "flush does not update the frame count"
+    writer.close()
+    # appending keeps the old frames
+    with trajectory_writer(path, species, np.array(['Na', 'Cl']), np.array([5.0] * 3), append=True) as writer:
+        for n in range(6, 10):
+            writer.write(frames[n], 10 * n)
+    with open(path, 'rb') as f:
+        n_frames, species_read, symbols, L, offset = read_header(f)
+    assert n_frames == 10 and np.array_equal(species_read, species) and list(symbols) == ['Na', 'Cl']
+    data = np.fromfile(path, dtype=frame_dtype(4), offset=offset)
+    assert len(data) == 10, "the preallocated space is not removed"
+    assert np.array_equal(data['step'], 10 * np.arange(10))
+    assert np.allclose(data['positions'], frames, rtol=1e-6)
+
+    export_xyz(path, str(tmp_path / 'traj.xyz'), slice(2, 10, 4))
+    lines = open(str(tmp_path / 'traj.xyz')).read().split('\n')
+    assert lines[0] == '4' and lines[2].split()[0] == 'Na' and lines[3].split()[0] == 'Cl'
+    assert np.allclose([float(x) for x in lines[8].split()[1:]], frames[6, 0], atol=1e-6)
+
+
+def test_trajectory_reader(tmp_path):
+    path = str(tmp_path / 'traj.bin')
+    species = np.array([0, 0, 0, 1, 1])
+    frames = (np.random.rand(50, 5, 3) * 5).astype(np.float32)
+    with trajectory_writer(path, species, np.array(['Na', 'Cl']), np.array([5.0] * 3), buffer_frames=7) as writer:
+        for n in range(50):
+            writer.write(frames[n], n)
+    traj = trajectory_reader(path)
+    assert len(traj) == 50 and traj.shape == (50, 5, 3) and np.array_equal(traj.steps, np.arange(50))
+    assert np.array_equal(traj[10:40:10], frames[10:40:10]) and np.array_equal(traj[-1], frames[-1])
+    assert np.array_equal(np.asarray(traj), frames)
+
+    # xyz files as written by export_xyz and by older versions of get_traj (a header after every frame)
+    export_xyz(path, str(tmp_path / 'traj.xyz'))
+    old = str(tmp_path / 'old.xyz')
+    with open(old, 'w') as f:
+        f.write('5\n\n')
+        for n in range(3):
+            f.write(''.join('%s %f %f %f\n' % ((('A', 'A', 'A', 'B', 'B')[p],) + tuple(frames[n, p])) for p in range(5)))
+            f.write('5\n\n')
+    traj = xyz_reader(str(tmp_path / 'traj.xyz'))
+    assert len(traj) == 50 and list(traj.names) == ['Na'] * 3 + ['Cl'] * 2
+    assert np.allclose(traj[10:40:10], frames[10:40:10], atol=1e-6)
+    particle_type_A, particle_num_A, particle_type_B, particle_num_B, position_array = md.import_traj(None, old)
+    assert (particle_type_A, particle_num_A, particle_type_B, particle_num_B) == ('A', 3, 'B', 2)
+    assert len(position_array) == 3 and np.allclose(position_array[1:], frames[1:3], atol=1e-6)
+    assert md.import_traj(None, path)[:4] == ('Na', 3, 'Cl', 2)
+
+
+def test_hdf5_trajectory(tmp_path):
+    pytest.importorskip('h5py')
+    path = str(tmp_path / 'traj.h5')
+    frames = np.random.rand(3, 12, 64, 3)
+    metadata = {'Symbols': np.array(['Na', 'Cl']), 'labels': np.repeat([[22.99, 1.0, 0.0], [35.45, -1.0, 1.0]], 32, axis=0),
+                'L': np.array([6.0] * 3), 'dt': ip.dt}
+    with hdf5_writer(path, metadata, chunk_frames=4) as writer:
+        for n in range(8):
+            writer.write(frames[0, n], 10 * n, frames[1, n], frames[2, n])
+            writer.append('energies', 10 * n, -n)
+    with hdf5_writer(path, compression='lzf', append=True) as writer:
+        for n in range(8, 12):
+            writer.write(frames[0, n], 10 * n, frames[1, n], frames[2, n])
+    traj = hdf5_reader(path)
+    assert len(traj) == 12 and traj.metadata['dt'] == ip.dt and list(traj.names[[0, -1]]) == ['Na', 'Cl']
+    assert np.allclose(traj[2:11:4], frames[0, 2:11:4], atol=1e-6)
+    assert np.allclose(traj.read('forces', slice(5, 7)), frames[2, 5:7], atol=1e-6)
+    assert np.array_equal(traj.read('step'), 10 * np.arange(12)) and np.array_equal(traj.read('energies'), -np.arange(8))
+    assert traj.file['positions'].compression == 'gzip' and traj.file['positions'].chunks[0] == 4
+    traj.close()
+    with hdf5_writer(path, append=True) as writer:
+        writer.truncate(50)
+    traj = hdf5_reader(path)
+    assert len(traj) == 6 and traj.read('forces').shape[0] == 6 and np.array_equal(traj.read('energies'), -np.arange(6))
+    traj.close()
+
+    # a run of get_traj into one HDF5 file
+    MDobj = _small_md()
+    run = str(tmp_path / 'run')
+    MDobj.get_traj(6, 2, 3, 3, run, hdf5=True)
+    traj = hdf5_reader(run + '\\traj.h5')
+    assert np.array_equal(traj.read('step'), [0, 3, 6]) and np.array_equal(traj.read('energies_step'), [2, 4, 6])
+    assert np.allclose(traj[-1], MDobj.positions, atol=1e-5) and np.isclose(traj.metadata['std'], MDobj.std)
+    assert np.allclose(traj.read('velocities', -1), MDobj.velocities, rtol=1e-6)
+    # the radial distributions of the frames are in the same file
+    rdf = traj.read('rdf')
+    assert np.array_equal(traj.read('rdf_step'), [0, 3, 6]) and rdf.shape[:2] == (3, 2)
+    assert np.allclose(rdf[-1], MDobj.get_radial_distribution(positions=traj[-1]))
+    assert not os.path.exists(run + '\\rdf')
+    traj.close()
+    # a second run continues the file
+    MDobj.get_traj(6, 2, 3, 3, run, hdf5=True)
+    traj = hdf5_reader(run + '\\traj.h5')
+    assert np.array_equal(traj.read('step'), [0, 3, 6, 9, 12])
+    assert np.array_equal(traj.read('rdf_step'), [0, 3, 6, 9, 12])
+    assert np.array_equal(traj.read('energies_step'), [2, 4, 6, 8, 10, 12])
+    traj.close()
+
+
+def test_hdf5_lz4(tmp_path):
+    pytest.importorskip('h5py')
+    hdf5plugin = pytest.importorskip('hdf5plugin')
+    path = str(tmp_path / 'traj.h5')
+    frames = np.random.rand(5, 8, 3)
+    with hdf5_writer(path, compression='lz4', chunk_frames=2) as writer:
+        for n in range(5):
+            writer.write(frames[n], n)
+    traj = hdf5_reader(path)
+    assert np.allclose(traj[:], frames, atol=1e-6)
+    assert str(hdf5plugin.LZ4_ID) in traj.file['positions']._filters
+    traj.close()
+
+
+def test_output_pipeline(tmp_path):
+    received = []
+
+    def slow_consumer(snapshot):
+        time.sleep(0.01)
+        received.append((snapshot['step'], snapshot['positions'][0, 0]))
+
+    positions = np.zeros((4, 3))
+    with output_pipeline([slow_consumer], queue_size=2) as pipeline:
+        for step in range(10):
+            positions[0, 0] = step
+            pipeline.push(step, positions=positions)
+    # the snapshots are copies and arrive in order
+    assert received == [(step, step) for step in range(10)]
+    pipeline = output_pipeline([slow_consumer], queue_size=1, when_full='drop')
+    accepted = [pipeline.push(step, positions=positions) for step in range(10)]
+    pipeline.close()
+    assert pipeline.n_dropped > 0 and pipeline.n_dropped + pipeline.n_pushed == 10 and not all(accepted)
+    # snapshots that are not droppable wait for the writer thread
+    del received[:]
+    with output_pipeline([slow_consumer], queue_size=1, when_full='drop') as pipeline:
+        assert all(pipeline.push(step, False, positions=positions) for step in range(10))
+    assert len(received) == 10 and pipeline.n_dropped == 0
+
+    # an interrupted run still writes the frames and energies up to the interrupt
+    MDobj = _small_md()
+    propagate = MDobj.propagte_system
+    steps = []
+
+    def interrupted():
+        if len(steps) == 5:
+            raise KeyboardInterrupt
+        steps.append(1)
+        return propagate()
+
+    MDobj.propagte_system = interrupted
+    run = str(tmp_path / 'run')
+    try:
+        MDobj.get_traj(20, 1, 1, 1, run)
+        assert False, "the interrupt is not raised"
+    except KeyboardInterrupt:
+        pass
+    traj = trajectory_reader(run + '\\traj.bin')
+    assert np.array_equal(traj.steps, np.arange(6)) and np.allclose(traj[-1], MDobj.positions, atol=1e-5)
+    assert np.count_nonzero(np.loadtxt(run + '\\Energies')) == 5
+    assert len(open(run + '\\rdf').read().splitlines()) == 12
+
+    # an error of a consumer in the last frame does not keep the other files from being written
+    MDobj = _small_md()
+    radial_distribution = MDobj.get_radial_distribution
+    frames = []
+
+    def failing(positions):
+        frames.append(1)
+        if len(frames) == 3:
+            raise ValueError('rdf failed')
+        return radial_distribution(positions=positions)
+
+    MDobj.get_radial_distribution = failing
+    run = str(tmp_path / 'failed')
+    with pytest.raises(ValueError):
+        MDobj.get_traj(4, 1, 1, 2, run)
+    traj = trajectory_reader(run + '\\traj.bin')
+    assert np.array_equal(traj.steps, [0, 2, 4]) and np.count_nonzero(np.loadtxt(run + '\\Energies')) == 4
+    assert np.count_nonzero(np.loadtxt(run + '\\Temperature')) == 4
+
+
+def test_checkpoint(tmp_path, monkeypatch):
+    for fused_pairs in (False, True):
+        np.random.seed(3)
+        MDobj = _small_md(p_rea=0.2, fused_pairs=fused_pairs, r_skin=0.02)
+        path = str(tmp_path / ('run%d' % fused_pairs))
+        MDobj.get_traj(4, 1, 1, 2, path, checkpoint_save=4)
+        assert MDobj.n_steps == 4
+
+        def advance(md_object):
+            states = []
+            for step in range(4):
+                md_object.positions, md_object.velocities, md_object.forces = md_object.propagte_system()
+                md_object.neighbours_LJ, md_object.distances_LJ = md_object.update_neighbourlist_LJ()
+                md_object.neighbours_coulomb, md_object.distances_coulomb = md_object.update_neighbourlist_coulomb()
+                states.append((md_object.positions, md_object.velocities, md_object.get_energy()))
+            return states
+
+        expected = advance(MDobj)
+        # the restored object must not repeat the timing run of the cutoffs
+        monkeypatch.setattr(coulomb, 'compute_optimal_cutoff', lambda *args: 1 / 0)
+        restored = md.from_checkpoint(''.join([path, "\\checkpoint.npz"]))
+        monkeypatch.undo()
+        assert restored.n_steps == 4
+        assert (restored.r_cut_coulomb, restored.k_cut, restored.std) == (MDobj.r_cut_coulomb, MDobj.k_cut, MDobj.std)
+        for (positions, velocities, energy), (positions_2, velocities_2, energy_2) in zip(expected, advance(restored)):
+            assert np.array_equal(positions, positions_2), "the restored run is not bit for bit identical"
+            assert np.array_equal(velocities, velocities_2)
+            assert energy == energy_2
+        assert restored.verlet_LJ.n_builds == MDobj.verlet_LJ.n_builds
+
+    # get_traj of the run restored after a crash continues the output files of the crashed run
+    MDobj = _small_md(p_rea=0.2)
+    reference = copy.deepcopy(MDobj)
+    state = np.random.get_state()
+    reference_path = str(tmp_path / 'reference')
+    reference.get_traj(8, 1, 2, 2, reference_path)
+    np.random.set_state(state)
+    propagate = MDobj.propagte_system
+    steps = []
+
+    def crashing():
+        if len(steps) == 6:
+            raise KeyboardInterrupt
+        steps.append(1)
+        return propagate()
+
+    MDobj.propagte_system = crashing
+    path = str(tmp_path / 'crashed')
+    with pytest.raises(KeyboardInterrupt):
+        MDobj.get_traj(8, 1, 2, 2, path, checkpoint_save=4)
+    assert np.array_equal(trajectory_reader(path + '\\traj.bin').steps, [0, 2, 4, 6])
+    restored = md.from_checkpoint(''.join([path, "\\checkpoint.npz"]))
+    restored.get_traj(4, 1, 2, 2, path, checkpoint_save=4)
+    traj, reference_traj = trajectory_reader(path + '\\traj.bin'), trajectory_reader(reference_path + '\\traj.bin')
+    assert np.array_equal(traj.steps, [0, 2, 4, 6, 8]) and np.array_equal(traj[:], reference_traj[:])
+    for name in ('\\Energies', '\\Temperature', '\\rdf'):
+        assert open(path + name).read() == open(reference_path + name).read(), name
+
+
+def test_md_workers_close_and_copy():
+    with _small_md(n_workers=2, k_workers=2) as MDobj:
+        Forces = MDobj.forces
+        assert MDobj.parallel_pair_engine.pool is not None and MDobj.coulomb.structure_factor.pool is not None
+        # copies start their own pools
+        replica = copy.deepcopy(MDobj)
+        assert replica.parallel_pair_engine.pool is None and replica.coulomb.structure_factor.pool is None
+        replica.positions = replica.positions.copy()
+        assert np.array_equal(replica.get_forces(), Forces)
+        replica.close()
+        restored = pickle.loads(pickle.dumps(MDobj))
+        restored.positions = restored.positions.copy()
+        assert np.array_equal(restored.get_forces(), Forces)
+        restored.close()
+    assert MDobj.parallel_pair_engine.pool is None and MDobj.coulomb.structure_factor is None
+    assert MDobj.parallel_pair_engine.shared.blocks == {}
+
+
 def test_SymmetriesPotC():
     # tests coulomb potential function with equidistant charges where the middle one has twice the negativ charge
     potential = coulomb(ip.n_boxes_short_range, ip.L, ip.p)
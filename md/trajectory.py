@@ -0,0 +1,603 @@
+'''
+Binary trajectory files
+
+A trajectory file starts with a fixed header (see _HEADER), followed by the
+species index of every particle (int32) and the table of the chemical symbols
+(16 bytes each). Then come the frames, every frame is the step number (int64)
+and the positions (float32, N x 3). The file grows in blocks of frames, the
+number of valid frames is kept in the header.
+
+trajectory_reader (binary files) and xyz_reader (XYZ files) give lazy random
+access to the frames, see open_trajectory.
+
+hdf5_writer and hdf5_reader store positions, velocities, forces and scalar
+series (energies, temperatures) together in chunked, optionally compressed
+HDF5 datasets, they need h5py.
+'''
+import os
+import struct
+import operator
+import threading
+import queue
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+_MAGIC = b'MDTRAJ\x00\x01'
+# magic, number of frames, number of particles, number of symbols, box dimensions
+_HEADER = struct.Struct('<8sqii3d')
+
+
+def frame_dtype(N):
+    '''
+    Record of one frame of N particles.
+    '''
+    return np.dtype([('step', '<i8'), ('positions', '<f4', (N, 3))])
+
+
+def read_header(file_object):
+    '''
+    Reads the header of a trajectory file.
+
+    Returns
+    -------
+    n_frames : int
+    species : 1D int Array
+    symbols : 1D Array of str
+    L : 3x1 Array
+    offset : int
+        Position of the first frame in the file.
+    '''
+    file_object.seek(0)
+    magic, n_frames, N, n_symbols, Lx, Ly, Lz = _HEADER.unpack(file_object.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError('not a trajectory file')
+    species = np.frombuffer(file_object.read(4 * N), dtype='<i4').astype(int)
+    symbols = np.frombuffer(file_object.read(16 * n_symbols), dtype='S16').astype(str)
+    return n_frames, species, symbols, np.array([Lx, Ly, Lz]), _HEADER.size + 4 * N + 16 * n_symbols
+
+
+class trajectory_writer(object):
+    '''
+    Writes frames to a binary trajectory file, see the module docstring.
+
+    The file stays open for the whole run. write only copies the positions and
+    puts them into a queue, a writer thread collects the frames in a buffer of
+    buffer_frames frames and writes them with one call. The file is
+    preallocated in blocks of preallocate frames. The frame count in the header
+    is updated by flush and close, so after a crash the file holds all frames
+    up to the last flush.
+
+    Parameters
+    ----------
+    path : string
+        Name of the file.
+
+    species : 1D int Array
+        Species index of every particle, the third column of the labels.
+
+    symbols : 1D Array of str
+        Chemical symbol of every species.
+
+    L : 3x1 Array
+        Dimensions of the simulation box.
+
+    append : bool, optional
+        If True and the file exists, the frames are appended to it. The
+        particles have to be the same. Default is False, the file is replaced.
+
+    buffer_frames : int, optional
+        Number of frames written at once, default is 64.
+
+    preallocate : int, optional
+        Number of frames the file grows by, default is 1024.
+
+    queue_size : int, optional
+        Number of frames that can wait for the writer thread, write blocks if
+        the queue is full. Default is 256.
+    '''
+
+    def __init__(self, path, species, symbols, L, append=False, buffer_frames=64, preallocate=1024,
+                 queue_size=256):
+        species = np.asarray(species, dtype='<i4')
+        self.path = path
+        self.N = len(species)
+        self.dtype = frame_dtype(self.N)
+        self.buffer = np.zeros(buffer_frames, dtype=self.dtype)
+        self.n_buffered = 0
+        self.preallocate = preallocate
+        if append and os.path.exists(path):
+            self.file = open(path, 'r+b')
+            self.n_frames, old_species, symbols, L, self.offset = read_header(self.file)
+            if not np.array_equal(old_species, species):
+                self.file.close()
+                raise ValueError('the particles differ from the ones in ' + path)
+        else:
+            self.file = open(path, 'w+b')
+            symbols = np.asarray(symbols).astype('S16')
+            self.file.write(_HEADER.pack(_MAGIC, 0, self.N, len(symbols), *np.asarray(L, dtype=float)))
+            self.file.write(species.tobytes())
+            self.file.write(symbols.tobytes())
+            self.n_frames = 0
+            self.offset = self.file.tell()
+        self.capacity = self.n_frames
+        self.error = None
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    def write(self, positions, step=0):
+        '''
+        Queues a frame, the positions are copied.
+        '''
+        self.__check()
+        frame = np.zeros((), dtype=self.dtype)
+        frame['step'] = step
+        frame['positions'] = positions
+        self.queue.put(frame)
+        return
+
+    def flush(self):
+        '''
+        Waits until all queued frames are on disk and updates the header.
+        '''
+        self.__check()
+        self.queue.put('flush')
+        self.queue.join()
+        self.__check()
+        return
+
+    def truncate(self, step):
+        '''
+        Removes the frames after step, e.g. the frames a crashed run wrote after
+        its last checkpoint.
+        '''
+        self.flush()
+        if self.n_frames > 0:
+            frames = np.memmap(self.file, dtype=self.dtype, mode='r', offset=self.offset, shape=(self.n_frames,))
+            steps = np.array(frames['step'])
+            del frames
+            self.n_frames = int(np.searchsorted(steps, step, side='right'))
+            self.__write_count()
+        return
+
+    def close(self):
+        '''
+        Writes all queued frames, removes the preallocated space and closes the file.
+        '''
+        if self.file is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.file.truncate(self.offset + self.n_frames * self.dtype.itemsize)
+        self.file.close()
+        self.file = None
+        self.__check()
+        return
+
+    def __check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None or isinstance(item, str):
+                    self.__write_buffer()
+                    self.__write_count()
+                else:
+                    self.buffer[self.n_buffered] = item
+                    self.n_buffered += 1
+                    if self.n_buffered == len(self.buffer):
+                        self.__write_buffer()
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+            if item is None:
+                return
+
+    def __write_buffer(self):
+        if self.n_buffered == 0:
+            return
+        n_frames = self.n_frames + self.n_buffered
+        if n_frames > self.capacity:
+            self.capacity = n_frames + self.preallocate
+            self.file.truncate(self.offset + self.capacity * self.dtype.itemsize)
+        self.file.seek(self.offset + self.n_frames * self.dtype.itemsize)
+        self.file.write(self.buffer[:self.n_buffered].tobytes())
+        self.n_frames = n_frames
+        self.n_buffered = 0
+        return
+
+    def __write_count(self):
+        # the frame count follows the magic
+        self.file.seek(8)
+        self.file.write(struct.pack('<q', self.n_frames))
+        self.file.flush()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+
+class _frames(object):
+    '''
+    Lazy sequence of the frames of a trajectory file, subclasses provide
+    n_frames, names (symbol of every particle) and _read(indices).
+    Indexing with an int gives the N x 3 positions of one frame, a slice gives
+    an n x N x 3 Array of the selected frames only.
+    '''
+
+    def __len__(self):
+        return self.n_frames
+
+    @property
+    def shape(self):
+        return (self.n_frames, len(self.names), 3)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._read(np.arange(*index.indices(self.n_frames)))
+        index = operator.index(index)
+        if index < 0:
+            index += self.n_frames
+        if not 0 <= index < self.n_frames:
+            raise IndexError('frame %d of %d' % (index, self.n_frames))
+        return self._read(np.array([index]))[0]
+
+    def __iter__(self):
+        for n in range(self.n_frames):
+            yield self[n]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class trajectory_reader(_frames):
+    '''
+    Random access to the frames of a binary trajectory file (see
+    trajectory_writer) through np.memmap, only the requested frames are read.
+
+    Parameters
+    ----------
+    path : string
+
+    Attributes
+    ----------
+    n_frames : int
+    species : 1D int Array
+    symbols : 1D Array of str
+        Symbol of every species.
+    names : 1D Array of str
+        Symbol of every particle.
+    L : 3x1 Array
+    steps : 1D int Array
+        Step number of every frame.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as file_object:
+            self.n_frames, self.species, self.symbols, self.L, offset = read_header(file_object)
+        self.names = self.symbols[self.species]
+        dtype = frame_dtype(len(self.species))
+        if self.n_frames > 0:
+            self.frames = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(self.n_frames,))
+        else:
+            self.frames = np.zeros(0, dtype=dtype)
+        return
+
+    @property
+    def steps(self):
+        return np.array(self.frames['step'])
+
+    def _read(self, indices):
+        return np.array(self.frames['positions'][indices])
+
+
+class xyz_reader(_frames):
+    '''
+    Random access to the frames of an XYZ file. The file is scanned once for the
+    byte offsets of the frames, a frame is read by seeking to its offset.
+    Incomplete frames at the end of the file are ignored.
+
+    Parameters
+    ----------
+    path : string
+
+    Attributes
+    ----------
+    n_frames : int
+    names : 1D Array of str
+        Symbol of every particle, from the first frame.
+    offsets : 1D int Array
+        Byte offset of the first particle line of every frame.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        offsets = []
+        N = None
+        with open(path, 'rb') as file_object:
+            while True:
+                line = file_object.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                n_lines = int(line)
+                if N is None:
+                    N = n_lines
+                elif n_lines != N:
+                    raise ValueError('frames with %d and %d particles in %s' % (N, n_lines, path))
+                file_object.readline()
+                offset = file_object.tell()
+                complete = True
+                for p in range(N):
+                    if not file_object.readline():
+                        complete = False
+                        break
+                if complete and N > 0:
+                    offsets.append(offset)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.n_frames = len(offsets)
+        self.names = np.array([], dtype=str)
+        if self.n_frames > 0:
+            self.names = self.__read_frame(self.offsets[0], N)[0]
+        return
+
+    def __read_frame(self, offset, N):
+        with open(self.path, 'rb') as file_object:
+            file_object.seek(offset)
+            fields = [file_object.readline().split() for p in range(N)]
+        names = np.array([f[0].decode() for f in fields])
+        positions = np.array([f[1:4] for f in fields], dtype=np.float32)
+        return names, positions
+
+    def _read(self, indices):
+        N = len(self.names)
+        positions = np.zeros((len(indices), N, 3), dtype=np.float32)
+        for n, index in enumerate(indices):
+            positions[n] = self.__read_frame(self.offsets[index], N)[1]
+        return positions
+
+
+def _compression(compression, level, shuffle):
+    '''
+    Keyword arguments of h5py create_dataset for the compression filters.
+    '''
+    if compression is None:
+        return {'shuffle': shuffle}
+    if compression == 'lz4':
+        if hdf5plugin is None:
+            raise ImportError('lz4 compression needs hdf5plugin')
+        return dict(hdf5plugin.LZ4(), shuffle=shuffle)
+    if compression not in ('gzip', 'lzf'):
+        raise ValueError('Unknown compression: ' + str(compression))
+    return {'compression': compression, 'compression_opts': level if compression == 'gzip' else None,
+            'shuffle': shuffle}
+
+
+class hdf5_writer(object):
+    '''
+    Writes a trajectory to an HDF5 file (needs h5py).
+
+    Every frame appends to the datasets 'step', 'positions' and, if given,
+    'velocities' and 'forces' (n_frames x N x 3), which are chunked by
+    chunk_frames frames. Series like energies, temperatures and radial
+    distributions, saved at their own intervals, go to the datasets name and
+    name + '_step'. The metadata (Symbols, labels, L, dt, std, cutoffs, ...)
+    are stored as attributes of the file.
+
+    Parameters
+    ----------
+    path : string
+
+    metadata : dictionary, optional
+        Attributes of the file, see md.get_metadata.
+
+    compression : None, 'gzip', 'lzf' or 'lz4', optional
+        Compression filter of the datasets, 'lz4' needs hdf5plugin. Default is 'gzip'.
+
+    level : int, optional
+        Level of the gzip compression, default is 4.
+
+    shuffle : bool, optional
+        If True (default), the shuffle filter is applied before the compression.
+
+    chunk_frames : int, optional
+        Number of frames per chunk, default is 1.
+
+    dtype : numpy dtype, optional
+        Type of the positions, velocities and forces, default is float32.
+
+    append : bool, optional
+        If True and the file exists, the frames are appended. Default is False,
+        the file is replaced.
+    '''
+
+    def __init__(self, path, metadata=None, compression='gzip', level=4, shuffle=True, chunk_frames=1,
+                 dtype=np.float32, append=False):
+        if h5py is None:
+            raise ImportError('hdf5_writer needs h5py')
+        self.file = h5py.File(path, 'a' if append else 'w')
+        self.filters = _compression(compression, level, shuffle)
+        self.chunk_frames = chunk_frames
+        self.dtype = dtype
+        for key, value in (metadata or {}).items():
+            if isinstance(value, np.ndarray) and value.dtype.kind == 'U':
+                value = value.astype('S')
+            self.file.attrs[key] = value
+        return
+
+    def __append(self, name, value, dtype):
+        value = np.asarray(value, dtype=dtype)
+        if name not in self.file:
+            self.file.create_dataset(name, shape=(0,) + value.shape, maxshape=(None,) + value.shape, dtype=dtype,
+                                     chunks=(self.chunk_frames,) + value.shape, **self.filters)
+        dataset = self.file[name]
+        dataset.resize(dataset.shape[0] + 1, axis=0)
+        dataset[-1] = value
+        return
+
+    def write(self, positions, step=0, velocities=None, forces=None):
+        '''
+        Appends a frame.
+        '''
+        self.__append('step', step, np.int64)
+        self.__append('positions', positions, self.dtype)
+        if velocities is not None:
+            self.__append('velocities', velocities, self.dtype)
+        if forces is not None:
+            self.__append('forces', forces, self.dtype)
+        return
+
+    def append(self, name, step, value):
+        '''
+        Appends value, a number or an array, to the series name, e.g. 'energies' or 'rdf'.
+        '''
+        self.__append(name + '_step', step, np.int64)
+        self.__append(name, value, np.float64)
+        return
+
+    def truncate(self, step):
+        '''
+        Removes the frames and the entries of the series after step, e.g. the
+        output a crashed run wrote after its last checkpoint.
+        '''
+        for name in list(self.file):
+            if name == 'step' or name.endswith('_step'):
+                n = int(np.searchsorted(self.file[name][:], step, side='right'))
+                data = ('positions', 'velocities', 'forces') if name == 'step' else (name[:-len('_step')],)
+                for dataset in (name,) + data:
+                    if dataset in self.file:
+                        self.file[dataset].resize(n, axis=0)
+        return
+
+    def flush(self):
+        self.file.flush()
+        return
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+
+class hdf5_reader(_frames):
+    '''
+    Partial reads of an HDF5 trajectory written by hdf5_writer (needs h5py).
+    Indexing gives the positions, like trajectory_reader.
+
+    Parameters
+    ----------
+    path : string
+
+    Attributes
+    ----------
+    n_frames : int
+    metadata : dictionary
+        Attributes of the file.
+    names : 1D Array of str
+        Symbol of every particle, if Symbols and labels are in the metadata.
+    '''
+
+    def __init__(self, path):
+        if h5py is None:
+            raise ImportError('hdf5_reader needs h5py')
+        self.file = h5py.File(path, 'r')
+        self.metadata = {}
+        for key, value in self.file.attrs.items():
+            if isinstance(value, np.ndarray) and value.dtype.kind == 'S':
+                value = value.astype(str)
+            self.metadata[key] = value
+        self.n_frames = self.file['positions'].shape[0] if 'positions' in self.file else 0
+        if 'Symbols' in self.metadata and 'labels' in self.metadata:
+            self.names = self.metadata['Symbols'][self.metadata['labels'][:, 2].astype(int)]
+        else:
+            self.names = np.array([''] * (self.file['positions'].shape[1] if self.n_frames else 0))
+        return
+
+    def read(self, name, index=slice(None)):
+        '''
+        Reads only the selected entries of a dataset, e.g. read('velocities', slice(100, 200)).
+        '''
+        return self.file[name][index]
+
+    def _read(self, indices):
+        if len(indices) == 0:
+            return np.zeros((0,) + self.shape[1:], dtype=self.file['positions'].dtype)
+        # h5py needs increasing indices
+        if np.all(np.diff(indices) > 0):
+            return self.file['positions'][indices]
+        unique, inverse = np.unique(indices, return_inverse=True)
+        return self.file['positions'][unique][inverse]
+
+    def close(self):
+        self.file.close()
+        return
+
+
+def open_trajectory(path):
+    '''
+    trajectory_reader for binary trajectory files, hdf5_reader for HDF5 files,
+    xyz_reader otherwise.
+    '''
+    with open(path, 'rb') as file_object:
+        magic = file_object.read(len(_MAGIC))
+    if magic == _MAGIC:
+        return trajectory_reader(path)
+    if magic == b'\x89HDF\r\n\x1a\n':
+        return hdf5_reader(path)
+    return xyz_reader(path)
+
+
+def export_xyz(path, xyz_path, frames=slice(None)):
+    '''
+    Converts (a slice of) a binary or HDF5 trajectory file to the XYZ format for visualization.
+
+    Parameters
+    ----------
+    path : string
+        Binary or HDF5 trajectory file, see open_trajectory.
+
+    xyz_path : string
+        Name of the XYZ file.
+
+    frames : slice, optional
+        Frames to export, default is all.
+    '''
+    trajectory = open_trajectory(path)
+    names = trajectory.names.astype(object)
+    N = len(names)
+    with open(xyz_path, 'w') as xyz:
+        for n in range(*frames.indices(len(trajectory))):
+            xyz.write('%d\n\n' % N)
+            positions = trajectory[n]
+            xyz.write(''.join('%s %.8f %.8f %.8f\n' % (names[p], positions[p, 0], positions[p, 1], positions[p, 2])
+                              for p in range(N)))
+    return
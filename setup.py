@@ -64,4 +64,6 @@ setup(
     license='GPLv3+',
     packages=['md'],
     #install_requires=['numpy>=1.7.0', 'cython>=0.22'],
+    # HDF5 trajectories (trajectory.hdf5_writer), lz4 compression needs hdf5plugin
+    extras_require={'hdf5': ['h5py'], 'lz4': ['h5py', 'hdf5plugin']},
     tests_require=['pytest'])